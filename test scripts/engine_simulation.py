@@ -4,17 +4,23 @@ Created on Mon Aug 28 17:16:12 2023
 
 @author: Washu
 
+The physics is in visualiser/engine_model.py (engine_batch), which runs headless,
+EngineSim draws one engine with pygame, which is only needed to run this as a viewer,
+and is imported (by init_viewer) the first time an EngineSim is given a surface or drawn.
+The parts that don't move (flywheel, cylinder) are drawn once to a background, which each frame starts from,
+and the physics is stepped at sim_rate by the time each frame took, however fast frames are drawn.
+
 todo:
     draw cylinder head
-    simulate
 """
 
-
-import pygame as pg
-import pygame.gfxdraw as draw
-
+import os
+import sys
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'visualiser'))
+from engine_model import engine_batch, POWER_STROKE, INTAKE_STROKE, COMP_STROKE, EXHAUST_STROKE
+
 
 W =  1280
 H = 720
@@ -23,26 +29,34 @@ CY = H//2
 C = np.array([CX,CY])
 S = np.array([1,-1])
 
-pg.init()
-screen = pg.display.set_mode((W, H))
-clock = pg.time.Clock()
-running = True
 fps = 60
-dt = 0
 
-font = pg.font.Font('freesansbold.ttf', 32)
 text_colour = (255,255,255)
 
+#pygame and pygame.gfxdraw, set by init_viewer
+pg = None
+draw = None
+
 
+#import pygame for drawing, if it hasn't been already
+def init_viewer():
+    global pg, draw
+    if pg is None:
+        import pygame
+        import pygame.gfxdraw
+        pg, draw = pygame, pygame.gfxdraw
+    if not pg.font.get_init():
+        pg.font.init()
 
 
 class EngineSim:
-    INTAKE_STROKE = 0
-    COMP_STROKE = 1
-    POWER_STROKE = 2
-    EXHAUST_STROKE = 3
+    INTAKE_STROKE = INTAKE_STROKE
+    COMP_STROKE = COMP_STROKE
+    POWER_STROKE = POWER_STROKE
+    EXHAUST_STROKE = EXHAUST_STROKE
     
-    def __init__(self, sim_rate=1000, bore=100, piston_height=80, stroke_len=50, rod_length=200, comp_ratio=8, flywheel_dia=100, flywheel_moi=1, cyl_angle=45, ):
+    #flywheel_moi is in kg.m2, the geometry is in pixels (only its ratios matter to the physics)
+    def __init__(self, sim_rate=2000, bore=100, piston_height=80, stroke_len=50, rod_length=200, comp_ratio=8, flywheel_dia=100, flywheel_moi=0.05, cyl_angle=45, ):
         self.sim_rate = sim_rate
         self.bore = bore
         self.piston_height = piston_height
@@ -53,28 +67,31 @@ class EngineSim:
         self.flywheel_moi = flywheel_moi
         self.crank_pin_dia = 2
         
-        self.shaft_angle = 0
         self.cam_angle = 0
         self.line_colour=(200,200,200)
         self.fill_colour=(10,10,200)
         
-        self.do_sim = False
-        self.throttle = 0
-        self.cycle_pos = 0
-        self.stroke = self.INTAKE_STROKE
-        self.SIM_SHAFT_DRAG_Nms_rad = 0.1
-        self.SIM_IMPULSE_MAX = 1
-        self.SIM_IMPULSE_MIN = self.SIM_IMPULSE_MAX*0.1
+        self.background_colour = "dark blue"
+        
+        self.do_sim = True
+        self.throttle = 0.5
+        self.sim_time = 0   #time not yet simulated (s), less than one step
+        self.max_frame_time = 0.1   #most time simulated per frame (s), a longer frame is dropped rather than caught up on
         
-        self.angular_rate = 0.01*(np.pi*0.05)
+        #the physics of this engine, the crank pin is stroke_len from the shaft
+        self.core = engine_batch(1, sim_rate, throttle=self.throttle, crank_radius=stroke_len, rod_length=rod_length,
+                                 comp_ratio=comp_ratio, inertia=flywheel_moi)
         
         self.cyl_angle = np.radians(cyl_angle)
         
         self.srf = None
+        self.background = None
+        self.font = None
         
         self.make_piston()
         self.make_cylinder()
         #self.make_head()
+        self.make_static()
         
     def make_piston(self):
         side = self.bore/2
@@ -102,6 +119,33 @@ class EngineSim:
                           
         self.cylinder_lines = lines
 
+    #the rotation of the cylinder axis, and the parts that don't move, in screen coordinates
+    def make_static(self):
+        c,s = np.cos(self.cyl_angle), np.sin(self.cyl_angle)
+        self.cyl_rot = np.array([[c,-s],[s,c]])
+        self.centre_screen = self.screen_tx(np.array([0,0]))
+        self.cylinder_screen = self.screen_tx(self.cylinder_tx(self.cylinder_lines))
+        self.background = None
+        
+    #draw the parts that don't move to a surface the size of srf, to start each frame from
+    def make_background(self, srf):
+        self.init_drawing()
+        self.background = pg.Surface(srf.get_size())
+        self.background.fill(self.background_colour)
+        #flywheel and shaft
+        draw.aacircle(self.background, self.centre_screen[0], self.centre_screen[1], int(self.flywheel_dia), self.line_colour)
+        #cylinder walls
+        self.draw_lines(self.cylinder_screen, self.background)
+
+    #crank angle, 0 to 4 pi, 0 is top dead centre at the start of the intake stroke
+    @property
+    def shaft_angle(self):
+        return self.core.angle[0]
+    
+    @property
+    def stroke(self):
+        return self.core.stroke[0]
+    
     #transform system coordinate to screen coordinate, and cast to int
     def screen_tx(self, vector):
         return ((vector*S)+C).astype(np.int32)
@@ -114,7 +158,7 @@ class EngineSim:
     
     #rotate a vector by cyl_angle
     def cylinder_tx(self, vector):
-        return self.rotate(vector, self.cyl_angle)
+        return np.dot(vector, self.cyl_rot)
     
     #get the crank pin position relative to the cylinder axis
     def crank_pin_pos(self):
@@ -124,21 +168,28 @@ class EngineSim:
         #return np.array([np.cos(angle),np.sin(angle)]) * self.stroke_len
     
     #get the piston pin position relative to the cylinder axis
-    def piston_pin_pos(self):
+    def piston_pin_pos(self, crank_pin=None):
         #crank pin pos relative to cyl axis
-        rx,y1 = self.crank_pin_pos()
+        rx,y1 = self.crank_pin_pos() if crank_pin is None else crank_pin
         #piston position relative to y1
         y2 = np.sqrt(np.square(self.rod_length) - np.square(rx))
         return np.array([0,y1+y2])
     
+    #pygame, and the font for the text
+    def init_drawing(self):
+        init_viewer()
+        if self.font is None:
+            self.font = pg.font.Font('freesansbold.ttf', 32)
+
     def set_surface(self, srf):
+        self.init_drawing()
         self.srf = srf
         
     def print_line(self, text, srf=None):
         if srf is None:
             srf = self.srf
         text = str(text)
-        text = font.render(text, True, text_colour)
+        text = self.font.render(text, True, text_colour)
         textRect = text.get_rect()
         #print(textRect[3])
         textRect.move_ip(10,textRect[3]*self.text_line_no)
@@ -149,7 +200,6 @@ class EngineSim:
     def draw_lines(self, lines, srf=None):
         if srf is None:
             srf = self.srf
-        print(lines.shape)
         for n in range(lines.shape[0]//2):
             m = n*2
             draw.line(srf, lines[m][0], lines[m][1], lines[m+1][0], lines[m+1][1], self.line_colour)
@@ -158,41 +208,36 @@ class EngineSim:
         if srf is None:
             srf = self.srf
         
+        #flywheel, shaft and cylinder walls
+        if self.background is None or self.background.get_size() != srf.get_size():
+            self.make_background(srf)
+        srf.blit(self.background, (0,0))
         
-        #flywheel and shaft
-        pos_w = self.screen_tx(np.array([0,0]))
-        draw.aacircle(srf, pos_w[0], pos_w[1], int(self.flywheel_dia), self.line_colour)
-        
-        draw.aacircle(srf, pos_w[0], pos_w[1], int(self.flywheel_dia), self.line_colour)
+        #the moving parts, transformed together: crank pin, piston pin and piston
+        pos_c_a = self.crank_pin_pos()
+        pos_p_a = self.piston_pin_pos(pos_c_a)
+        points = self.screen_tx(self.cylinder_tx(np.vstack((pos_c_a, pos_p_a, self.piston_lines + pos_p_a))))
+        pos_c, pos_p, lines_p = points[0], points[1], points[2:]
         
         #crank pin
-        pos_c_a = self.crank_pin_pos()
-        pos_c = self.screen_tx(self.cylinder_tx(pos_c_a))
         draw.aacircle(srf, pos_c[0], pos_c[1], int(self.crank_pin_dia), self.line_colour)
         
         #piston pin
-        pos_p_a = self.piston_pin_pos()
-        pos_p_b = self.cylinder_tx(pos_p_a)
-        pos_p = self.screen_tx(pos_p_b)
         draw.aacircle(srf, pos_p[0], pos_p[1], int(self.crank_pin_dia), self.line_colour)
         
         #piston
-        lines_p = self.piston_lines + pos_p_a
-        lines_p = self.cylinder_tx(lines_p)
-        lines_p = self.screen_tx(lines_p)
         draw.aapolygon(srf,lines_p,self.line_colour)
         
         #connecting rod
         draw.line(srf,pos_c[0],pos_c[1],pos_p[0],pos_p[1],self.line_colour)
-        
-        #cylinder walls
-        self.draw_lines(self.screen_tx(self.cylinder_tx(self.cylinder_lines)))
 
         
         #debug text
         self.text_line_no = 0
-        self.print_line(f"Shaft Angle:   {np.degrees(self.shaft_angle).round().astype(np.int32):03.0f}")
-        self.print_line(f"Piston Pos(sys):   {pos_p_a[0]:.3f}, {pos_p_a[1]:.3f}")
+        self.print_line(f"Shaft Angle:   {np.degrees(self.shaft_angle).round().astype(np.int32):03.0f}", srf)
+        self.print_line(f"Piston Pos(sys):   {pos_p_a[0]:.3f}, {pos_p_a[1]:.3f}", srf)
+        self.print_line(f"Speed (rpm):   {self.core.rpm[0]:.0f}", srf)
+        self.print_line(f"Throttle:   {self.throttle:.2f}", srf)
         #self.print_line(f"Piston Pos(cyl):   {pos_p_b[0]:.3f}, {pos_p_b[1]:.3f}")
         #self.print_line(f"Piston Pos(scr):   {pos_p[0]:.3f}, {pos_p[1]:.3f}")
         #length = np.sqrt(np.sum(np.square(pos_c_a - pos_p_a)))
@@ -200,76 +245,49 @@ class EngineSim:
         
     def set_throttle(self, throttle):
         self.throttle = throttle #0-1
+        self.core.set_throttle(throttle)
         
+    #advance the simulation by dt seconds, in fixed steps of 1/sim_rate
+    #the part of dt left over is carried on to the next call, and at most max_frame_time is simulated,
+    #so a frame that took too long (eg. the window being dragged) is skipped rather than leaving the physics behind
     def simulate(self, dt):
-        if dt==0:
+        if dt<=0:
             return
+        self.sim_time += min(dt, self.max_frame_time)
+        steps = int(self.sim_time * self.sim_rate)
+        self.sim_time -= steps / self.sim_rate
         
-        if self.do_sim:
-          #simulation
-          
-          #torque applied to the shaft this timestep
-          total_torque_Nm = 0
-          #effect of drag over the last rotation
-          total_torque_Nm -= self.SIM_SHAFT_DRAG_Nms_rad * self.angular_rate * dt
-      
-          
-          # check which part of the cycle we're in
-          cycle_pos = (self.shaft_angle/(4*np.pi))
-          
-          stroke = int(cycle_pos * 4)
-          top = self.rod_length + self.stroke + (self.piston_height/2)
-          piston_pos = (top - piston_pin_pos()[1]) / self.stroke_len
-          
-          
-          if stroke == self.INTAKE_STROKE:
-            if not self.stroke != stroke:
-                self.charge = ((self.SIM_IMPULSE_MAX-self.SIM_IMPULSE_MIN)* self.throttle) + self.SIM_IMPULSE_MIN
-            
-          if stroke == self.POWER_STROKE:
-            
-            #apply power - force applied to piston is the initial charge energy times the expansion ratio
-            force = self.charge * (piston_pos + 1/self.comp_ratio)
-            
-            #torque is the force transformed by the rod and
-            # multiplied by the crank lever arm length
-    
-            total_torque_Nm += power;
-            
-      
-          #apply the torque to the flywheel
-          engine_speed_rads += total_torque_Nm * (1/SIM_MASS_kgm2) * time_s;
-        else:
-          float new_speed = US_TO_RADS(lerp(SIM_RPM_MIN_us, SIM_RPM_MAX_us, servo_pos));
-          engine_speed_rads = lerp(engine_speed_rads, new_speed, NO_SIM_LAG);
-      
-        
-        self.shaft_angle = np.mod((self.shaft_angle + dt*self.angular_rate),4*np.pi)
-        
-        self.stroke = stroke
+        #without the simulation, the shaft just turns at the speed it is at
+        self.core.run(steps, physics=self.do_sim)
         
         
 
-engine = EngineSim()
-engine.set_surface(screen)
+if __name__ == "__main__":
+    init_viewer()
+    pg.init()
+    screen = pg.display.set_mode((W, H))
+    clock = pg.time.Clock()
+    running = True
+    dt = 0
 
-while running:
-    # poll for events
-    # pg.QUIT event means the user clicked X to close your window
-    for event in pg.event.get():
-        if event.type == pg.QUIT:
-            running = False
+    engine = EngineSim()
+    engine.set_surface(screen)
 
-    # fill the screen with a color to wipe away anything from last frame
-    screen.fill("dark blue")
+    while running:
+        # poll for events
+        # pg.QUIT event means the user clicked X to close your window
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                running = False
 
-    # RENDER YOUR GAME HERE
-    engine.simulate(fps)
-    engine.draw()
-    
-    # flip() the display to put your work on screen
-    pg.display.flip()
+        # the physics catches up with the time the last frame took, then the frame is drawn over the background
+        engine.simulate(dt/1000)
+        engine.draw()
+        engine.print_line(f"FPS:   {clock.get_fps():.0f}")
+        
+        # flip() the display to put your work on screen
+        pg.display.flip()
 
-    dt = clock.tick(fps)  # limits FPS to 60
+        dt = clock.tick(fps)  # limits FPS to 60
 
-pg.quit()
\ No newline at end of file
+    pg.quit()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:40:00 2026
+
+The PWL log2/pow2 mapping between pid parameter space and UI screen (slider) space, as numpy array operations,
+for every configuration of the LOG_* macros (PID.h) at once.
+
+k_to_px and px_to_k are pid_convert_k_to_px and pid_convert_px_to_k (PID.ino) on whole arrays,
+with the C types of the AVR (int and unsigned int are 16 bits) wrapped as the firmware would, so they match it to the bit.
+log-exp_validation.py checks one configuration a value at a time; this works through the grid of
+(LOG_PAR_BITS, LOG_SCR_BITS, LOG_PAR_MIN_BITS), every input of each, and for each configuration reports
+    the screen range (the px of the largest parameter, which the slider has to cover)
+    the round trip error, parameter -> screen -> parameter (% of the parameter) and screen -> parameter -> screen (px)
+    the number of parameters (from LOG_PAR_MIN) that come back as 0, as the smallest maps to LOG_SCR_MIN, which is taken as 0
+        (these are left out of the max parameter round trip error, which they would always make 100%, but not the mean)
+    the error of the screen value against log2 (px)
+    the number of inputs that would shift by a negative amount, which is undefined in C
+Chunks of configurations are worked out together (one row of each array per configuration),
+and the chunks are spread over a process pool.
+
+usage: python log_exp_sweep.py [--par-bits N ...] [--scr-bits N ...] [--fit PX] [--defined] [--sort COLUMN] [--top N] [--processes N] [--check]
+
+@author: AlexT-38
+"""
+
+import sys
+import time
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+#PID.h
+LOG_PAR_MIN_BITS = 4
+LOG_PAR_BITS = 16
+LOG_SCR_BITS = 8
+LOG_SLIDER_PX_RANGE = 174       #screen_pid_rpm.ino
+
+UINT16 = 0xffff
+CHUNK_SIZE = 32                 #configurations worked out together
+COLUMNS = ['px_max', 'k_max', 'k_mean', 'zeroed', 'px_err', 'px_mean', 'log_err', 'undefined']
+
+
+#the LOG_* macros of a configuration, each an array if the bits are
+def log_macros(par_bits=LOG_PAR_BITS, scr_bits=LOG_SCR_BITS, par_min_bits=LOG_PAR_MIN_BITS):
+    par_bits = np.asarray(par_bits, np.int64)
+    scr_bits = np.asarray(scr_bits, np.int64)
+    par_min_bits = np.asarray(par_min_bits, np.int64)
+    m = {'PAR_BITS': par_bits, 'SCR_BITS': scr_bits, 'PAR_MIN_BITS': par_min_bits}
+    m['PAR_LIM'] = 1 << par_bits
+    m['PAR_MAX'] = np.where(par_bits == 16, UINT16, m['PAR_LIM'] - 1)
+    m['SCR_LIM'] = 1 << scr_bits
+    m['SCR_MAX'] = m['SCR_LIM'] - 1
+    m['STEP_BITS'] = scr_bits - 4
+    m['STEP'] = 1 << m['STEP_BITS']
+    m['SCR_MIN'] = (m['SCR_LIM'] * par_min_bits) // par_bits
+    m['PAR_MIN'] = 1 << par_min_bits
+    m['WH_OFFSET'] = m['STEP_BITS'] - 2
+    return m
+
+#a signed 16 bit int (AVR int), from int64 values
+def int16(values):
+    return ((values + (1 << 15)) & UINT16) - (1 << 15)
+
+#number of bits in each (non negative) value, 0 for 0
+def bit_length(values):
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64)
+
+
+#pid_convert_k_to_px, parameter space (unsigned int) to screen space (int)
+#returns (px, undefined), undefined is True where the firmware would shift by -1
+def k_to_px(k, m):
+    k = np.asarray(k, np.int64) & UINT16
+    n = bit_length(k >> m['STEP_BITS'])
+    defined = k >= m['PAR_MIN']
+    undefined = defined & (n == 0)
+    frac = k >> np.maximum(n - 1, 0)
+    whole = (m['WH_OFFSET'] + n) * m['STEP']
+    px = int16(whole + frac)
+    px = np.where(px <= m['SCR_MIN'], 0, px - m['SCR_MIN'])
+    return np.where(defined, px, 0), undefined
+
+#pid_convert_px_to_k, screen space (int) to parameter space (unsigned int)
+#returns (k, undefined), undefined is True where the firmware would shift by a negative (wrapped byte) amount
+def px_to_k(px, m):
+    px = int16(int16(np.asarray(px, np.int64)) + m['SCR_MIN'])
+    inside = (px > m['SCR_MIN']) & (px <= m['SCR_MAX'])
+    whole = (px // m['STEP']) & 0xff
+    frac = (px % m['STEP']) & 0xff
+    shift = whole - m['STEP_BITS']
+    undefined = inside & (shift < 0)
+    k = ((frac + m['STEP']) << np.clip(shift, 0, 15)) & UINT16
+    k = np.where(px > m['SCR_MAX'], m['PAR_MAX'] & UINT16, k)
+    return np.where(px > m['SCR_MIN'], k, 0), undefined
+
+
+#the columns of each of a chunk of configurations, (par_bits, scr_bits, par_min_bits) each
+def run_chunk(configs):
+    configs = np.asarray(configs, np.int64)
+    m = log_macros(*(configs[:, [n]] for n in range(3)))   #a row per configuration
+
+    #every parameter the firmware could be given, and every px that maps into the parameter range
+    k = np.arange(1 << 16)[None, :]
+    k_in = (k >= m['PAR_MIN']) & (k <= m['PAR_MAX'])
+    px_k, undefined_k = k_to_px(k, m)
+    k_px_k, undefined_kpk = px_to_k(px_k, m)
+    px = np.arange(1 << configs[:, 1].max())[None, :]
+    px_in = px <= (m['SCR_MAX'] - m['SCR_MIN'])
+    k_px, undefined_px = px_to_k(px, m)
+    px_k_px, undefined_pkp = k_to_px(k_px, m)
+
+    undefined = (undefined_k | undefined_kpk) & k_in
+    undefined_p = (undefined_px | undefined_pkp) & px_in
+    k_ok = k_in & ~undefined
+    px_ok = px_in & ~undefined_p
+    def stats(errors, ok):
+        count = np.maximum(ok.sum(axis=1), 1)
+        return np.where(ok, errors, 0).max(axis=1), np.where(ok, errors, 0).sum(axis=1) / count
+
+    #the max leaves out the parameters that come back as 0 (which are counted), the mean doesn't
+    zeroed = k_ok & (k_px_k == 0)
+    k_errors = 100 * np.abs(k_px_k - k) / np.maximum(k, 1)
+    k_err, _ = stats(k_errors, k_ok & ~zeroed)
+    _, k_mean = stats(k_errors, k_ok)
+    px_err, px_mean = stats(np.abs(px_k_px - px), px_ok)
+    with np.errstate(divide='ignore'):
+        log_err, _ = stats(np.abs(px_k - (np.log2(k) * m['STEP'] - m['SCR_MIN'])), k_ok & (px_k > 0))
+    px_max = np.where(k_ok, px_k, 0).max(axis=1)
+    return np.column_stack((px_max, k_err, k_mean, zeroed.sum(axis=1), px_err, px_mean, log_err, undefined.sum(axis=1) + undefined_p.sum(axis=1)))
+
+#work out the columns of every configuration, a chunk at a time over processes
+def sweep(configs, processes=None, chunk_size=CHUNK_SIZE):
+    chunks = [configs[n:n+chunk_size] for n in range(0, len(configs), chunk_size)]
+    if processes == 1 or len(chunks) < 2:
+        results = [run_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(run_chunk, chunks))
+    return np.concatenate(results) if results else np.zeros((0, len(COLUMNS)))
+
+#the grid of configurations, (par_bits, scr_bits, par_min_bits), par_min_bits is every value below par_bits
+def config_grid(par_bits, scr_bits):
+    return [(p, s, n) for p, s in itertools.product(par_bits, scr_bits) for n in range(p)]
+
+
+#pid_convert_k_to_px as the firmware does it, one value at a time, to check k_to_px against
+def k_to_px_ref(val_lin, par_bits=LOG_PAR_BITS, scr_bits=LOG_SCR_BITS, par_min_bits=LOG_PAR_MIN_BITS):
+    m = {name: int(value) for name, value in log_macros(par_bits, scr_bits, par_min_bits).items()}
+    val_log = 0
+    if val_lin >= m['PAR_MIN']:
+        base = val_lin >> m['STEP_BITS']
+        n = 0
+        while base:
+            n += 1
+            base >>= 1
+        frac = val_lin >> (n - 1)
+        whole = (m['WH_OFFSET'] + n) * m['STEP']
+        val_log = whole + frac
+        if val_log <= m['SCR_MIN']:
+            val_log = 0
+        else:
+            val_log -= m['SCR_MIN']
+    return val_log
+
+#pid_convert_px_to_k, one value at a time
+def px_to_k_ref(val_log, par_bits=LOG_PAR_BITS, scr_bits=LOG_SCR_BITS, par_min_bits=LOG_PAR_MIN_BITS):
+    m = {name: int(value) for name, value in log_macros(par_bits, scr_bits, par_min_bits).items()}
+    val_lin = 0
+    val_log += m['SCR_MIN']
+    if val_log > m['SCR_MIN']:
+        if val_log > m['SCR_MAX']:
+            val_lin = m['PAR_MAX']
+        else:
+            whole = (val_log // m['STEP']) & 0xff
+            frac = (val_log % m['STEP']) & 0xff
+            shift = (whole - m['STEP_BITS']) & 0xff
+            val_lin = int16((frac + m['STEP']) << shift)
+    return val_lin & UINT16
+
+#check the vectorised conversions against the step by step ones, for every input of the firmware's configuration
+def check(par_bits=LOG_PAR_BITS, scr_bits=LOG_SCR_BITS, par_min_bits=LOG_PAR_MIN_BITS):
+    m = log_macros(par_bits, scr_bits, par_min_bits)
+    k = np.arange(1 << 16)
+    px = np.arange(-(1 << 10), 1 << 11)
+    px_fast, undefined = k_to_px(k, m)
+    k_fast, undefined_px = px_to_k(px, m)
+    if undefined.any() or undefined_px.any():
+        print(f"configuration {par_bits}, {scr_bits}, {par_min_bits} shifts by a negative amount, not checked")
+        return False
+    px_slow = np.array([k_to_px_ref(int(v), par_bits, scr_bits, par_min_bits) for v in k])
+    k_slow = np.array([px_to_k_ref(int(v), par_bits, scr_bits, par_min_bits) for v in px])
+    k_ok = np.array_equal(px_fast, px_slow)
+    px_ok = np.array_equal(k_fast, k_slow)
+    print(f"k to px: {'all' if k_ok else 'NOT all'} {len(k)} inputs match, px to k: {'all' if px_ok else 'NOT all'} {len(px)} inputs match")
+    return k_ok and px_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="round trip error of the PWL log2/pow2 pid slider mapping, for every configuration")
+    parser.add_argument('--par-bits', type=int, nargs='*', default=list(range(8, 17)), help="LOG_PAR_BITS to try")
+    parser.add_argument('--scr-bits', type=int, nargs='*', default=list(range(5, 11)), help="LOG_SCR_BITS to try")
+    parser.add_argument('--fit', type=int, help=f"only configurations whose screen range fits this many px (the slider is {LOG_SLIDER_PX_RANGE})")
+    parser.add_argument('--sort', choices=COLUMNS, default='k_mean', help="column to rank by, least first")
+    parser.add_argument('--top', type=int, default=30, help="number of configurations to list")
+    parser.add_argument('--processes', type=int, help="worker processes, 1 for none")
+    parser.add_argument('--defined', action='store_true', help="leave out configurations that shift by a negative amount")
+    parser.add_argument('--check', action='store_true', help="check the vectorised conversions against the step by step ones first")
+    args = parser.parse_args()
+
+    if args.check and not check():
+        sys.exit("the vectorised conversions don't match the firmware's")
+
+    configs = config_grid(args.par_bits, [s for s in args.scr_bits if s > 4])
+    if not configs:
+        sys.exit("no configurations (LOG_SCR_BITS has to be more than 4)")
+    start = time.perf_counter()
+    results = sweep(configs, args.processes)
+    elapsed = time.perf_counter() - start
+    print(f"{len(configs)} configurations in {elapsed:.2f} s")
+
+    keep = np.ones(len(configs), bool)
+    if args.fit:
+        keep &= results[:, COLUMNS.index('px_max')] <= args.fit
+    if args.defined:
+        keep &= results[:, COLUMNS.index('undefined')] == 0
+    #configurations that shift by a negative amount are ranked after all of those that don't
+    order = np.lexsort((results[:, COLUMNS.index(args.sort)], results[:, COLUMNS.index('undefined')] > 0))
+    order = [n for n in order if keep[n]]
+    firmware = (LOG_PAR_BITS, LOG_SCR_BITS, LOG_PAR_MIN_BITS)
+
+    print("par scr min   px_max  k->px->k max%  mean%  zeroed  px->k->px max  mean  vs log2 px  undefined")
+    for n in order[:args.top] + [n for n in range(len(configs)) if configs[n] == firmware and n not in order[:args.top]]:
+        px_max, k_max, k_mean, zeroed, px_err, px_mean, log_err, undefined = results[n]
+        mark = "  <- PID.h" if configs[n] == firmware else ""
+        print(f"{configs[n][0]:3} {configs[n][1]:3} {configs[n][2]:3} {px_max:8.0f} {k_max:13.2f} {k_mean:6.2f} {zeroed:7.0f}"
+              f" {px_err:14.0f} {px_mean:5.2f} {log_err:11.2f} {undefined:10.0f}{mark}")
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:10:00 2026
+
+Generates PROGMEM lookup tables (a C header) for conversions the firmware works out at run time on the AVR,
+from the python models of them, with a report of each table's error and a rough estimate of its cost in cycles.
+
+    pid slider log2/pow2 (pid_convert_px_to_k and pid_convert_k_to_px, PID.ino), from log_exp_sweep's model:
+        px to k is a table of every px, which is exact
+        k to px is a binary search of the same table (the largest px whose k is not more than the input), also exact
+    rpm from rpm counter ticks (TK_TO_RPM, 3750000/tk) and from ms (MS_TO_RPM, 60000/ms), which are long divisions:
+        a table of numerator/m for the top --bits bits (m) of the input, shifted back down by the bits dropped,
+        nearest (the dropped bits round m) or linear (interpolated between m and m+1 by the dropped bits)
+        every table value is exact (floor(n/m)), so the error only comes from the dropped bits,
+        more bits is a bigger table and less error, and linear costs a multiply and a 32 bit shift
+        the error is reported over the inputs from RPM_MAX_rpm down to RPM_MIN_rpm
+
+Each lookup is modelled with the same integer steps as the C it generates, over every input it can be given,
+and compared with what the firmware works out now. The cycle counts are estimates (see AVR_CYCLES), to compare
+the table lookups with the code they would replace, not timings.
+
+eg. to compare table sizes, and write the tables for 8 bit linear rpm lookups:
+    python lookup_tables.py --bits 6 7 8 9 10
+    python lookup_tables.py --tk-bits 8 --ms-bits 9 --mode linear --out ../firmware_arduino/lookup_tables.h
+
+usage: python lookup_tables.py [--bits B ...] [--tk-bits B] [--ms-bits B] [--mode nearest|linear] [--out FILE]
+
+@author: AlexT-38
+"""
+
+import sys
+import argparse
+import numpy as np
+
+from log_exp_sweep import log_macros, px_to_k, k_to_px, LOG_PAR_BITS, LOG_SCR_BITS, LOG_PAR_MIN_BITS
+
+
+#RPM_counter.h
+TICK_us_BITS = 4
+TK_TO_RPM_N = 60000000 // (1 << TICK_us_BITS)
+MS_TO_RPM_N = 60000
+RPM_MAX_rpm = 6000
+RPM_MIN_ms = 500                #UPDATE_INTERVAL_ms, below RPM_MIN_rpm (120) the engine is taken to have stopped
+
+#rough costs (cycles) of the operations the conversions are made of, for avr-gcc on an ATmega2560
+AVR_CYCLES = {
+    'call': 8,          #call, return and moving the arguments
+    'shift16': 5,       #one bit of a 16 bit shift by a variable amount (lsr, ror, dec, brne)
+    'shift32': 7,       #one bit of a 32 bit shift by a variable amount
+    'compare': 4,       #compare and branch
+    'pgm_word': 9,      #pgm_read_word, with the address
+    'mul16': 20,        #unsigned 16 x 16 -> 32 bit multiply (__umulhisi3)
+    'div32': 650,       #32 bit division (__udivmodsi4)
+}
+
+#the rpm conversions: name, C name, numerator, and the inputs from RPM_MAX_rpm to RPM_MIN_rpm the error is reported over
+#(the lookups work for any input, those below the lowest are taken as the lowest)
+RECIPROCALS = [
+    ('tk_to_rpm', 'TK_TO_RPM', TK_TO_RPM_N, TK_TO_RPM_N // RPM_MAX_rpm, TK_TO_RPM_N // (MS_TO_RPM_N // RPM_MIN_ms)),
+    ('ms_to_rpm', 'MS_TO_RPM', MS_TO_RPM_N, MS_TO_RPM_N // RPM_MAX_rpm, RPM_MIN_ms),
+]
+
+
+#number of bits in each (non negative) value, 0 for 0
+def bit_length(values):
+    return np.frexp(np.asarray(values, np.float64))[1].astype(np.int64)
+
+
+#table of numerator//m, for every m a lookup of an input from lo up can index with bits bits
+#returns (table, first m)
+def reciprocal_table(numerator, lo, bits):
+    first = min(lo, 1 << (bits - 1))
+    table = numerator // np.arange(first, (1 << bits) + 1)
+    if table[0] > 0xffff:
+        raise ValueError(f"{numerator}/{first} doesn't fit in 16 bits, use more than {bits} bits")
+    return table, first
+
+#numerator/x by table lookup, as the generated C does it
+#returns (values, bits dropped from each input)
+def reciprocal_lookup(x, table, first, bits, linear=False):
+    x = np.maximum(np.asarray(x, np.int64), first)
+    e = np.maximum(bit_length(x) - bits, 0)
+    if linear:
+        m = x >> e
+        f = x & ((1 << e) - 1)
+        a = table[m - first]
+        b = table[np.minimum(m + 1 - first, len(table) - 1)]
+        values = ((a << e) - (a - b) * f) >> (2 * e)
+    else:
+        m = np.where(e > 0, ((x >> np.maximum(e - 1, 0)) + 1) >> 1, x)
+        values = table[m - first] >> e
+    return values, e
+
+#estimated cycles of each lookup, from the bits dropped from each input
+def reciprocal_cycles(e, linear=False):
+    c = AVR_CYCLES
+    normalise = e * (c['shift16'] + c['compare'])
+    if linear:
+        return c['call'] + normalise + 2*c['pgm_word'] + c['mul16'] + 3*e*c['shift32'] + 10
+    return c['call'] + normalise + 2*e*c['shift16'] + c['pgm_word'] + 6
+
+
+#the px to k table of a log configuration, every px from 0 to the last before the output clamps
+def slider_table(par_bits=LOG_PAR_BITS, scr_bits=LOG_SCR_BITS, par_min_bits=LOG_PAR_MIN_BITS):
+    m = log_macros(par_bits, scr_bits, par_min_bits)
+    table, undefined = px_to_k(np.arange(int(m['SCR_MAX'] - m['SCR_MIN']) + 1), m)
+    if undefined.any():
+        raise ValueError("pid_convert_px_to_k shifts by a negative amount in this configuration")
+    if np.any(np.diff(table) < 0):
+        raise ValueError("the px to k table isn't in order, it can't be searched")
+    return table, m
+
+#pid_convert_px_to_k and pid_convert_k_to_px by table, as the generated C does it
+def slider_px_to_k(px, table, m):
+    px = np.asarray(px, np.int64)
+    return np.where(px <= 0, 0, np.where(px >= len(table), m['PAR_MAX'] & 0xffff, table[np.clip(px, 0, len(table) - 1)]))
+
+def slider_k_to_px(k, table):
+    return np.searchsorted(table, np.asarray(k, np.int64), 'right') - 1
+
+#estimated cycles of the slider conversions, and of the firmware functions they replace, for every input
+def slider_cycles(table, m):
+    c = AVR_CYCLES
+    search = int(np.ceil(np.log2(len(table))))
+    k = np.arange(1 << 16)
+    n = bit_length(k >> int(m['STEP_BITS']))
+    k_to_px_fw = c['call'] + n*(c['shift16'] + c['compare']) + np.maximum(n - 1, 0)*c['shift16'] + 15
+    px = np.arange(len(table))
+    px_to_k_fw = c['call'] + np.maximum((px + m['SCR_MIN']) // m['STEP'] - m['STEP_BITS'], 0)*c['shift16'] + 15
+    return {'px_to_k': (c['call'] + c['pgm_word'] + 8, px_to_k_fw),
+            'k_to_px': (c['call'] + search*(c['pgm_word'] + c['compare'] + 6), k_to_px_fw)}
+
+
+#one line of the report
+def report_line(name, entries, errors, cycles, firmware_cycles, reference=None):
+    errors = np.abs(errors)
+    line = f"{name:24} {entries:5} {2*entries:6} {errors.max():9.0f} {errors.mean():8.3f}"
+    if reference is not None:
+        line += f" {100*(errors/np.maximum(reference, 1)).max():8.3f}"
+    else:
+        line += f" {'':8}"
+    cycles = np.broadcast_to(cycles, errors.shape)
+    firmware_cycles = np.broadcast_to(firmware_cycles, errors.shape)
+    return line + f" {cycles.mean():6.0f} {cycles.max():5.0f} {firmware_cycles.mean():8.0f} {firmware_cycles.max():5.0f}"
+
+
+#the C of a PROGMEM table, 12 values to a line
+def c_table(name, values, ctype="unsigned int"):
+    lines = [", ".join(str(int(v)) for v in values[n:n+12]) for n in range(0, len(values), 12)]
+    return f"const {ctype} {name}[{len(values)}] PROGMEM = {{\n  " + ",\n  ".join(lines) + "\n};\n"
+
+def c_slider(table, m):
+    return (f"/* pid slider log2/pow2, LOG_PAR_BITS {int(m['PAR_BITS'])}, LOG_SCR_BITS {int(m['SCR_BITS'])}, "
+            f"LOG_PAR_MIN_BITS {int(m['PAR_MIN_BITS'])}\n"
+            f" * the same results as pid_convert_px_to_k and pid_convert_k_to_px (PID.ino)\n */\n"
+            f"#define PID_PX_TO_K_SIZE {len(table)}\n"
+            + c_table("PID_PX_TO_K", table) +
+            f"\n/* screen space to parameter space */\n"
+            f"unsigned int pid_lookup_px_to_k(int px)\n{{\n"
+            f"  if (px <= 0) return 0;\n"
+            f"  if (px >= PID_PX_TO_K_SIZE) return {int(m['PAR_MAX']) & 0xffff};\n"
+            f"  return pgm_read_word(&PID_PX_TO_K[px]);\n}}\n"
+            f"\n/* parameter space to screen space, the largest px whose k is not more than k */\n"
+            f"int pid_lookup_k_to_px(unsigned int k)\n{{\n"
+            f"  int lo = 0;\n"
+            f"  int hi = PID_PX_TO_K_SIZE - 1;\n"
+            f"  while (lo < hi)\n  {{\n"
+            f"    int mid = (lo + hi + 1) >> 1;\n"
+            f"    if (pgm_read_word(&PID_PX_TO_K[mid]) <= k) lo = mid;\n"
+            f"    else hi = mid - 1;\n  }}\n"
+            f"  return lo;\n}}\n")
+
+def c_reciprocal(name, macro, numerator, bits, linear, table, first):
+    table_name = f"{macro}_TABLE"
+    func = f"{name}_lookup"
+    head = (f"/* {macro}, {numerator}/x from a table of {numerator}/m for the top {bits} bits of x"
+            f"{', interpolated' if linear else ''}, x below {first} is taken as {first} */\n"
+            f"#define {table_name}_BITS {bits}\n"
+            f"#define {table_name}_FIRST {first}\n"
+            + c_table(table_name, table) + "\n"
+            f"unsigned int {func}(unsigned int x)\n{{\n"
+            f"  if (x < {table_name}_FIRST) x = {table_name}_FIRST;\n"
+            f"  byte e = 0;\n"
+            f"  unsigned int m = x;\n"
+            f"  while (m >> {table_name}_BITS)\n  {{\n    m >>= 1;\n    e++;\n  }}\n")
+    if linear:
+        body = (f"  unsigned int a = pgm_read_word(&{table_name}[m - {table_name}_FIRST]);\n"
+                f"  if (!e) return a;\n"
+                f"  unsigned int b = pgm_read_word(&{table_name}[m + 1 - {table_name}_FIRST]);\n"
+                f"  unsigned int f = x & ((1u << e) - 1);\n"
+                f"  return (unsigned int)((((unsigned long)a << e) - (unsigned long)(a - b) * f) >> (2*e));\n}}\n")
+    else:
+        body = (f"  if (e) m = ((x >> (e - 1)) + 1) >> 1;   //round to the nearest m\n"
+                f"  return pgm_read_word(&{table_name}[m - {table_name}_FIRST]) >> e;\n}}\n")
+    return head + body
+
+
+#the error report, and the header with the tables of the chosen bits
+# bits_list:  rpm table index bits to report
+# write_bits: rpm table index bits of each of RECIPROCALS to write
+def generate(bits_list, write_bits, linear=False, report_all=True):
+    print(f"{'table':24} {'size':>5} {'bytes':>6} {'max err':>9} {'mean err':>8} {'max err%':>8}"
+          f" {'cycles':>6} {'max':>5} {'replaces':>8} {'max':>5}")
+
+    table, m = slider_table()
+    k = np.arange(1 << 16)
+    px = np.arange(-16, int(m['SCR_LIM']) + 16)
+    cycles = slider_cycles(table, m)
+    print(report_line("pid px to k", len(table), slider_px_to_k(px, table, m) - px_to_k(px, m)[0],
+                      cycles['px_to_k'][0], cycles['px_to_k'][1].mean()))
+    print(report_line("pid k to px (search)", 0, slider_k_to_px(k, table) - k_to_px(k, m)[0],
+                      cycles['k_to_px'][0], cycles['k_to_px'][1]))
+    sections = [c_slider(table, m)]
+
+    modes = [False, True] if report_all else [linear]
+    for (name, macro, numerator, lo, hi), written in zip(RECIPROCALS, write_bits):
+        x = np.arange(lo, hi + 1)
+        exact = numerator // x
+        for bits in bits_list:
+            try:
+                table, first = reciprocal_table(numerator, lo, bits)
+            except ValueError as error:
+                print(f"{name} {bits}: {error}")
+                continue
+            for mode in modes:
+                values, e = reciprocal_lookup(x, table, first, bits, mode)
+                label = f"{name} {bits} {'linear' if mode else 'nearest'}"
+                print(report_line(label, len(table), values - exact, reciprocal_cycles(e, mode),
+                                  AVR_CYCLES['call'] + AVR_CYCLES['div32'], exact))
+        sections.append(c_reciprocal(name, macro, numerator, written, linear, *reciprocal_table(numerator, lo, written)))
+    return sections
+
+def write_header(path, sections, argv):
+    with open(path, 'w', newline='\n') as file:
+        file.write("#ifndef __LOOKUP_TABLES_H__\n#define __LOOKUP_TABLES_H__\n\n"
+                   f"// generated by test scripts/lookup_tables.py {' '.join(argv)}\n"
+                   "// lookup tables in program memory, for conversions that would otherwise be worked out at run time\n\n"
+                   "#include <avr/pgmspace.h>\n\n")
+        file.write("\n".join(sections))
+        file.write("\n#endif //__LOOKUP_TABLES_H__\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="lookup tables for the firmware's log2/pow2 and rpm conversions, with their error and cost")
+    parser.add_argument('--bits', type=int, nargs='*', default=[7, 8, 9, 10], help="rpm table index bits to report")
+    parser.add_argument('--tk-bits', type=int, default=8, help="index bits of the TK_TO_RPM table written")
+    parser.add_argument('--ms-bits', type=int, default=9, help="index bits of the MS_TO_RPM table written")
+    parser.add_argument('--mode', choices=['nearest', 'linear'], default='linear', help="rpm table lookup written")
+    parser.add_argument('--out', help="write the tables to this C header")
+    args = parser.parse_args()
+
+    try:
+        sections = generate(args.bits, [args.tk_bits, args.ms_bits], args.mode == 'linear')
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.out:
+        write_header(args.out, sections, sys.argv[1:])
+        print("written", args.out)
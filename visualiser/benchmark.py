@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Parsing and plotting benchmark.
+
+Generates synthetic logs (see log_generator) of each of the given lengths, then times
+parsing them as v4 (json, loaded whole and streamed) and v3 (text), and plotting them with plot_data,
+so a change to the parser or plotting that makes them slower shows up as a number.
+
+Each step is timed without the cache, best of --repeat runs, then run once more with tracemalloc
+to find its peak memory (tracemalloc slows things down, so isn't used for the timing).
+Parser output (prints) is hidden. Plots are drawn with the Agg backend, so no windows are opened.
+
+usage: python benchmark.py [--records N ...] [--repeat R] [--dir D] [--config NAME=VALUE ...]
+
+@author: AlexT-38
+"""
+
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from log_file_visualiser import log_file
+from log_generator import generate_log, parse_config
+
+
+#time a function, best of repeat runs, then its peak memory (bytes) over one more run
+#returns (seconds, peak bytes, result of the last run)
+def measure(function, repeat=3):
+    best = None
+    for n in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+#parse a log without the cache
+def parse(path, stream=False):
+    return log_file(path, stream=stream, cache=False)
+
+#plot a parsed log, overview only, and draw every figure (the Agg backend doesn't draw until asked to)
+def plot(log):
+    log.detailed_pid = log.detailed_rpm = False
+    log.plot_data()
+    for number in plt.get_fignums():
+        plt.figure(number).canvas.draw()
+    plt.close('all')
+
+
+#run the benchmark for each number of records
+#returns a list of (records, step, file size, seconds, peak bytes)
+def run(records_list, repeat=3, folder=None, config=None):
+    results = []
+    with tempfile.TemporaryDirectory(dir=folder) as temp:
+        for records in records_list:
+            v4_path = os.path.join(temp, f"bench_{records}.jsn")
+            v3_path = os.path.join(temp, f"bench_{records}.txt")
+            generate_log(v4_path, records, config=config)
+            generate_log(v3_path, records, v3=True, config=config)
+            steps = [('parse_v4', v4_path, lambda: parse(v4_path)),
+                     ('parse_v4_stream', v4_path, lambda: parse(v4_path, True)),
+                     ('parse_v3', v3_path, lambda: parse(v3_path))]
+            logs = {}
+            for step, path, function in steps:
+                seconds, peak, logs[step] = measure(function, repeat)
+                results.append((records, step, os.path.getsize(path), seconds, peak))
+                print_result(*results[-1])
+            seconds, peak, result = measure(lambda: plot(logs['parse_v4']), repeat)
+            results.append((records, 'plot_data', os.path.getsize(v4_path), seconds, peak))
+            print_result(*results[-1])
+    return results
+
+
+def print_header():
+    print(f"{'records':>8} {'step':<16} {'file MB':>8} {'time s':>8} {'records/s':>10} {'peak MB':>8}")
+
+def print_result(records, step, size, seconds, peak):
+    print(f"{records:>8} {step:<16} {size/1e6:>8.1f} {seconds:>8.3f} {records/seconds:>10.0f} {peak/1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time parsing and plotting synthetic logs")
+    parser.add_argument('--records', type=int, nargs='+', default=[1000, 10000], help="log lengths to test")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each step, the best is reported")
+    parser.add_argument('--dir', help="folder for the generated logs (default: the system temp folder)")
+    parser.add_argument('--config', nargs='*', metavar='NAME=VALUE', help="firmware build settings, see binary_records.FIRMWARE_CONFIG")
+    args = parser.parse_args()
+    try:
+        config = parse_config(args.config)
+    except ValueError as e:
+        sys.exit(str(e))
+    print_header()
+    run(args.records, args.repeat, args.dir, config)
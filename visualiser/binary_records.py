@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Decoder for binary record dumps.
+
+With do_sdcard_write_hex / do_serial_write_hex set, the firmware writes each record as the raw
+DATA_RECORD struct (records.h) wrapped in a DATA_STORAGE:
+    bytes_stored (unsigned int), hash (byte), bytes_stored bytes of DATA_RECORD
+SD card writes are then padded with zeros up to the next BLOCK_SIZE (512) bytes, serial writes are not.
+
+The layout of DATA_RECORD depends on the array sizes the firmware was built with,
+the defaults here are those in firmware_arduino.ino, ADC.h and RPM_counter.h,
+any of them can be overridden to match other builds.
+The AVR is 8 bit, so the struct has no padding, int is 16 bits and long 32 bits, all little endian.
+
+Records are found by searching the dump for bytes_stored values that match the record size
+and keeping those whose hash (hash_data in records.ino) matches, so padding, partial writes and
+serial noise between records are skipped without needing to know how the dump was framed.
+
+note: as of v0.6.0 the firmware sets bytes_stored to sizeof(DATA_STORAGE) and writes from the wrong address,
+so hex dumps from that version can't be read - this decodes the format as intended.
+
+@author: AlexT-38
+"""
+
+import numpy as np
+
+
+#array sizes and rates of the firmware build, as defined in the firmware
+FIRMWARE_CONFIG = {
+    'UPDATE_INTERVAL_ms'        : 500,
+    'ANALOG_SAMPLE_INTERVAL_ms' : 100,
+    'ADC_SAMPLE_INTERVAL_ms'    : 5,
+    'EGT_SAMPLE_INTERVAL_ms'    : 250,
+    'PID_UPDATE_INTERVAL_ms'    : 50,
+    'RPM_MAX_rpm'               : 6000,
+    'TICK_us_BITS'              : 4,
+    'NO_OF_USER_INPUTS'         : 4,
+    'NO_OF_MAP_SENSORS'         : 1,
+    'NO_OF_TMP_SENSORS'         : 0,
+    'NO_OF_EGT_SENSORS'         : 1,
+    'NO_OF_SERVOS'              : 3,
+    'NO_OF_PIDS'                : 2,
+}
+
+BLOCK_SIZE = 512            #sd card writes are padded to this
+STORAGE_HEADER_SIZE = 3     #bytes_stored (2), hash (1)
+SEARCH_CHUNK = 1<<12        #number of candidate records hashed at a time
+
+#pid record fields, and the names they are logged under in json logs
+PID_FIELDS = [('target', 'trg', '<i2'), ('actual', 'act', '<i2'), ('err', 'err', '<i2'), ('output', 'out', '<i2'),
+              ('p', 'p', '<i2'), ('i', 'i', '<i4'), ('d', 'd', '<i2')]
+
+
+#firmware config, with any overrides, and the array sizes derived from it
+def firmware_config(**overrides):
+    config = dict(FIRMWARE_CONFIG)
+    for name, value in overrides.items():
+        if name not in config:
+            raise KeyError(f"unknown firmware config '{name}'")
+        config[name] = value
+    interval = config['UPDATE_INTERVAL_ms']
+    config['ANALOG_SAMPLES_PER_UPDATE'] = interval // config['ANALOG_SAMPLE_INTERVAL_ms']
+    config['NO_OF_ADC_FAST_PER_RECORD'] = interval // config['ADC_SAMPLE_INTERVAL_ms']
+    config['EGT_SAMPLES_PER_UPDATE'] = interval // config['EGT_SAMPLE_INTERVAL_ms']
+    config['PID_LOOPS_PER_UPDATE'] = interval // config['PID_UPDATE_INTERVAL_ms']
+    config['RPM_MAX_TICKS_PER_UPDATE'] = 1 + interval // (60000 // config['RPM_MAX_rpm'])
+    return config
+
+
+#PID_RECORD (PID.h)
+def pid_record_dtype(config):
+    loops = config['PID_LOOPS_PER_UPDATE']
+    return np.dtype([(name, dtype, (loops,)) for name, json_name, dtype in PID_FIELDS])
+
+
+#DATA_RECORD (records.h)
+def data_record_dtype(config):
+    slow = config['ANALOG_SAMPLES_PER_UPDATE']
+    return np.dtype([
+        ('timestamp',               '<u4'),
+        ('ANA_no_of_slow_samples',  'u1'),
+        ('ANA_no_of_fast_samples',  'u1'),
+        ('USR',                     '<i2', (config['NO_OF_USER_INPUTS'], slow)),
+        ('MAP',                     '<i2', (config['NO_OF_MAP_SENSORS'], config['NO_OF_ADC_FAST_PER_RECORD'])),
+        ('TMP',                     '<i2', (config['NO_OF_TMP_SENSORS'], slow)),
+        ('TRQ',                     '<i2', (slow,)),
+        ('EGT_no_of_samples',       'u1'),
+        ('EGT',                     '<i2', (config['NO_OF_EGT_SENSORS'], config['EGT_SAMPLES_PER_UPDATE'])),
+        ('RPM_no_of_ticks',         'u1'),
+        ('RPM_tick_offset_tk',      '<u2'),
+        ('RPM_tick_times_tk',       '<u2', (config['RPM_MAX_TICKS_PER_UPDATE'],)),
+        ('SRV_no_of_samples',       'u1'),
+        ('SRV',                     '<i2', (config['NO_OF_SERVOS'], config['PID_LOOPS_PER_UPDATE'])),
+        ('PIDs',                    pid_record_dtype(config), (config['NO_OF_PIDS'],)),
+    ])
+
+
+#hash_data (records.ino) of each row of a 2D array of bytes
+#each byte has its index (as a byte) added to it, and the results are xored together
+def hash_data(data):
+    data = np.asarray(data, np.uint8)
+    index = (np.arange(data.shape[-1]) & 0xFF).astype(np.uint8)
+    return np.bitwise_xor.reduce(data + index, axis=-1)
+
+
+#find and decode every record in a binary dump
+#data: the dump, as bytes
+#returns an array of DATA_RECORD, in the order found, and the offset of each record's DATA_STORAGE in the dump
+def read_records(data, config=None, verbose=False):
+    if config is None:
+        config = firmware_config()
+    dtype = data_record_dtype(config)
+    size = dtype.itemsize
+    data = np.frombuffer(data, np.uint8)
+    if len(data) < STORAGE_HEADER_SIZE + size:
+        return np.zeros(0, dtype), np.zeros(0, np.int64)
+
+    #every position where bytes_stored could be
+    last = len(data) - (STORAGE_HEADER_SIZE + size)
+    bytes_stored = data[:last+1].astype(np.uint16) | (data[1:last+2].astype(np.uint16) << 8)
+    candidates = np.flatnonzero(bytes_stored == size)
+
+    #keep those whose hash matches
+    offsets = np.arange(size)
+    matched = []
+    for start in range(0, len(candidates), SEARCH_CHUNK):
+        chunk = candidates[start:start+SEARCH_CHUNK]
+        payload = data[(chunk + STORAGE_HEADER_SIZE)[:, None] + offsets]
+        matched.append(chunk[hash_data(payload) == data[chunk + 2]])
+    found = np.concatenate(matched) if matched else np.zeros(0, np.int64)
+
+    #a record can't start inside the one before it - there will be false matches within records now and then
+    frame = STORAGE_HEADER_SIZE + size
+    if len(found) > 1 and np.any(np.diff(found) < frame):
+        keep = []
+        end = -1
+        for offset in found:
+            if offset >= end:
+                keep.append(offset)
+                end = offset + frame
+        found = np.array(keep, np.int64)
+
+    if verbose:
+        print(f"{len(found)} records found, {len(candidates) - len(found)} rejected by hash")
+
+    records = np.empty(len(found), dtype)
+    raw = records.view(np.uint8).reshape(len(found), size)
+    for start in range(0, len(found), SEARCH_CHUNK):
+        chunk = found[start:start+SEARCH_CHUNK]
+        raw[start:start+len(chunk)] = data[(chunk + STORAGE_HEADER_SIZE)[:, None] + offsets]
+    return records, found
+
+
+#encode records as the firmware would write them
+#block_size: pad each record to a multiple of this (as the sd card writes), None for serial
+def write_records(records, block_size=None):
+    records = np.ascontiguousarray(records)
+    raw = records.view(np.uint8).reshape(len(records), records.dtype.itemsize)
+    size = raw.shape[1]
+    frame = STORAGE_HEADER_SIZE + size
+    if block_size:
+        #the firmware pads a whole block if the record is already a multiple of it
+        frame += block_size - frame % block_size
+    out = np.zeros((len(records), frame), np.uint8)
+    out[:, 0] = size & 0xFF
+    out[:, 1] = size >> 8
+    out[:, 2] = hash_data(raw)
+    out[:, STORAGE_HEADER_SIZE:STORAGE_HEADER_SIZE+size] = raw
+    return out.tobytes()
+
+
+#the json (v4) header the firmware would write for this config
+def firmware_header(config):
+    interval = config['UPDATE_INTERVAL_ms']
+    analog = config['ANALOG_SAMPLE_INTERVAL_ms']
+    sensors = []
+    def add_sensor(name, num, rate, units, minimum=None, maximum=None, scale=None, rate_units='ms'):
+        if num <= 0:
+            return
+        sensor = {'name': name, 'num': num, 'rate': rate, 'rate_units': rate_units, 'units': units}
+        if minimum is not None:
+            sensor['min'] = minimum
+            sensor['max'] = maximum
+        if scale is not None:
+            sensor['scale'] = scale
+        sensors.append(sensor)
+    add_sensor('usr', config['NO_OF_USER_INPUTS'], analog, 'LSB', 0, 1023, 0)
+    add_sensor('map', config['NO_OF_MAP_SENSORS'], config['ADC_SAMPLE_INTERVAL_ms'], 'mbar')
+    add_sensor('egt', config['NO_OF_EGT_SENSORS'], config['EGT_SAMPLE_INTERVAL_ms'], '°C', 0, 1024, -2)
+    add_sensor('tmp', config['NO_OF_TMP_SENSORS'], analog, '°C', 0, 256, -2)
+    add_sensor('trq', 1, analog, 'mN.m', -32000, 32000, 0)
+    add_sensor('spd', 1, 1, 'us', scale=config['TICK_us_BITS'], rate_units='pr')
+    return {'version': 4, 'firmware': 'binary', 'rate_ms': interval, 'date': None, 'time': None,
+            'sensors': sensors,
+            'servos': {'num': config['NO_OF_SERVOS'], 'rate': config['PID_UPDATE_INTERVAL_ms'], 'rate_units': 'ms',
+                       'units': 'LSB', 'min': 0, 'max': 1023},
+            'pid': {'num': config['NO_OF_PIDS'], 'rate': config['PID_UPDATE_INTERVAL_ms'], 'rate_units': 'ms'}}
+
+
+#the samples of each sensor channel in the records
+#yields (name, index, samples, counts), samples is 2D (record, sample), counts the number of valid samples in each record
+def record_samples(records):
+    slow = records['ANA_no_of_slow_samples']
+    fast = records['ANA_no_of_fast_samples']
+    for name, field, counts in [('usr', 'USR', slow), ('map', 'MAP', fast), ('tmp', 'TMP', slow),
+                                ('egt', 'EGT', records['EGT_no_of_samples']), ('srv', 'SRV', records['SRV_no_of_samples'])]:
+        for index in range(records[field].shape[1]):
+            yield name, index, records[field][:, index], counts
+    yield 'trq', 0, records['TRQ'], slow
+    pids = records['PIDs']
+    for index in range(pids.shape[1]):
+        for field, json_name, dtype in PID_FIELDS:
+            yield 'pid.'+json_name, index, pids[field][:, index], records['SRV_no_of_samples']
+
+
+#the valid samples of a 2D (record, sample) array, in order, given the number of valid samples in each record
+#counts larger than the array (corrupt records) are clipped
+def valid_samples(samples, counts):
+    counts = np.minimum(counts, samples.shape[1]).astype(np.int64)
+    mask = np.arange(samples.shape[1]) < counts[:, None]
+    return samples[mask], counts
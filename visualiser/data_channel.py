@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Containers for logged data.
+
+sample_buffer is a growable contiguous array, used while parsing for data that isn't a sensor channel.
+data_channel holds the samples of one sensor channel (eg. usr 2, egt 0, pid 0 'trg')
+along with the timestamp of each sample.
+
+Both are sized up front from the expected number of samples and doubled if that turns out to be too small,
+so that parsing a log appends in linear time rather than reallocating every record.
+
+ring_buffer holds a fixed number of the latest samples of a channel, for live data.
+
+Channels keep their values as logged (raw), along with a factor to convert them to the logged units,
+eg. egt is logged in quarter degrees (header scale -2), so its factor is 0.25.
+The factor is only applied as values are read, so the raw arrays can stay as the integers they were logged as.
+Once a log is parsed, the raw values are stored in the smallest integer type that holds the sensor's range (see compact),
+eg. 10 bit adc values in uint16, rather than float64, a quarter of the memory.
+Reading values gives float64 values in units, made as they are asked for.
+
+Sensors sampled at a fixed rate don't log a timestamp per sample, only one per record.
+While parsing, channels record which record each block of samples came from (append_record)
+and the timestamps of all of the samples are generated in one go once the log has been read (make_times).
+
+@author: AlexT-38
+"""
+
+import numpy as np
+
+from decimate import lod_pyramid
+
+
+#grow an array to hold at least capacity elements, keeping the first length elements
+def grow(array, length, capacity):
+    grown = np.empty(max(capacity, 2*len(array)), array.dtype)
+    grown[:length] = array[:length]
+    return grown
+
+
+#the smallest integer dtype that holds every value from low to high
+def integer_dtype(low, high):
+    for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+# sample_buffer is a growable contiguous array
+class sample_buffer:
+    __slots__ = ('data', 'length')
+
+    def __init__(self, capacity=0, dtype=np.float64):
+        self.data = np.empty(max(int(capacity), 16), dtype)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, n):
+        return self.data[:self.length][n]
+
+    #append a single value or a list/array of values
+    def append(self, values):
+        values = np.asarray(values, dtype=self.data.dtype).ravel()
+        end = self.length + values.size
+        if end > len(self.data):
+            self.data = grow(self.data, self.length, end)
+        self.data[self.length:end] = values
+        self.length = end
+
+    #the valid part of the buffer, trimmed to length
+    def array(self):
+        if self.length < len(self.data):
+            self.data = self.data[:self.length].copy()
+        return self.data
+
+
+# ring_buffer keeps the latest values of a channel, and their timestamps, for live data
+# everything is written twice, capacity apart, so the buffered samples can always be read as one contiguous view
+class ring_buffer:
+    __slots__ = ('_values', '_times', 'capacity', 'start', 'length')
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = max(int(capacity), 1)
+        self._values = np.zeros(2*self.capacity, dtype)
+        self._times = np.zeros(2*self.capacity, np.float64)
+        self.start = 0      #position of the oldest sample
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    #append values and their timestamps, dropping the oldest samples once full
+    def append(self, values, times):
+        values = np.asarray(values).ravel()[-self.capacity:]
+        times = np.asarray(times).ravel()[-self.capacity:]
+        n = len(values)
+        if n == 0:
+            return
+        positions = (self.start + self.length + np.arange(n)) % self.capacity
+        self._values[positions] = values
+        self._values[positions + self.capacity] = values
+        self._times[positions] = times
+        self._times[positions + self.capacity] = times
+        dropped = max(0, self.length + n - self.capacity)
+        self.start = (self.start + dropped) % self.capacity
+        self.length = min(self.capacity, self.length + n)
+
+    #the buffered values and times, oldest first - these are views, valid until the next append
+    @property
+    def values(self):
+        return self._values[self.start:self.start+self.length]
+
+    @property
+    def times(self):
+        return self._times[self.start:self.start+self.length]
+
+
+# data_channel holds the values and timestamps (in seconds from the start of the log) of one channel
+# channels that are sampled together can share a single timestamp array (see share_times)
+class data_channel:
+    __slots__ = ('name', 'index', 'units', 'scale', 'rate', 'factor', '_values', '_times', '_length', '_records', '_counts', '_lod', '_order')
+
+    # name:     sensor name, as in the log header (eg. 'usr', 'egt', 'pid.trg')
+    # index:    index of the channel for sensors with more than one channel
+    # capacity: expected number of samples
+    # units:    units, as in the log header
+    # scale:    power of two scale factor, as in the log header
+    # rate:     sample interval in seconds, for sensors sampled at a fixed rate, otherwise None
+    def __init__(self, name, index=0, capacity=0, units=None, scale=0, dtype=np.float64, rate=None):
+        self.name = name
+        self.index = index
+        self.units = units
+        self.scale = scale
+        self.rate = rate
+        self.factor = 1         #multiplier from the raw values to units (see calibrate)
+        self._values = np.empty(max(int(capacity), 16), dtype)
+        self._times = None
+        self._length = 0
+        self._records = None    #record number of each append_record call, until make_times
+        self._counts = None     #number of samples added by each append_record call
+        self._lod = None        #lod_pyramid for plotting, built when first needed
+        self._order = None      #(length, time order of the samples) once worked out (see time_order)
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return f"data_channel({self.name!r}, {self.index}, {self._length} samples)"
+
+    #values in units - a float copy of the raw values, unless they are already float and the factor is 1
+    @property
+    def values(self):
+        return self.scaled(self._values[:self._length])
+
+    #values as logged, without the factor applied
+    @property
+    def raw(self):
+        return self._values[:self._length]
+
+    #raw values (eg. a slice of raw) in units, as float64
+    def scaled(self, raw):
+        if self.factor == 1 and raw.dtype == np.float64:
+            return raw
+        return raw * float(self.factor)
+
+    #store the raw values in the smallest integer dtype that holds low to high (eg. the sensor range from the log header)
+    #and every value in the channel - channels with values that aren't whole numbers are left as they are
+    def compact(self, low=None, high=None):
+        raw = self.raw
+        if len(raw) == 0 or raw.dtype.kind not in 'iuf':
+            return
+        lowest, highest = raw.min(), raw.max()
+        if not (np.isfinite(lowest) and np.isfinite(highest)):
+            return
+        if raw.dtype.kind == 'f' and not np.array_equal(raw, np.floor(raw)):
+            return
+        if low is not None: lowest = min(lowest, low)
+        if high is not None: highest = max(highest, high)
+        dtype = integer_dtype(lowest, highest)
+        if dtype != raw.dtype:
+            self._values = raw.astype(dtype)
+            self._lod = None
+
+    #set the multiplier from the raw values to units
+    def calibrate(self, factor):
+        if factor != self.factor:
+            self.factor = factor
+            self._lod = None
+
+    #timestamps of each value, None if the timestamps haven't been set
+    @property
+    def times(self):
+        if self._times is None:
+            return None
+        return self._times[:self._length]
+
+    #the channel at several resolutions, for plotting (see decimate)
+    #built the first time it is needed, and rebuilt if the channel changes
+    def lod(self):
+        if self._lod is None or len(self._lod.levels[0][0]) != self._length:
+            self._lod = lod_pyramid(self.times, self.raw, self.factor)
+        return self._lod
+
+    #None if the timestamps are in order, otherwise the indices of the samples in time order
+    #worked out the first time it is needed, and again if the channel changes
+    def time_order(self):
+        if self._order is None or self._order[0] != self._length:
+            times = self.times
+            order = None if np.all(times[1:] >= times[:-1]) else np.argsort(times, kind='stable')
+            self._order = (self._length, order)
+        return self._order[1]
+
+    #index range [start, stop) of the samples with t0 <= time < t1 (None for the start/end of the log)
+    #only meaningful if the timestamps are in order
+    def index_range(self, t0=None, t1=None):
+        times = self.times
+        start = 0 if t0 is None else int(np.searchsorted(times, t0, 'left'))
+        stop = len(times) if t1 is None else int(np.searchsorted(times, t1, 'left'))
+        return start, max(start, stop)
+
+    #the times and values of the samples with t0 <= time < t1 (None for the start/end of the log)
+    #the times are a view of the channel, unless the timestamps aren't in order (eg. late rpm ticks),
+    #then they are a copy of the samples in the window, in time order
+    #the values are a copy, calibrated from the raw values (which compact stores as integers)
+    def window(self, t0=None, t1=None):
+        if self.times is None:
+            raise ValueError(f"{self!r}: no timestamps")
+        order = self.time_order()
+        if order is None:
+            start, stop = self.index_range(t0, t1)
+            return self.times[start:stop], self.scaled(self.raw[start:stop])
+        times = self.times[order]
+        start = 0 if t0 is None else np.searchsorted(times, t0, 'left')
+        stop = len(times) if t1 is None else max(start, np.searchsorted(times, t1, 'left'))
+        return times[start:stop], self.scaled(self.raw[order[start:stop]])
+
+    #append values, and optionally their timestamps
+    #channels are either appended to with timestamps every time, or never (and then set_times is used)
+    def append(self, values, times=None):
+        values = np.asarray(values).ravel()
+        end = self._length + values.size
+        if end > len(self._values):
+            self._values = grow(self._values, self._length, end)
+        self._values[self._length:end] = values
+        if times is not None:
+            if self._times is None:
+                self._times = np.empty(len(self._values), np.float64)
+            elif end > len(self._times):
+                self._times = grow(self._times, self._length, end)
+            self._times[self._length:end] = times
+        self._length = end
+
+    #append the samples of one record, the timestamps are generated later by make_times
+    def append_record(self, values, record):
+        if self._records is None:
+            self._records = sample_buffer(dtype=np.int64)
+            self._counts = sample_buffer(dtype=np.int64)
+        start = self._length
+        self.append(values)
+        self._records.append(record)
+        self._counts.append(self._length - start)
+
+    #generate the timestamps of samples added with append_record
+    #record_times:    timestamp (s) of every record
+    #record_interval: time (s) between records
+    def make_times(self, record_times, record_interval):
+        if self._records is None:
+            return
+        self.set_times(record_sample_times(record_times, self._records.array(), self._counts.array(),
+                                           record_interval, self.rate))
+        self._records = None
+        self._counts = None
+
+    #replace the contents of the channel, values (raw) and times are not copied
+    def set(self, values, times=None):
+        self._lod = None
+        self._order = None
+        self._values = np.asarray(values)
+        self._length = len(self._values)
+        if times is not None:
+            self.set_times(times)
+        elif self._times is not None and len(self._times) < self._length:
+            self._times = None
+
+    #set the timestamps, the array is not copied, so can be shared between channels
+    def set_times(self, times):
+        if len(times) != self._length:
+            raise ValueError(f"{self!r}: {len(times)} timestamps for {self._length} values")
+        self._lod = None
+        self._order = None
+        self._times = times
+
+    #release any spare capacity
+    def trim(self):
+        if self._length < len(self._values):
+            self._values = self._values[:self._length].copy()
+        if self._times is not None and self._length < len(self._times):
+            self._times = self._times[:self._length].copy()
+
+
+#timestamps of the samples of a fixed rate channel
+#records: the record number of each block of samples, counts: the number of samples in each block
+#samples are spaced by rate from the record timestamp, or spread evenly over the record if there is no rate
+#or there are more samples than fit in the record at that rate
+def record_sample_times(record_times, records, counts, record_interval, rate=None):
+    counts = np.asarray(counts)
+    records = np.asarray(records)[counts > 0]
+    counts = counts[counts > 0]
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0)
+    #position of each sample within its block
+    starts = np.cumsum(counts) - counts
+    position = np.arange(total) - np.repeat(starts, counts)
+    step = record_interval / counts
+    if rate:
+        step = np.minimum(step, rate)
+    return np.repeat(np.asarray(record_times)[records], counts) + position * np.repeat(step, counts)
+
+
+#where channels were sampled together (same timestamps), make them share one timestamp array
+#timebases is an optional list of existing timestamp arrays to share, it is extended with any new ones found
+def share_times(channels, timebases=None):
+    if timebases is None:
+        timebases = []
+    for channel in channels:
+        if channel.times is None:
+            continue
+        for times in timebases:
+            if np.array_equal(times, channel.times):
+                channel.set_times(times)
+                break
+        else:
+            timebases.append(channel.times)
+    return timebases
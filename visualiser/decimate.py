@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Level of detail reduction for plotting.
+
+A line with more points than the axis has pixels draws slowly and looks no different,
+so channels are reduced to about the pixel width of the plot before drawing.
+Each bucket of consecutive samples is replaced by its minimum and maximum (in time order),
+so peaks and dropouts are still drawn however far the plot is zoomed out.
+
+lod_pyramid keeps a channel at several resolutions, each a quarter of the one before,
+so a window of any length can be drawn from a level with not much more than the number of points needed.
+
+@author: AlexT-38
+"""
+
+import numpy as np
+
+
+#reduce times/values to at most about points samples, keeping the min and max of each bucket of samples
+#times must be in order
+def minmax(times, values, points):
+    n = len(values)
+    buckets = max(1, points//2)
+    if n <= 2*buckets:
+        return times, values
+    size = -(-n // buckets)                 #samples per bucket, rounded up
+    buckets = -(-n // size)
+    #pad the last bucket with its last value, which can't change its min or max
+    padded = np.empty(buckets*size, values.dtype)
+    padded[:n] = values
+    padded[n:] = values[-1]
+    padded = padded.reshape(buckets, size)
+    start = np.arange(buckets)*size
+    low = start + np.argmin(padded, axis=1)
+    high = start + np.argmax(padded, axis=1)
+    index = np.empty(2*buckets, np.int64)
+    index[0::2] = np.minimum(low, high)
+    index[1::2] = np.maximum(low, high)
+    index = np.minimum(index, n-1)
+    return times[index], values[index]
+
+
+# lod_pyramid holds a channel at decreasing resolutions, for drawing any window of it quickly
+class lod_pyramid:
+
+    factor = 4          #each level has 1/factor the points of the one before
+    min_points = 1024   #stop when a level would have fewer points than this
+
+    #scale: multiplier applied to the values as they are read, so the levels can be kept as raw integers (must be > 0)
+    def __init__(self, times, values, scale=1):
+        self.scale = scale
+        self.levels = [(np.asarray(times), np.asarray(values))]
+        while len(self.levels[-1][0]) > self.min_points*self.factor:
+            times, values = self.levels[-1]
+            self.levels.append(minmax(times, values, len(times)//self.factor))
+
+    #number of samples at full resolution
+    def __len__(self):
+        return len(self.levels[0][0])
+
+    #the samples between t0 and t1 (None for the start/end) reduced to about points samples
+    def get(self, t0=None, t1=None, points=2000):
+        #use the coarsest level that still has at least twice the points needed within the window
+        #(the last level tried is the full resolution one)
+        for times, values in reversed(self.levels):
+            start = 0 if t0 is None else np.searchsorted(times, t0, 'left')
+            stop = len(times) if t1 is None else np.searchsorted(times, t1, 'right')
+            if stop - start >= 2*points:
+                break
+        #include the samples either side of the window, so lines reach the edges of the plot
+        start = max(0, start-1)
+        stop = min(len(times), stop+1)
+        times, values = minmax(times[start:stop], values[start:stop], points)
+        if self.scale != 1 or values.dtype.kind != 'f':
+            values = values * float(self.scale)
+        return times, values
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Engine model - a headless single cylinder four stroke engine simulation, for any number of engines at once.
+
+This is the physics of test scripts/engine_simulation.py (EngineSim, which draws it) and engine_simulator.ino,
+stepped at a fixed time step (1/sim_rate) with every engine's state held in arrays,
+so a batch of engines, or of parameter sets for one engine, is stepped by the same few array operations.
+
+Each step:
+    the stroke (intake, compression, power, exhaust) is the quarter of the 4 pi cycle the crank angle is in
+    at the start of each intake stroke, the charge is taken in: the energy the next power stroke will deliver,
+        ((impulse_max - impulse_min)*throttle + impulse_min) * (1 - exp(-intake_drag*speed)) as engine_simulator.ino
+    during the power stroke, the charge expands (pressure inversely proportional to volume) and the torque on the crank is
+        pressure * d(volume)/d(angle), from the crank and rod geometry, scaled so that each power stroke delivers the charge
+    drag torque, drag*speed, takes in everything else (friction, pumping, compression)
+    the speed is integrated from the torque and the flywheel inertia, and the crank angle from the speed
+A tick (as the rpm counter sees) is counted each time the crank passes top dead centre, once per revolution,
+with its time interpolated within the step.
+
+Only the ratios of the geometry matter (crank radius to rod length, and the compression ratio), so it can be given
+in any units, eg. the pixels EngineSim draws it in.
+
+Parameters are single values, or arrays with a value for each engine.
+A batch of one engine (eg. virtual_ecu's) can be advanced many steps at a time with python floats (advance),
+which gives the same results as step, many times faster than the array operations are for one value.
+
+@author: AlexT-38
+"""
+
+import math
+import numpy as np
+
+
+#engine_simulator.ino, with the impulse and drag scaled to a small engine (about 7Nm, 3600 rpm at full throttle)
+SIM_RATE_Hz = 2000              #steps per second
+SIM_MASS_kgm2 = 0.05            #flywheel inertia (kg.m2)
+SIM_SHAFT_DRAG_Nms_rad = 0.012  #drag torque per rad/s of speed (Nm.s/rad)
+SIM_IMPULSE_MAX = 80.0          #energy per power stroke at full throttle (J)
+SIM_IMPULSE_MIN = SIM_IMPULSE_MAX*0.1
+SIM_INTAKE_DRAG = 0.1           #charge falls off at low speed: charge *= 1 - exp(-SIM_INTAKE_DRAG*speed (rad/s))
+
+INTAKE_STROKE = 0
+COMP_STROKE = 1
+POWER_STROKE = 2
+EXHAUST_STROKE = 3
+
+CYCLE = 4*np.pi                 #crank angle of a four stroke cycle
+REVOLUTION = 2*np.pi
+
+
+def rpm_to_rads(rpm):
+    return rpm * (np.pi/30)
+
+def rads_to_rpm(rads):
+    return rads * (30/np.pi)
+
+
+#crank angle (0 at top dead centre) to piston travel (0 at top dead centre, 1 at bottom),
+#and the rate of change of travel with crank angle
+def piston_travel(angle, crank_radius, rod_length):
+    s, c = np.sin(angle), np.cos(angle)
+    root = np.sqrt(np.square(rod_length) - np.square(crank_radius*s))
+    height = crank_radius*c + root                      #piston pin above the crank axis
+    travel = (rod_length + crank_radius - height) / (2*crank_radius)
+    rate = (s + crank_radius*s*c/root) / 2
+    return travel, rate
+
+
+# engine_batch steps a batch of engines
+class engine_batch:
+    # engines:     number of engines
+    # sim_rate:    steps per second
+    # speed_rpm:   speed at the start
+    # throttle:    0 to 1, can be changed between steps
+    # geometry:    crank_radius, rod_length, comp_ratio
+    # physics:     inertia (kg.m2), drag (Nm.s/rad), impulse_max/min (J), intake_drag
+    def __init__(self, engines=1, sim_rate=SIM_RATE_Hz, speed_rpm=1500, throttle=0.5,
+                 crank_radius=50, rod_length=200, comp_ratio=8,
+                 inertia=SIM_MASS_kgm2, drag=SIM_SHAFT_DRAG_Nms_rad,
+                 impulse_max=SIM_IMPULSE_MAX, impulse_min=SIM_IMPULSE_MIN, intake_drag=SIM_INTAKE_DRAG):
+        self.engines = int(engines)
+        self.sim_rate = sim_rate
+        self.dt = 1/sim_rate
+        shape = (self.engines,)
+        def parameter(value):
+            return np.broadcast_to(np.asarray(value, np.float64), shape).copy()
+        self.crank_radius = parameter(crank_radius)
+        self.rod_length = parameter(rod_length)
+        self.comp_ratio = parameter(comp_ratio)
+        self.inertia = parameter(inertia)
+        self.drag = parameter(drag)
+        self.impulse_max = parameter(impulse_max)
+        self.impulse_min = parameter(impulse_min)
+        self.intake_drag = parameter(intake_drag)
+        self.throttle = parameter(throttle)
+
+        #clearance volume, in swept volumes, and the expansion torque scale that makes a power stroke deliver its charge
+        self.clearance = 1/(self.comp_ratio - 1)
+        self.expansion = 1/np.log(self.comp_ratio)
+
+        self.time = 0.0                                     #s since the start
+        self.angle = np.zeros(shape)                        #crank angle, 0 to 4 pi, 0 is top dead centre at the start of intake
+        self.speed = parameter(rpm_to_rads(speed_rpm))      #rad/s
+        self.charge = np.zeros(shape)                       #energy the next power stroke delivers (J)
+        self.stroke = np.full(shape, EXHAUST_STROKE, np.int8)
+        self.torque = np.zeros(shape)                       #net torque of the last step (Nm)
+        self.ticks = np.zeros(shape, np.int64)              #ticks counted since the start
+
+    def __len__(self):
+        return self.engines
+
+    @property
+    def rpm(self):
+        return rads_to_rpm(self.speed)
+
+    def set_throttle(self, throttle):
+        self.throttle[:] = throttle
+
+    #charge taken in at the start of an intake stroke
+    def intake(self):
+        charge = (self.impulse_max - self.impulse_min)*self.throttle + self.impulse_min
+        return charge * (1 - np.exp(-self.intake_drag*self.speed))
+
+    #advance every engine by one step
+    #physics: False to turn at a fixed speed, without any torque
+    #returns the time of the tick in this step of each engine, nan for engines without one
+    def step(self, physics=True):
+        dt = self.dt
+        if physics:
+            stroke = (self.angle // np.pi).astype(np.int8)
+            intake = (stroke == INTAKE_STROKE) & (self.stroke != INTAKE_STROKE)
+            if intake.any():
+                self.charge = np.where(intake, self.intake(), self.charge)
+            self.stroke = stroke
+            power = stroke == POWER_STROKE
+            if power.any():
+                travel, rate = piston_travel(self.angle, self.crank_radius, self.rod_length)
+                power = np.where(power, self.charge*self.expansion*rate/(travel + self.clearance), 0)
+            else:
+                power = 0
+            self.torque = power - self.drag*self.speed
+            self.speed = np.maximum(self.speed + self.torque/self.inertia*dt, 0)
+
+        angle = self.angle + self.speed*dt
+        #a tick at each revolution, timed by where in the step the crank passed top dead centre
+        tdc = np.where(self.angle < REVOLUTION, REVOLUTION, CYCLE)
+        passed = angle >= tdc
+        tick_time = np.full(self.angle.shape, np.nan)
+        if passed.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = (tdc - self.angle) / (angle - self.angle)
+            tick_time[passed] = self.time + np.clip(fraction[passed], 0, 1)*dt
+            self.ticks += passed
+            self.angle = np.where(angle >= CYCLE, angle - CYCLE, angle)
+        else:
+            self.angle = angle
+        self.time += dt
+        return tick_time
+
+    #advance a batch of one engine by a number of steps, as step() would, with python floats rather than arrays
+    #(for one engine, each array operation costs far more than the sum it does, and a step is a few dozen of them)
+    #returns the list of tick times in those steps
+    def advance(self, steps):
+        if self.engines != 1:
+            raise ValueError(f"advance steps a batch of one engine, not {self.engines}")
+        dt = self.dt
+        crank_radius, rod_length = float(self.crank_radius[0]), float(self.rod_length[0])
+        inertia, drag, throttle = float(self.inertia[0]), float(self.drag[0]), float(self.throttle[0])
+        expansion, clearance = float(self.expansion[0]), float(self.clearance[0])
+        impulse_max, impulse_min, intake_drag = float(self.impulse_max[0]), float(self.impulse_min[0]), float(self.intake_drag[0])
+        t, angle, speed, charge = self.time, float(self.angle[0]), float(self.speed[0]), float(self.charge[0])
+        last_stroke, torque, ticks = int(self.stroke[0]), float(self.torque[0]), 0
+        tick_times = []
+        for n in range(int(steps)):
+            stroke = int(angle // math.pi)
+            if stroke == INTAKE_STROKE and last_stroke != INTAKE_STROKE:
+                charge = ((impulse_max - impulse_min)*throttle + impulse_min) * (1 - math.exp(-intake_drag*speed))
+            last_stroke = stroke
+            power = 0.0
+            if stroke == POWER_STROKE:
+                s, c = math.sin(angle), math.cos(angle)
+                root = math.sqrt(rod_length*rod_length - (crank_radius*s)*(crank_radius*s))
+                travel = (rod_length + crank_radius - (crank_radius*c + root)) / (2*crank_radius)
+                rate = (s + crank_radius*s*c/root) / 2
+                power = charge*expansion*rate/(travel + clearance)
+            torque = power - drag*speed
+            speed = max(speed + torque/inertia*dt, 0.0)
+
+            new_angle = angle + speed*dt
+            tdc = REVOLUTION if angle < REVOLUTION else CYCLE
+            if new_angle >= tdc:
+                fraction = (tdc - angle) / (new_angle - angle)
+                tick_times.append(t + min(max(fraction, 0.0), 1.0)*dt)
+                ticks += 1
+                if new_angle >= CYCLE:
+                    new_angle -= CYCLE
+            angle = new_angle
+            t += dt
+
+        self.time = t
+        self.angle[0], self.speed[0], self.charge[0] = angle, speed, charge
+        self.stroke[0], self.torque[0] = last_stroke, torque
+        self.ticks[0] += ticks
+        return tick_times
+
+    #run every engine for a number of steps
+    #throttle: None to keep the throttle as it is, a value or one per engine, or a function of time (s) that returns either
+    #record:   keep the speed (rpm) of each engine every record steps, 0 not to
+    #returns (tick times, speeds), tick times is a list of an array of tick times (s) for each engine,
+    #speeds is an array of (records, engines), or None if not recorded
+    def run(self, steps, throttle=None, record=0, physics=True):
+        ticks = [[] for n in range(self.engines)]
+        speeds = []
+        for n in range(int(steps)):
+            if callable(throttle):
+                self.set_throttle(throttle(self.time))
+            elif throttle is not None and n == 0:
+                self.set_throttle(throttle)
+            tick_time = self.step(physics)
+            ticked = np.flatnonzero(~np.isnan(tick_time))
+            for engine in ticked:
+                ticks[engine].append(tick_time[engine])
+            if record and n % record == 0:
+                speeds.append(self.rpm)
+        ticks = [np.array(times) for times in ticks]
+        return ticks, (np.array(speeds) if record else None)
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description="run a batch of engines headless, and report their speed and how fast it ran")
+    parser.add_argument('--engines', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=10, help="simulated time")
+    parser.add_argument('--rate', type=float, default=SIM_RATE_Hz, help="steps per second")
+    args = parser.parse_args()
+
+    #a spread of throttle positions, one per engine
+    batch = engine_batch(args.engines, args.rate, throttle=np.linspace(0, 1, args.engines))
+    start = time.perf_counter()
+    ticks, speeds = batch.run(args.seconds*args.rate, record=int(args.rate/10))
+    elapsed = time.perf_counter() - start
+    print(f"{args.engines} engines x {args.seconds} s in {elapsed:.2f} s: {args.engines*args.seconds/elapsed:.0f} x real time")
+    for n in np.linspace(0, args.engines-1, min(args.engines, 5)).astype(int):
+        print(f"throttle {batch.throttle[n]:.2f}: {batch.rpm[n]:7.0f} rpm, {len(ticks[n])} ticks")
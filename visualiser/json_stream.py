@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Streaming reader for version 4 (JSON) log files.
+
+json.load() builds the whole log as python objects before anything can be done with it,
+which for a day of SD card logging is several times the size of the file.
+This reads the file in chunks, decodes the header as a whole,
+and then decodes the 'records' array one record at a time,
+so only the record currently being parsed is held as python objects.
+
+Log files that were cut short (power removed while logging, so the
+closing brackets were never written) are read up to the last complete record.
+
+@author: AlexT-38
+"""
+
+import json
+import os
+import codecs
+
+
+class v4_stream_reader:
+
+    chunk_size = 1<<16          #bytes read from the file at a time
+    max_record_size = 1<<22     #give up if a single record is larger than this (corrupt file)
+
+    # file:     log file, opened in binary mode
+    # progress: optional function(bytes_read, total_bytes), called after each chunk is read
+    def __init__(self, file, progress=None):
+        self.file = file
+        self.progress = progress
+        self.decoder = json.JSONDecoder()
+        #the log is expected to be utf-8, but some serial captures have latin-1 degree signs in them
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        try:
+            self.total_bytes = os.fstat(file.fileno()).st_size
+        except (AttributeError, OSError):
+            self.total_bytes = 0
+        self.bytes_read = 0
+
+        self.text = ""          #decoded text not yet consumed
+        self.pos = 0            #position of the next unconsumed character in text
+        self.eof = False
+
+        self.header = None
+        self.first_record = None
+        self.first_record_size = 0
+        self.truncated = False
+        self.after_record = False   #a record has been read, so a separator is expected before the next
+
+        self.read_header()
+
+    #read the next chunk from the file, dropping any text that has already been consumed
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if self.progress is not None:
+            self.progress(self.bytes_read, self.total_bytes)
+        if not chunk:
+            self.eof = True
+            self.text = self.text[self.pos:] + self.text_decoder.decode(b"", final=True)
+        else:
+            self.text = self.text[self.pos:] + self.text_decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    #skip whitespace, return the next character (or None at the end of the file)
+    def peek(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        c = self.peek()
+        if c is None or c not in chars:
+            raise ValueError(f"expected '{chars}' at byte ~{self.bytes_read - len(self.text) + self.pos}, got {c!r}")
+        self.pos += 1
+        return c
+
+    #decode the next complete json value, reading more of the file as needed
+    #returns None if the file ends before the value is complete
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+                size = end - self.pos
+                self.pos = end
+                return value, size
+            except json.JSONDecodeError:
+                if len(self.text) - self.pos > self.max_record_size:
+                    raise ValueError(f"record at byte ~{self.bytes_read - len(self.text) + self.pos} is corrupt or too long")
+                if not self.fill():
+                    return None, 0
+
+    #read the top level object up to the start of the records array
+    def read_header(self):
+        self.expect("{")
+        while True:
+            key, size = self.decode()
+            if key is None:
+                raise ValueError("log file ends before records")
+            self.expect(":")
+            if key == 'records':
+                self.expect("[")
+                break
+            value, size = self.decode()
+            if value is None:
+                raise ValueError(f"log file ends in '{key}'")
+            if key == 'header':
+                self.header = value
+            self.expect(",")
+
+        if self.header is None:
+            raise ValueError("no header before records")
+
+        #decode the first record now, so its size can be used to estimate the number of records
+        self.first_record, self.first_record_size = self.next_record()
+
+    #get the next record, or None at the end of the records array
+    def next_record(self):
+        c = self.peek()
+        #step over the separator after the previous record here, rather than straight after decoding it,
+        #so a record is returned as soon as it is complete (which matters when reading from a serial port)
+        if self.after_record:
+            if c == ",":
+                self.pos += 1
+                c = self.peek()
+            elif c is not None and c != "]":
+                self.expect(",]")
+        if c == "]" or c is None:
+            self.truncated = c is None
+            return None, 0
+        record, size = self.decode()
+        if record is None:
+            self.truncated = True
+            return None, 0
+        self.after_record = True
+        return record, size
+
+    #estimate of the number of records in the file, for sizing buffers
+    def estimated_records(self):
+        if not self.first_record_size:
+            return 0
+        return max(1, self.total_bytes // self.first_record_size)
+
+    def __iter__(self):
+        record = self.first_record
+        self.first_record = None
+        while record is not None:
+            yield record
+            record, size = self.next_record()
+        if self.truncated:
+            print("log file is truncated, read up to the last complete record")
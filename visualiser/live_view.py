@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Live view of records streamed from the controller's serial port.
+
+serial.ino sends the same json log as is written to the sd card (or binary records, if do_serial_write_hex is set).
+A reader thread decodes records as they arrive and queues them, and a timer on the plot window
+collates whatever has been queued since the last frame, with the same parser used for log files,
+into a ring buffer per channel holding the last window_s seconds.
+
+Frames are drawn at most fps times a second. Lines are drawn animated over a cached background of their axes,
+so a frame only redraws the axes with new data, and the whole figure is only redrawn
+when an axis has to be rescaled (when the data reaches the right hand edge, or goes out of range).
+
+The source can be a serial port (needs pyserial), a pty, a tcp socket (host:port) or a log file (which is followed as it grows),
+so the viewer can be tested without the controller, eg. with virtual_ecu.py, or by writing a log file to a pty.
+
+usage: python live_view.py <port, host:port or file> [--baud B] [--binary] [--window S] [--fps F]
+
+@author: AlexT-38
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import numpy as np
+import matplotlib.pyplot as plt
+
+try:
+    import serial   #pyserial, only needed to read from a serial port
+except ImportError:
+    serial = None
+
+from data_channel import ring_buffer
+from json_stream import v4_stream_reader
+from binary_records import firmware_config, firmware_header, data_record_dtype, read_records, STORAGE_HEADER_SIZE
+from log_file_visualiser import log_file
+
+
+# live_source reads whatever bytes are available from a serial port, pty, tcp socket or growing file
+# read() waits for data rather than returning nothing, so the stream readers see it as a slow file
+class live_source:
+
+    poll_interval = 0.01    #seconds between checks for new data, when the source can't block
+
+    # path:   serial port, pty, host:port or file
+    # baud:   serial port baud rate (the firmware uses 1000000)
+    # follow: wait for more data at the end of a file, rather than ending
+    def __init__(self, path, baud=1000000, follow=True):
+        self.stopped = False
+        self.follow = follow
+        self.port = None
+        self.file = None
+        self.socket = None
+        if is_address(path):
+            host, port = path.rsplit(':', 1)
+            self.socket = socket.create_connection((host, int(port)))
+        elif os.path.isfile(path) or serial is None:
+            #unbuffered, so reads return as soon as there is any data
+            self.file = open(path, 'rb', buffering=0)
+        else:
+            self.port = serial.Serial(path, baud, timeout=self.poll_interval)
+
+    def read(self, size=-1):
+        size = size if size > 0 else 1<<12
+        while not self.stopped:
+            if self.port is not None:
+                data = self.port.read(max(1, min(size, self.port.in_waiting)))
+            elif self.socket is not None:
+                try:
+                    #blocks until there is data, returns nothing once the other end has closed
+                    return self.socket.recv(size)
+                except OSError:
+                    return b""
+            else:
+                try:
+                    data = self.file.read(size)
+                except OSError:
+                    #the other end of a pty was closed
+                    return b""
+                if not data and not self.follow:
+                    return b""
+            if data:
+                return data
+            time.sleep(self.poll_interval)
+        return b""
+
+    def close(self):
+        self.stopped = True
+        if self.port is not None:
+            self.port.close()
+        if self.file is not None:
+            self.file.close()
+        if self.socket is not None:
+            self.socket.close()
+
+
+#True if a source is a host:port rather than a port or file
+def is_address(path):
+    host, sep, port = path.rpartition(':')
+    return bool(sep and host and port.isdigit()) and not os.path.exists(path)
+
+
+# live_log collects the records read from a live source into a ring buffer per channel
+class live_log:
+
+    max_tick_rate = 100     #most rpm counter ticks per second (6000 rpm), to size the spd buffer
+
+    # source:   live_source, or any object with read(size)
+    # binary:   the source sends binary records, rather than json
+    # window_s: number of seconds of data to keep
+    def __init__(self, source, binary=False, window_s=60):
+        self.source = source
+        self.binary = binary
+        self.window_s = window_s
+        self.config = firmware_config(**log_file.binary_config)
+        self.header = None
+        self.pending = []           #records read but not yet collated
+        self.lock = threading.Lock()
+        self.buffers = {}           #(channel name, index) : ring_buffer
+        self.t0 = None              #timestamp (ms) of the first record
+        self.latest = 0             #time (s from the first record) of the end of the latest record
+        self.records = 0
+        self.finished = False
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    #reader thread
+    def read(self):
+        try:
+            if self.binary:
+                self.read_binary()
+            else:
+                self.read_json()
+        except (OSError, ValueError) as e:
+            print("live source:", e)
+        self.finished = True
+
+    def read_json(self):
+        reader = v4_stream_reader(self.source)
+        self.header = reader.header
+        for record in reader:
+            with self.lock:
+                self.pending.append(record)
+
+    def read_binary(self):
+        self.header = firmware_header(self.config)
+        frame = STORAGE_HEADER_SIZE + data_record_dtype(self.config).itemsize
+        data = b""
+        while True:
+            chunk = self.source.read(1<<12)
+            if not chunk:
+                break
+            data += chunk
+            records, offsets = read_records(data, self.config)
+            if len(records):
+                with self.lock:
+                    self.pending.append(records)
+                data = data[offsets[-1] + frame:]
+            elif len(data) > 2*frame:
+                #no record in two records worth of data, keep only what could be the start of one
+                data = data[-frame:]
+
+    #number of samples to buffer for a channel
+    def capacity(self, channel, record_interval):
+        if channel.name == 'spd':
+            return self.window_s * self.max_tick_rate
+        if channel.rate:
+            return self.window_s / channel.rate
+        return self.window_s / record_interval
+
+    #collate the records read since the last update
+    #returns the set of (channel name, index) that have new data
+    def update(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending or self.header is None:
+            return set()
+
+        #the queued records are parsed as a short log of their own
+        batch = log_file.__new__(log_file)
+        if self.binary:
+            records = np.concatenate(pending)
+            batch.parse_binary_records(records, self.config)
+            t = int(records['timestamp'][0])
+        else:
+            batch.parse_v4_records(self.header, pending, len(pending))
+            t = pending[0]['timestamp']
+        if self.t0 is None:
+            self.t0 = t
+        offset = (t - self.t0)/1000
+        self.records += len(batch.AVG_t)
+        self.latest = max(self.latest, offset + batch.AVG_t[-1] + batch.RECORD_INTERVAL)
+
+        changed = set()
+        for name, channels in batch.channels.items():
+            for channel in channels:
+                if channel.times is None or len(channel) == 0:
+                    continue
+                key = (name, channel.index)
+                if key not in self.buffers:
+                    self.buffers[key] = ring_buffer(self.capacity(channel, batch.RECORD_INTERVAL))
+                self.buffers[key].append(channel.values, channel.times + offset)
+                changed.add(key)
+        return changed
+
+
+# live_view plots the channels of a live_log, redrawing only the axes that have new data
+class live_view:
+
+    #axes to plot, each a title and a list of (channel name, index, label, function of the values to plot)
+    PLOTS = [('Engine Speed (RPM)', [('spd', 0, 'from tick times', lambda v: 60000/v)]),
+             ('EGT (°C)',           [('egt', 0, 'EGT 0', None), ('egt', 1, 'EGT 1', None)]),
+             ('RPM PID',            [('pid.trg', 0, 'trg', None), ('pid.act', 0, 'act', None), ('pid.out', 0, 'out', None)])]
+
+    def __init__(self, log, fps=20, plots=None):
+        self.log = log
+        self.fps = fps
+        self.fig, axes = plt.subplots(len(plots or self.PLOTS), 1, sharex=True, squeeze=False)
+        self.canvas = self.fig.canvas
+        self.axes = []              #list of (axes, {(name, index) : (line, function)})
+        for ax, (title, channels) in zip(axes[:, 0], plots or self.PLOTS):
+            lines = {}
+            for name, index, label, function in channels:
+                line, = ax.plot([], [], label=label, animated=True)
+                lines[(name, index)] = (line, function)
+            ax.set_title(title)
+            ax.legend(loc='upper left')
+            ax.set_ylim(0, 1)
+            self.axes.append((ax, lines))
+        axes[-1, 0].set_xlabel("time (s)")
+        self.x_min = 0
+        self.set_x_range(0)
+        self.backgrounds = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.timer = None
+
+    #scroll the time axis so that t is half way across it
+    def set_x_range(self, t):
+        self.x_min = max(0, t - self.log.window_s/2)
+        self.axes[0][0].set_xlim(self.x_min, self.x_min + self.log.window_s)
+
+    #after a full redraw, keep the background of each axes, and draw the lines over it
+    def on_draw(self, event):
+        self.backgrounds = {ax: self.canvas.copy_from_bbox(ax.bbox) for ax, lines in self.axes}
+        for ax, lines in self.axes:
+            for line, function in lines.values():
+                ax.draw_artist(line)
+
+    #update the lines of channels with new data, and redraw what changed
+    #returns False to stop the timer (which drops a callback that returns False) once the source has finished
+    def frame(self):
+        changed = self.log.update()
+        if not changed:
+            return not (self.log.finished and not self.log.pending)
+        redraw = self.backgrounds is None
+        if self.log.latest > self.x_min + self.log.window_s:
+            self.set_x_range(self.log.latest)
+            redraw = True
+
+        dirty = []
+        for ax, lines in self.axes:
+            updated = False
+            for key, (line, function) in lines.items():
+                if key not in changed:
+                    continue
+                buffer = self.log.buffers[key]
+                values = buffer.values if function is None else function(buffer.values)
+                line.set_data(buffer.times, values)
+                updated = True
+                #grow the y axis to fit, with a margin so this isn't needed every frame
+                if len(values):
+                    low, high = ax.get_ylim()
+                    v_min, v_max = np.nanmin(values), np.nanmax(values)
+                    if v_min < low or v_max > high:
+                        margin = 0.1*max(v_max - v_min, 1)
+                        ax.set_ylim(min(low, v_min - margin), max(high, v_max + margin))
+                        redraw = True
+            if updated:
+                dirty.append((ax, lines))
+
+        if redraw:
+            #on_draw redraws the lines
+            self.canvas.draw()
+            self.canvas.blit(self.fig.bbox)
+        else:
+            for ax, lines in dirty:
+                self.canvas.restore_region(self.backgrounds[ax])
+                for line, function in lines.values():
+                    ax.draw_artist(line)
+                self.canvas.blit(ax.bbox)
+        self.canvas.flush_events()
+        return True
+
+    #start redrawing at fps, and show the window
+    def show(self):
+        self.timer = self.canvas.new_timer(interval=int(1000/self.fps))
+        self.timer.add_callback(self.frame)
+        self.timer.start()
+        plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="live plot of records streamed by the controller")
+    parser.add_argument('source', help="serial port, pty, host:port or log file")
+    parser.add_argument('--baud', type=int, default=1000000)
+    parser.add_argument('--binary', action='store_true', help="the source sends binary records")
+    parser.add_argument('--window', type=float, default=60, help="seconds of data to show")
+    parser.add_argument('--fps', type=float, default=20, help="most frames drawn per second")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source) and not is_address(args.source):
+        sys.exit(f"no such port or file: {args.source}")
+    source = live_source(args.source, args.baud)
+    view = live_view(live_log(source, args.binary, args.window), args.fps)
+    try:
+        view.show()
+    finally:
+        source.close()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Binary cache of parsed log files.
+
+Parsing a long log takes far longer than plotting it, and the result is the same every time,
+so once a log has been parsed all of its channels are written to a sidecar file next to it (<log>.cache, ignored by git).
+The next time the log is opened the cache is memory mapped instead,
+so channels are only read from disk as they are used.
+
+The cache is keyed on the log's absolute path, size and modification time,
+the parser version and any options that change the parsed data,
+a cache that doesn't match is ignored and rewritten.
+
+File layout:
+    magic (4 bytes), index length (8 bytes, little endian), index (json)
+    padding to CACHE_ALIGN
+    each array's raw data, padded to CACHE_ALIGN
+
+The index holds the key, the fields (with arrays and channels replaced by references to the arrays)
+and the dtype, shape and offset (from the end of the index padding) of each array.
+Arrays referenced more than once (eg. timestamps shared by channels) are stored once.
+
+@author: AlexT-38
+"""
+
+import json
+import os
+import numpy as np
+
+from data_channel import data_channel
+
+
+CACHE_MAGIC = b"OGLC"
+CACHE_ALIGN = 64
+CACHE_EXT = ".cache"
+
+
+def cache_path(path):
+    return path + CACHE_EXT
+
+#key identifying the source file and the parser that produced the cache
+def cache_key(path, parser_version, options):
+    st = os.stat(path)
+    return {'path'    : os.path.abspath(path),
+            'size'    : st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'parser'  : parser_version,
+            'options' : options}
+
+def aligned(n):
+    return (n + CACHE_ALIGN - 1) // CACHE_ALIGN * CACHE_ALIGN
+
+
+#values that can't be cached are skipped
+SKIP = object()
+
+
+#write the given fields to a cache file
+#fields is a dict of name : value, where values are scalars, ndarrays, data_channels, or lists and dicts of those
+#anything else is not cached
+def save_cache(path, key, fields):
+    arrays = []
+    array_ids = {}
+    data = []
+    offset = 0
+
+    #arrays are stored once, however many times they are referenced (eg. timestamps shared between channels)
+    def add_array(value):
+        nonlocal offset
+        interface = value.__array_interface__
+        array_id = (interface['data'][0], value.shape, value.strides, value.dtype.str)
+        if array_id not in array_ids:
+            value = np.ascontiguousarray(value)
+            array_ids[array_id] = len(arrays)
+            arrays.append({'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset})
+            data.append(value)
+            offset = aligned(offset + value.nbytes)
+        return {'$array': array_ids[array_id]}
+
+    def encode(value):
+        if isinstance(value, np.ndarray):
+            return add_array(value)
+        if isinstance(value, data_channel):
+            return {'$channel': {'name': value.name, 'index': value.index, 'units': value.units, 'scale': value.scale,
+                                 'rate': value.rate, 'factor': value.factor,
+                                 'values': add_array(value.raw),
+                                 'times': None if value.times is None else add_array(value.times)}}
+        if isinstance(value, dict):
+            items = {str(k): encode(v) for k, v in value.items()}
+            return {'$dict': {k: v for k, v in items.items() if v is not SKIP}}
+        if isinstance(value, (list, tuple)):
+            items = [encode(v) for v in value]
+            return SKIP if SKIP in items else items
+        if isinstance(value, (str, bool, int, float, type(None))):
+            return value
+        if isinstance(value, np.generic):
+            return value.item()
+        return SKIP
+
+    encoded = {name: encode(value) for name, value in fields.items()}
+    encoded = {name: value for name, value in encoded.items() if value is not SKIP}
+
+    index = json.dumps({'key': key, 'fields': encoded, 'arrays': arrays}).encode()
+    header = CACHE_MAGIC + len(index).to_bytes(8, 'little') + index
+
+    #write to a temporary file first, so an interrupted write never leaves a valid looking cache
+    #(a failed write is removed, so it doesn't leave a temporary file next to the log)
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(header)
+            file.write(bytes(aligned(len(header)) - len(header)))
+            for value in data:
+                file.write(value.tobytes())
+                file.write(bytes(aligned(value.nbytes) - value.nbytes))
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+#read the fields from a cache file, if it exists and matches the key
+#arrays are memory mapped copy-on-write, so they can be modified without changing the cache
+#returns None if there is no valid cache
+def load_cache(path, key):
+    try:
+        with open(path, 'rb') as file:
+            if file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            length = int.from_bytes(file.read(8), 'little')
+            index = json.loads(file.read(length))
+    except (OSError, ValueError):
+        return None
+
+    if index.get('key') != key:
+        return None
+
+    data_start = aligned(len(CACHE_MAGIC) + 8 + length)
+    if os.path.getsize(path) > data_start:
+        buffer = np.memmap(path, dtype=np.uint8, mode='c', offset=data_start)
+    else:
+        buffer = np.zeros(0, np.uint8)
+
+    arrays = []
+    for entry in index['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        start = entry['offset']
+        count = int(np.prod(shape))
+        if start < 0 or start + count*dtype.itemsize > len(buffer):
+            return None     #truncated, the index says there is more data than there is
+        arrays.append(buffer[start:start + count*dtype.itemsize].view(dtype).reshape(shape))
+
+    def decode(value):
+        if isinstance(value, list):
+            return [decode(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+        if '$array' in value:
+            return arrays[value['$array']]
+        if '$channel' in value:
+            value = value['$channel']
+            channel = data_channel(value['name'], value['index'], 0, value['units'], value['scale'], rate=value.get('rate'))
+            channel.set(decode(value['values']), decode(value['times']))
+            channel.calibrate(value.get('factor', 1))
+            return channel
+        return {k: decode(v) for k, v in value['$dict'].items()}
+
+    return {name: decode(value) for name, value in index['fields'].items()}
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Export of parsed logs to columnar files and csv.
+
+Channels are exported in groups of channels with the same timestamps (see data_channel.share_times),
+so each group is one table with a time column and a column per channel:
+    eg. usr_0 ... usr_3 and trq_0 are sampled together, egt_0 has its own rate, spd_0 is one row per tick,
+    and the per record averages (with rpm_no and rpm_offset) are one row per record.
+
+Each group is written as an Arrow IPC file (or parquet) if pyarrow is installed,
+otherwise all of the groups go into one numpy .npz file, and optionally also as a csv file per group.
+Arrow, parquet and csv outputs are written in one pass over each group, a chunk of rows at a time,
+so nothing the size of the log is built up in memory beyond the parsed channels themselves.
+The npz holds the parsed arrays themselves, as they are.
+
+The units, scale, rate and range of each channel (from the log header sensors/servos/pid descriptors)
+and the log's own details are written as metadata: in the arrow schema, in the npz as a 'metadata' entry,
+and alongside the csv files as <out>.meta.json.
+
+Columns are named <sensor>_<index>, eg. usr_0, egt_1, pid.trg_0 - the parsed values, as plotted.
+Channels keep their values as logged, with a calibration factor (see data_channel.calibrate),
+which is applied as each chunk is written, so the calibrated values are never held all at once.
+The npz columns are the values as logged, calibrated by multiplying by the 'factor' in their metadata.
+Times are in seconds from the start of the log.
+
+usage: python log_export.py <log file> [--out BASE] [--format arrow|parquet|npz] [--no-csv]
+
+@author: AlexT-38
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+try:
+    import pyarrow as pa    #only needed for arrow and parquet output
+except ImportError:
+    pa = None
+
+from log_file_visualiser import log_file, header_descs
+
+
+CHUNK_ROWS = 1<<16      #rows written at a time
+CSV_FORMAT = '%.10g'
+
+
+#metadata of a channel, from the channel and its header descriptor
+def channel_metadata(channel, descs):
+    desc = descs.get(channel.name.split('.')[0], {})
+    meta = {'name': channel.name, 'index': channel.index, 'units': channel.units, 'scale': channel.scale,
+            'factor': channel.factor, 'rate_s': channel.rate}
+    for key in ['min', 'max', 'rate', 'rate_units']:
+        if key in desc:
+            meta[key] = desc[key]
+    return meta
+
+
+#metadata of the log as a whole
+def log_metadata(log):
+    return {'path': log.path, 'version': log.record_version, 'firmware': getattr(log, 'firmware', None),
+            'date': log.date, 'time': log.time, 'rate_ms': log.RECORD_INTERVAL_ms, 'header': log.header}
+
+
+#the channels of a log in groups that share timestamps
+#returns a list of (group name, times, [(column name, raw values, metadata)]), metadata 'factor' calibrates the raw values
+def channel_groups(log):
+    descs = header_descs(log.header) if log.header else {}
+    groups = []
+    def add_group(name, channels):
+        found = {}      #(address, length) of the timestamps : group
+        for channel in channels:
+            times = channel.times
+            if times is None or len(times) == 0:
+                continue
+            key = (times.__array_interface__['data'][0], len(times))
+            if key not in found:
+                found[key] = (name, times, [])
+                groups.append(found[key])
+            found[key][2].append((f"{channel.name}_{channel.index}", channel.raw, channel_metadata(channel, descs)))
+    add_group('samples', [channel for channels in log.channels.values() for channel in channels])
+    add_group('records', [channel for channels in log.averages.values() for channel in channels])
+
+    #the per record arrays go with the other per record values
+    records = [group for group in groups if group[0] == 'records' and len(group[1]) == len(log.AVG_t)]
+    if not records:
+        records = [('records', log.AVG_t, [])]
+        groups.append(records[0])
+    for name, values, units in [('rpm_no', getattr(log, 'RPM_no', None), None), ('rpm_offset', getattr(log, 'RPM_offset', None), 'ms')]:
+        if values is not None and len(values) == len(log.AVG_t):
+            records[0][2].append((name, values, {'name': name, 'units': units}))
+
+    #name each group after its first column, so the file names say what is in them
+    names = set()
+    for n, (group, times, columns) in enumerate(groups):
+        name = group if group == 'records' else columns[0][0].rsplit('_', 1)[0]
+        while name in names:
+            name += '_'
+        names.add(name)
+        groups[n] = (name, times, columns)
+    return groups
+
+
+# csv_writer writes a group to a csv file, a chunk of rows at a time
+class csv_writer:
+    def __init__(self, path, names):
+        self.file = open(path, 'w', newline='')
+        self.file.write(','.join(names) + '\n')
+
+    def write(self, columns):
+        np.savetxt(self.file, np.column_stack(columns), fmt=CSV_FORMAT, delimiter=',')
+
+    def close(self):
+        self.file.close()
+
+
+# arrow_writer writes a group to an Arrow IPC file or a parquet file, a record batch at a time
+class arrow_writer:
+    def __init__(self, path, names, columns, metadata, log_meta, parquet=False):
+        fields = [pa.field(name, pa.from_numpy_dtype(column.dtype), metadata={'meta': json.dumps(meta)})
+                  for name, column, meta in zip(names, columns, metadata)]
+        self.schema = pa.schema(fields, metadata={'log': json.dumps(log_meta)})
+        if parquet:
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+        self.parquet = parquet
+
+    def write(self, columns):
+        batch = pa.record_batch([pa.array(column) for column in columns], schema=self.schema)
+        if self.parquet:
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+#export every channel of a log
+# base:   output path without extension, files are named <base>.<group>.<ext>
+# format: 'arrow' or 'parquet' (need pyarrow), or 'npz', None for arrow if pyarrow is installed, otherwise npz
+# csv:    also write a csv file per group
+#returns the list of files written
+def export_log(log, base, format=None, csv=True, chunk_rows=CHUNK_ROWS):
+    if format is None:
+        format = 'arrow' if pa is not None else 'npz'
+    if format in ('arrow', 'parquet') and pa is None:
+        raise ImportError(f"{format} export needs pyarrow, use format 'npz'")
+    if format not in ('arrow', 'parquet', 'npz'):
+        raise ValueError(f"unknown export format '{format}'")
+
+    log_meta = log_metadata(log)
+    groups = channel_groups(log)
+    written = []
+    npz = {}
+    meta = {'log': log_meta, 'groups': {}}
+
+    for name, times, columns in groups:
+        names = ['time_s'] + [column[0] for column in columns]
+        arrays = [times] + [column[1] for column in columns]
+        metadata = [{'name': 'time', 'units': 's'}] + [column[2] for column in columns]
+        factors = [meta.get('factor', 1) for meta in metadata]
+        def calibrated(array, factor):
+            return array if factor == 1 else array * factor
+        meta['groups'][name] = dict(zip(names, metadata))
+
+        writers = []
+        if format in ('arrow', 'parquet'):
+            path = f"{base}.{name}.{format}"
+            writers.append(arrow_writer(path, names, [calibrated(array[:1], factor) for array, factor in zip(arrays, factors)],
+                                        metadata, log_meta, format == 'parquet'))
+            written.append(path)
+        if csv:
+            path = f"{base}.{name}.csv"
+            writers.append(csv_writer(path, names))
+            written.append(path)
+        try:
+            for start in range(0, len(times), chunk_rows):
+                chunk = [calibrated(array[start:start+chunk_rows], factor) for array, factor in zip(arrays, factors)]
+                for writer in writers:
+                    writer.write(chunk)
+        finally:
+            for writer in writers:
+                writer.close()
+
+        if format == 'npz':
+            #the raw arrays of the parsed channels, savez writes them as they are (the metadata has their factors)
+            for column, array in zip(names, arrays):
+                npz[f"{name}/{column}"] = array
+
+    if format == 'npz':
+        npz['metadata'] = np.array(json.dumps(meta))
+        path = base + ".npz"
+        np.savez(path, **npz)
+        written.append(path)
+    if csv:
+        path = base + ".meta.json"
+        with open(path, 'w') as file:
+            json.dump(meta, file, indent=1)
+        written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export a parsed log to arrow/parquet/npz and csv")
+    parser.add_argument('log', help="log file")
+    parser.add_argument('--out', help="output path, without extension (default: the log path)")
+    parser.add_argument('--format', choices=['arrow', 'parquet', 'npz'], help="default: arrow if pyarrow is installed, otherwise npz")
+    parser.add_argument('--no-csv', action='store_true', help="don't write csv files")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.log):
+        sys.exit(f"no such file: {args.log}")
+    log = log_file(args.log)
+    try:
+        written = export_log(log, args.out or os.path.splitext(args.log)[0], args.format, not args.no_csv)
+    except ImportError as e:
+        sys.exit(str(e))
+    for path in written:
+        print("wrote", path)
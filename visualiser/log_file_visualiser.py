@@ -35,765 +35,512 @@ import matplotlib.pyplot as plt
 import os
 import json
 
+from data_channel import sample_buffer, data_channel, share_times, record_sample_times
+from json_stream import v4_stream_reader
+from log_cache import cache_path, cache_key, load_cache, save_cache
+from rpm_ticks import reconstruct_ticks, reconstruct_v3_ticks, non_monotonic_ticks, late_ticks, tick_series
+from v3_reader import v3_reader
+
+
+from decimate import minmax
+from log_viewer import log_viewer
+from binary_records import firmware_config, firmware_header, read_records, record_samples, valid_samples
+
+
+#sample interval (s) of a header descriptor, if it is sampled at a fixed rate, otherwise None
+def sample_rate(desc):
+    if desc.get('rate_units') != 'ms' or not desc.get('rate'):
+        return None
+    return desc['rate']/1000
+
+
+#the descriptor of each named field of a v4 header
+#servos and pids are described seperately to sensors, but are treated the same
+def header_descs(header):
+    descs = {sensor['name'] : sensor for sensor in header.get('sensors', [])}
+    if 'servos' in header:
+        descs['srv'] = header['servos']
+    if 'pid' in header:
+        descs['pid'] = header['pid']
+    return descs
 
-    
 
 # log_file encapsulates all logged data and parses log files
 # takes each record and collates the data for each parameter
 class log_file:
         
-    def __init__(self, path):
+    def __init__(self, path, stream=None, cache=None):
         # open the specified file and attempt to parse data
-        with open(path) as file:
-            print("reading file:", path)
-            self.path = path.lower()
-            if self.path.endswith(".txt"):
-                self.parse_v3(file)
-            elif self.path.endswith(".json") or self.path.endswith(".jsn"):
-                self.parse_v4(file)
+        if stream is None:
+            stream = self.stream_v4
+        if cache is None:
+            cache = self.use_cache
+        self.path = path.lower()
+        print("reading file:", path)
+        if cache and self.load_cache(path):
+            return
+        if self.path.endswith(".bin"):
+            with open(path, 'rb') as file:
+                self.parse_binary(file)
+        elif stream and (self.path.endswith(".json") or self.path.endswith(".jsn")):
+            #the stream reader does its own text decoding
+            with open(path, 'rb') as file:
+                self.parse_v4_stream(file)
+        else:
+            with open(path) as file:
+                if self.path.endswith(".txt"):
+                    self.parse_v3(file)
+                elif self.path.endswith(".json") or self.path.endswith(".jsn"):
+                    self.parse_v4(file)
+        if cache:
+            self.save_cache(path)
                 
     verbose = False         #print extra info about parse process
-    echo = True             #echo input lines for v3 log files
-    detailed_rpm = True     #plot detailed rpm data... plot tacho ticks?
-    detailed_pid = True     #plot detailed pid data...?
+    echo = False            #echo input lines for v3 log files
+    detailed_rpm = True     #open the interactive viewer (log_viewer) after the overview plots
+    detailed_pid = True     #as detailed_rpm
     rpm_pid_no_ms = True    #change the way pid is plotted?
     rpm_pid_native = True   #change the way pid is plotted?
+    stream_v4 = False       #read v4 log files one record at a time, rather than loading the whole file first
+    use_cache = True        #save parsed data to <log>.cache and reuse it next time the log is opened
+    plot_points = 2400      #most points drawn per line (about the width of a plot in pixels), 0 to draw every sample
+    binary_config = {}      #firmware build settings for binary (.bin) logs, if not the defaults, see binary_records.FIRMWARE_CONFIG
+
+    parser_version = 9      #increment whenever a change to parsing changes the parsed data, invalidates old caches
+    cache_options = ['rpm_pid_no_ms', 'rpm_pid_native', 'binary_config'] #options that change the parsed data
 
 
     record_version = None   #record version as per record
     date = None             #record start date as per record
     time = None             #record start time as per record
+    header = None           #v4 log header, as read (generated from the firmware config for binary logs)
     
     RECORD_INTERVAL = 0.5   #record interval as per record (default vaule set here)
     RECORD_INTERVAL_ms = 500
-    EGT_FRACTION = 0.25     #egt value scale - why isn't this taken from sensor config?
-#collated data fields....
-#average values for each record
-    USR_avg = []#[np.array([])]
-    MAP_avg = []#[np.array([])]
-    TMP_avg = []#[np.array([])]
-    EGT_avg = []#[np.array([])]
-    SRV_avg = []#[np.array([])]
-    RPM_avg = np.array([])
-    TRQ_avg = np.array([])
-    POW_avg = np.array([])
-#number of rpm counter ticks each record
-    RPM_no = np.array([]) 
-#rpm calculated from the above tick count
-    RPM_calc = np.array([])
-
-#time stamps for each record
-    AVG_t = np.array([])
-
-#timestamps from each record
-    TIME_t = np.array([])
-
-#rpm interval times
-    RPM_intervals_ms = np.array([])
-#rpm intervals integrated from start of record
-    RPM_tick_times_ms = np.array([])
-    RPM_tick_time_record_s = np.array([]) #timestamps of the record associated with each tick
-    RPM_tick_time_record = np.array([]) #record index associated with each tick
-    RPM_tick_time_record_offset = np.array([]) #tick offset of the record associated with each tick
-#rpm calculated from the above tick intervals
-    RPM_ticks = np.array([])
-    
-    RPM_offset = np.array([])
-    
-    RPM_tick_scale = 0
-
-#analog samples
-    USR = []#[np.array([])]
-    MAP = []#[np.array([])]
-    TMP = []#[np.array([])]
-#load cell samples
-    TRQ = np.array([])
-#timestamps for analog samples
-    ANA_t = np.array([])
-    MAP_t = np.array([])
-
-#egt samples
-    EGT = []#[np.array([])]
-#timestamps for egt samples
-#as each egt is a seperate chip that may fail independantly, each channel needs its own timestamps
-    EGT_t = []#[np.array([])]
-
-#servo/pid samples - not apparently implemented
-    SRV = []#[np.array([])]
-#timestamps for servo samples
-    SRV_t = np.array([])
-
-    PID = [{}]
-    PID_t = [np.array([])]
-
-    PID_k = [{}]
+    RPM_tick_scale = 1      #rpm counter interval units (ms), from the spd sensor scale and units
+    V3_SCALES = {'egt': -2} #power of 2 scale of v3 log sensors, which have no header to say (v4 logs give egt a scale of -2)
+
+#collated data fields are set per log by the parser....
+#   channels : dict of sensor name : list of data_channel, one per sensor index
+#              eg. channels['usr'][0], channels['egt'][1], channels['spd'][0] (tacho intervals at each tick)
+#              pid fields are named 'pid.<field>', eg. channels['pid.trg'][0] is the target of the rpm pid
+#   averages : dict of sensor name : list of data_channel, one value per record
+#              pid coefficients are named 'pid.kp' etc.
+#   AVG_t    : timestamp of each record (s)
+#   RPM_no   : number of rpm counter ticks in each record
+#   RPM_offset : rpm counter tick offset of each record (ms)
+#   RPM_tick_time_record_s, RPM_tick_time_record, RPM_tick_time_record_offset :
+#              timestamp, index and tick offset of the record associated with each tick
+#   RPM_tick_non_monotonic, RPM_tick_late : indices of ticks earlier than the tick before them,
+#              or later than the end of their record (see rpm_ticks)
+
+    #get a channel, or None if it wasn't logged
+    def get_channel(self, name, index=0, averages=False):
+        channels = (self.averages if averages else self.channels).get(name, [])
+        if index < len(channels):
+            return channels[index]
+        return None
+
+    #number of pids logged
+    def no_of_pids(self):
+        return max([len(channels) for name, channels in self.channels.items() if name.startswith('pid.')], default=0)
+
+    #get the fields of a pid as a dict of field : data_channel
+    def get_pid(self, index):
+        return {name[4:] : channels[index] for name, channels in self.channels.items() if name.startswith('pid.') and index < len(channels)}
+
+    #the engine speed at each rpm counter tick (see rpm_ticks.tick_series), or None if no ticks were logged
+    def tick_rpm(self):
+        spd = self.get_channel('spd')
+        if spd is None or spd.times is None:
+            return None
+        return tick_series(spd.times, spd.values)
+
+    #the samples of each channel with t0 <= time < t1 (s from the start of the log), None for the start/end of the log
+    #the windows are found by binary search of the timestamps, so gaps (missing records) and jumps in time are
+    #handled - the times are views of the log's data (copies for channels whose timestamps aren't in order),
+    #the values are calibrated copies of the window
+    # channels: names of the channels to include (eg. ['egt', 'pid.trg']), None for all
+    # averages: from the per record averages, rather than the channels
+    #returns a dict of name : list of (times, values), one per channel index
+    def window(self, t0=None, t1=None, channels=None, averages=False):
+        group = self.averages if averages else self.channels
+        names = group.keys() if channels is None else [name for name in channels if name in group]
+        return {name : [channel.window(t0, t1) for channel in group[name] if channel.times is not None] for name in names}
+
+    #the records with t0 <= timestamp < t1, for indexing AVG_t, RPM_no and RPM_offset
+    #a slice, or an array of indices if the record timestamps aren't in order
+    def record_range(self, t0=None, t1=None):
+        times = self.AVG_t
+        if np.all(times[1:] >= times[:-1]):
+            start = 0 if t0 is None else int(np.searchsorted(times, t0, 'left'))
+            stop = len(times) if t1 is None else int(np.searchsorted(times, t1, 'left'))
+            return slice(start, max(start, stop))
+        return np.flatnonzero((times >= (-np.inf if t0 is None else t0)) & (times < (np.inf if t1 is None else t1)))
+
+    #trim channels once parsing is done, and share timestamps between channels that were sampled together
+    #raw values are stored in the smallest integer type that holds the header range of their sensor (see data_channel.compact)
+    def finish_channels(self):
+        descs = header_descs(self.header) if self.header else {}
+        for group in self.channels, self.averages:
+            for channels in group.values():
+                for channel in channels:
+                    channel.trim()
+                    desc = descs.get(channel.name.split('.')[0], {})
+                    channel.compact(desc.get('min'), desc.get('max'))
+        timebases = []
+        for channels in self.channels.values():
+            share_times(channels, timebases)
+        timebases = [self.AVG_t]
+        for channels in self.averages.values():
+            share_times(channels, timebases)
 
     
-    
-    #TODO - add class representing a data channel, replace data fields with data channels
     def parse_v4(self, file):
         print("parse_v4")
         print("file len:", file.readable())
         log = json.load(file)
+        self.parse_v4_records(log['header'], log['records'], len(log['records']))
+
+    #parse a v4 log without holding the whole file in memory
+    #records are decoded from the file one at a time and added straight to the channel buffers
+    def parse_v4_stream(self, file):
+        print("parse_v4 (streaming)")
+        #report progress every 10% of the file
+        progress_step = 0
+        def progress(bytes_read, total_bytes):
+            nonlocal progress_step
+            if total_bytes and bytes_read*10 >= (progress_step+1)*total_bytes:
+                progress_step = (bytes_read*10)//total_bytes
+                print(f"read {bytes_read} of {total_bytes} bytes ({progress_step*10}%)")
+        reader = v4_stream_reader(file, progress)
+        self.parse_v4_records(reader.header, reader, reader.estimated_records())
 
-        header = log['header']
-        records = log['records']
+    #read the fields of a v4 header, returns the descriptor of each named field of a record (see header_descs)
+    def read_v4_header(self, header):
         self.record_version = header['version']
         if self.record_version != 4:
             raise ValueError("wrong record version")
         self.firmware = header['firmware']
         self.date = header['date']
         self.time = header['time']
-        
+
+        self.header = header
         self.RECORD_INTERVAL_ms = header['rate_ms']
         self.RECORD_INTERVAL    = header['rate_ms']/1000
-        
-        for sensor in header['sensors']:
-            if sensor['name'] == 'spd':
-                #get the scale for rpm counter ticks
-                self.RPM_tick_scale = pow(2,sensor['scale'])
-                #convert us to ms
-                if sensor['units'] == 'us':
-                    self.RPM_tick_scale = self.RPM_tick_scale/1000
-        
-        #extend the length of an array to accept new data
-        def update_length(src, trg):
-            length = len(src)
-            avail = len(trg)
-            if length > avail:
-                if self.verbose:
-                    print("len usr:", length)
-                    print("len USR:", avail)
-                diff = length - avail
-                trg.extend([np.array([])]*diff)
-            return length
-                
-        #append indexed arrays (record, source field in record, target field)
-        def append_multi(rec, src, trg):
-            try:
-                src = rec[src]
-                for n in range(update_length(src,trg)):
-                    trg[n] = np.append(trg[n], np.array(src[n]))
-            except KeyError as e:
-                if self.verbose : print(e)
-                pass
-        #append single arrays (record, source field in record, target field)
-        def append_single(rec, src, trg):
-            try:
-                src = rec[src]
-                setattr( self, trg, np.append(getattr(self,trg), np.array(src)) )
-            except AttributeError as e:
-                if self.verbose : print(e)
-                pass
-        
-        def append_dict(): #todo - I guess this is for PID records
-            pass
-        
-        
+
+        descs = header_descs(header)
+
+        spd = descs.get('spd', {})
+        #get the scale for rpm counter ticks
+        self.RPM_tick_scale = pow(2,spd.get('scale',0))
+        #convert us to ms
+        if spd.get('units') == 'us':
+            self.RPM_tick_scale = self.RPM_tick_scale/1000
+        return descs
+
+    #collate the records of a v4 log
+    #records may be a list or any iterable that yields records in order, no_of_records is used to size the buffers
+    def parse_v4_records(self, header, records, no_of_records):
+        descs = self.read_v4_header(header)
+
+        #number of samples each record is expected to hold for a sensor/servo/pid descriptor
+        #only used to size the buffers - a wrong guess costs a reallocation, not data
+        def samples_per_record(desc):
+            if desc.get('rate_units') != 'ms' or not desc.get('rate'):
+                return 1
+            return max(1, self.RECORD_INTERVAL_ms // desc['rate'])
+
+        #get the list of channels for a name, adding channels up to the given count
+        #pid fields are named 'pid.<field>' and described by the pid descriptor
+        def get_channels(group, name, count, per_record=True):
+            channels = group.setdefault(name, [])
+            desc = descs.get(name.split('.')[0], {})
+            capacity = no_of_records * (samples_per_record(desc) if per_record else 1)
+            rate = sample_rate(desc) if per_record else None
+            while len(channels) < count:
+                channels.append(data_channel(name, len(channels), capacity, desc.get('units'), desc.get('scale', 0), rate=rate))
+            return channels
+
+        #fields of a record that aren't sensor sample arrays, or need special handling
+        special_fields = ['timestamp', 'avg', 'pid', 'spd', 'spd_t0']
+
+        self.channels = {}
+        self.averages = {}
+        avg_t = sample_buffer(no_of_records)
+
+        #rpm counter ticks - the number of ticks per record is not known in advance
+        rpm_record = sample_buffer(no_of_records, np.int64)
+        rpm_no = sample_buffer(no_of_records)
+        rpm_offset = sample_buffer(no_of_records)
+        rpm_intervals = sample_buffer(no_of_records)
+
+
         t0 = 0
         timestamp = 0
         pid_records = 0
-        pid_samples = 0
         for r in records:                   # LOOP THROUGH EVERY RECORD
             if self.verbose: print()
             time_s = r['timestamp']/1000
             #record timestamp               # TIMESTAMP
-            if len(self.AVG_t)>0:
+            if len(avg_t)>0:
                 timestamp = time_s - t0
                 if self.verbose: print("t:",timestamp)
-                self.AVG_t = np.append(self.AVG_t, timestamp)
+                avg_t.append(timestamp)
             else:
                 #first timestamp, set as t0
                 t0 = time_s
                 if self.verbose: print("t0:",t0)
-                self.AVG_t = np.array([0])
-                
-            if len(self.AVG_t) > 2 and self.AVG_t[-2]+(self.RECORD_INTERVAL*1.01) < self.AVG_t[-1]:
-                print("record timstamp incremented by more than record interval", self.AVG_t[-2], self.AVG_t[-1])
-            
-            
-            #get user inputs                    # GET USER INPUTS
-            append_multi(r,'usr',self.USR)
-            #analog sample times
+                avg_t.append(0)
 
-            #generate timestamps for user inputs
-            values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, len(r['usr'][0]),endpoint=False)
-            self.ANA_t = np.append(self.ANA_t, values)   #this step should probably be a function add_timestamps(src, rec, trg) : values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, len(rec[src][0]),endpoint=False) \n trg = np.append(trg, values)
-            
-            #get Manifold Air Presure sensors   # GET MAPS
-            append_multi(r,'map',self.MAP)
-            
-            #map sensor time axis, if different - why if different?
-            if len(r['usr'][0]) != len(r['map'][0]):
-                values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, len(r['map'][0]),endpoint=False)
-                self.MAP_t = np.append(self.MAP_t, values) #we still need to do this if same though, no?   just generate the time stamps - checking for them being the same has not benefit
+            if len(avg_t) > 2 and avg_t[-2]+(self.RECORD_INTERVAL*1.01) < avg_t[-1]:
+                print("record timstamp incremented by more than record interval", avg_t[-2], avg_t[-1])
+
+
+            #sensor and servo samples           # USR, MAP, TMP, EGT, TRQ, SRV...
+            #each is either an array of samples, or an array of arrays of samples, one for each channel
+            for name, samples in r.items():
+                if name in special_fields or not isinstance(samples, list):
+                    continue
+                if len(samples) and not isinstance(samples[0], list):
+                    samples = [samples]
+                channels = get_channels(self.channels, name, len(samples))
+                for n, row in enumerate(samples):
+                    #each channel gets its own timestamps - egt chips may fail independantly
+                    channels[n].append_record(row, len(avg_t)-1)
 
-            #thermistors - not implemented yet  # GET THERMISTORS
-            append_multi(r,'tmp',self.TMP)
-            
-            #thermocouples                      # GET THERMOCOUPLES
-            append_multi(r,'egt', self.EGT)
-            
-            #thermocouple time axis per sensor      -again, make this a funciton, consider creating a class of {[DATA],[TIMESTAMP]} or np.array([N, V]) with N=0 being timestamps, put all these adding functions in there too.
-            for n in range(update_length(r['egt'], self.EGT_t)):
-                values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, len(r['egt'][n]),endpoint=False)
-                self.EGT_t[n] = np.append(self.EGT_t[n], values)
-            
-            
-            #torque
-            append_single(r,'trq', 'TRQ')
-            
-            #servos
-            append_multi(r,'srv', self.SRV)
-            
-            #servo time axis
-            values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, len(r['srv'][0]),endpoint=False)
-            self.SRV_t = np.append(self.SRV_t, values) 
-            
             #record averages
-            avg = r['avg']
-            
-            #each category we are to collect - this is constant wrt LOOP, why is it here?
-            avgs_src = ['usr','map' ,'tmp' ,'egt' ,'srv','rpm','trq','pow']
-            avgs_dst = [x.upper() + '_avg' for x in avgs_src]
-            
-            #go through each name in the list and append the values within
-            for n in range(len(avgs_src)):
-                try:
-                    #get the source and destination
-                    src = avg[avgs_src[n]]
-                    dst = getattr(self, avgs_dst[n])
-                    #add to lists
-                    if type(src) == list:
-                        #loop through entry indices
-                        for m in range(update_length(src, dst)):
-                            dst[m] = np.append(dst[m], src[m])
-                    #add to dicts
-                    elif type(src) == dict:
-                        pass #todo
-                    #add single values
-                    else:
-                        setattr(self, avgs_dst[n], np.append(dst, src))
-                except KeyError as e:
-                    if self.verbose: print(e) #when an element is not in the record
-                except AttributeError as e:
-                    print ('Error!',e)
-            
-                
-            
-            
+            #each is either a single value, or an array of values, one for each channel
+            for name, values in r.get('avg', {}).items():
+                if name == 'pid':
+                    #latest pid coefficients, as an array of {kp, ki, kd}
+                    for n, coefs in enumerate(values):
+                        for key, value in coefs.items():
+                            get_channels(self.averages, 'pid.'+key, n+1, False)[n].append_record(value, len(avg_t)-1)
+                    continue
+                if not isinstance(values, list):
+                    values = [values]
+                channels = get_channels(self.averages, name, len(values), False)
+                for n, value in enumerate(values):
+                    channels[n].append_record(value, len(avg_t)-1)
+
             #read pids
-            try:
-                length = len(r['pid'])
-                avail = len(self.PID)
-                #ensure the lists have enough elements
-                if length > avail:
-                    if self.verbose: print("len pid:", length)
-                    if self.verbose: print("len PID:", avail)
-                    diff = length - avail
-                    self.PID.extend([{}]*diff)
-                    self.PID_k.extend([{}]*diff)
-                    self.PID_t.extend([np.array([])]*diff)
-                #make sure that there were any elements
-                if len(self.PID):
-                    pid_records = pid_records+1
-                    samples_max = 0
-                    #loop through each logged pid
-                    for n in range(avail):
-                        samples = 0
-                        #check if first record for pid
-                        if len(self.PID[n]) == 0:
-                            #fetch all available parameters from the first pid object
-                            self.PID[n] = r['pid'][n]
-                            #convert lists to ndarray
-                            for key in self.PID[n]:
-                                samples = len(r['pid'][n][key])
-                                samples_max = max(samples_max, samples)
-                                self.PID[n][key] = np.array(self.PID[n][key]);
-                        else:
-                            #go through each available field and append the new data
-                            for key in r['pid'][n]:
-                                samples = len(r['pid'][n][key])
-                                samples_max = max(samples_max, samples)
-                                self.PID[n][key] = np.append(self.PID[n][key], r['pid'][n][key])
-                        
-                        #now create timestamps for this record and PID
-                        values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, samples,endpoint=False)
-                        if self.verbose: print("times:",len(values))
-                        self.PID_t[n] = np.append(self.PID_t[n], values)  
-                        
-                        #now fetch the coefs (todo)
-                        #for key in avg['pid'][n]:
-                        #    self.PID_k[n][key] = np.append(self.PID_t[n][key], avg['pid'][n]) 
-                    pid_samples += samples_max
-                    #loop through each logged pid
-                #make sure there are elements
-                if self.verbose: print("pid records:", pid_records)        
-                if self.verbose: print("pid samples:", pid_samples)
-            except KeyError as e: #no PID date this sample
-                ###print("no key", e)
-                pass
-            
-            ###process rpm (copied from v3)
-            if len(self.RPM_intervals_ms) > 0:
-              pass
-            #what units are these in? ms or s? tick_scale is 0.016, so should be ms?
-            values = np.array(r['spd']) * self.RPM_tick_scale #these are the interval values for each tacho tick
-            tick_offset = r['spd_t0'] * self.RPM_tick_scale #this is the offset of the first tick from the record start, if a tick is recorded
-            #tick offset appears to be the same each time before rotation detected.
-            self.RPM_offset = np.append(self.RPM_offset, tick_offset)
-            
-            self.RPM_no = np.append(self.RPM_no, len(values))
-            if len(values > 0):
-              #check if this is the first recorded tick
-              if len(self.RPM_intervals_ms) == 0: # !? this will run even if no ticks recorded
-                  #in which case, ignore this tick #   but why? first tick interval is valid, or else it doesnt get recorded
-                  #values= values [1:]            # also, these arent ticks, these are intervals.
-                  first_tick = True
-                  if self.verbose: print("first tick") 
-              #also ignore any values less than 1 #not sure why there would be, as the src is uint, but good to catch data errors
-              if len(values[values<=0]) > 0:
-                  print("some ticks ignored:", np.argwhere(values<=0), ":", values[values<=0])
-                  values = values[values>0]
-              
-              self.RPM_intervals_ms = np.append(self.RPM_intervals_ms, values)
-              if self.verbose: print("RPM intervals (ms):", self.RPM_intervals_ms[-len(values):])
-              
-              
-              
-              
-              #this mostly works... except that it doesnt yet.
-              #initial_interval = 0
-              initial_interval = values[0] #back up that initial interval value
-              timenow_ms = timestamp *1000
-              timenext_ms = timenow_ms+self.RECORD_INTERVAL_ms
-              
-              #instead of accumilating times from the start of logging,
-              #we will use the 1st tick offset from the current record's timestamp
-              # using AVG_t starting at 0ms, rather than TIME_t, which does not start at 0
-              # if a tick offset hasnt been read out, default to the old method
-              try:
-                  if tick_offset >=0 and tick_offset < self.RECORD_INTERVAL_ms:
-                      #if this is the first tick in the log file,the first ick is ignored
-                      #so we must add the tick offset to the next tick (which is the time since the first uncounted tick)
-                      #NOPE, thats wrong. we treat each interval as valid
-                      # and the offset is to the tick at the end of that interval.
-                      # if the offset to the last interval in this record is longer than record length,
-                      # then we know the offset is to the start of the first interval and 
-                      # we then just subtract that interval from all the offsets
-                      if first_tick:
-                          #values[0] = values[0]+(self.AVG_t[-1]*1000) + tick_offset
-                          first_tick =  False;
-                      #else:
-                      
-                      #convert the
-                      values[0] = timenow_ms + tick_offset
-                      #cumalative sum to get the timestamps relative to the last tick
-                      
-                  else:
-                      if tick_offset > 0:
-                          print("tick offset is greater than record interval",self.AVG_t[-1],tick_offset,self.RECORD_INTERVAL_ms)
-                      else:
-                          print("tick offset is negative")
-                      #this is an error, but we can recover (by guessing)
-                      
-                      #add the previous tick time, if there was one
-                      if len(self.RPM_tick_times_ms) > 0:
-                          new_val0 = values[0] + self.RPM_tick_times_ms[-1]
-                          #and if the timestamp would fall within the current record
-                          
-                          if new_val0 >= timenow_ms and new_val0 < timenext_ms:
-                            values[0] = new_val0
-                          else:
-                            values[0] = values[0]+timenow_ms #if not, then assume the interval started at the beggingng of the record
-                      else:
-                          print("also no previous times recorded")
-                          #just use the record timestamp
-                          #we'll assume under these conditions that thefirst interval is
-                          #relative to the start of the record.
-                          values[0] = values[0]+timenow_ms
-              except IndexError as e:
-                  print(e)        
-              #add up all the intervals to get the timestamps for each tick
-              values = np.cumsum(values)
-              #check that the last value falls within the timeframe
-              if values[-1] > timenext_ms:
-                  print("last tick time is after end of record; shifting ticks to start of record")
-                  print(timenow_ms,timenext_ms)
-                  print(values[0],values[-1])
-                  print(initial_interval)
-                  values -= initial_interval
-                  if values[-1] > timenext_ms:
-                      print("last tick time is still after end of record\n")
-                  #we could also check for previous record's ticks?
-              #to help debug this, we'll record the timestamp of the record for each of these timestamps
-              self.RPM_tick_time_record_s = np.append(self.RPM_tick_time_record_s,[self.AVG_t[-1]]*len(values))
-              self.RPM_tick_time_record = np.append(self.RPM_tick_time_record,[len(self.RPM_offset)-1]*len(values))
-              self.RPM_tick_time_record_offset = np.append(self.RPM_tick_time_record_offset,[self.RPM_offset[-1]]*len(values))
-              
-  
-              #append the ticks times
-              self.RPM_tick_times_ms = np.append(self.RPM_tick_times_ms, values)
-              if self.verbose: print("RPM tick times (s):", self.RPM_tick_times_ms[-len(values):])
-              #check for non monotonicity
-              if len(self.RPM_tick_times_ms) > len(values):
-                  tick_idx_stop = len(self.RPM_tick_times_ms)
-                  tick_idx_start = tick_idx_stop - (len(values)+1)
-                  tick_idx = range(tick_idx_start, tick_idx_stop)
-                  
-                  for n in range(tick_idx_start,tick_idx_stop) :
-                      if self.RPM_tick_times_ms[n] < self.RPM_tick_times_ms[n-1]:
-                          last_tick = self.RPM_tick_times_ms[n-1]
-                          this_tick = self.RPM_tick_times_ms[n]
-                          plt.plot(tick_idx, self.RPM_tick_times_ms[tick_idx_start:tick_idx_stop])
-                          plt.plot(n, this_tick)
-                          plt.plot(n-1, last_tick)
-                          plt.show()
-                          plt.plot(self.RPM_tick_times_ms)
-                          plt.show()
-                          plt.plot(self.RPM_intervals_ms)
-                          plt.show()
-                          plt.plot(self.AVG_t)
-                          plt.show()
-                          plt.plot(self.RPM_offset)
-                          plt.show()
-                          print("ticks times non monotonic at", n, ":", this_tick, "vs", last_tick)
-              
-              
-              
+            pid = r.get('pid', [])
+            if len(pid):
+                pid_records = pid_records+1
+                #loop through each logged pid, and each field of each pid
+                for n in range(len(pid)):
+                    for key, row in pid[n].items():
+                        get_channels(self.channels, 'pid.'+key, n+1)[n].append_record(row, len(avg_t)-1)
+                if self.verbose: print("pid records:", pid_records)
+
+            #rpm counter ticks, the tick times are reconstructed once all the records have been read
+            if 'spd' not in r:
+                continue
+            rpm_record.append(len(avg_t)-1)
+            rpm_offset.append(r.get('spd_t0', -1))  #offset of the first tick from the record start, if a tick is recorded
+            rpm_no.append(len(r['spd']))
+            rpm_intervals.append(r['spd'])          #interval values for each tacho tick
+
             ##end record r
-            
-        rpm_pid = self.PID[0]
-        #print(rpm_pid.keys())
-        if self.rpm_pid_no_ms and not self.rpm_pid_native:
-            rpm_pid['trg'] = 60000/rpm_pid['trg']
-            rpm_pid['act'] = 60000/rpm_pid['act']
-            rpm_pid['err'] = rpm_pid['trg']-rpm_pid['act']
-        elif not self.rpm_pid_native:
-            rpm_pid['trg_rpm'] = 60000/rpm_pid['trg']
-            rpm_pid['act_rpm'] = 60000/rpm_pid['act']
-            rpm_pid['err_rpm'] = rpm_pid['trg_rpm']-rpm_pid['act_rpm']
-        elif not self.rpm_pid_no_ms:
-            rpm_pid['trg_ms'] = 60000/rpm_pid['trg']
-            rpm_pid['act_ms'] = 60000/rpm_pid['act']
-            rpm_pid['err_ms'] = rpm_pid['trg_ms']-rpm_pid['act_ms']
+
+        #trim the buffers
+        self.AVG_t = avg_t.array()
+
+        #timestamps of every sample, from the record timestamps and the number of samples in each record
+        for group in (self.channels, self.averages):
+            for channels in group.values():
+                for channel in channels:
+                    channel.make_times(self.AVG_t, self.RECORD_INTERVAL)
+
+        self.finish_v4(rpm_record.array(), rpm_no.array(), rpm_offset.array(), rpm_intervals.array())
+
+        #end parse v4
+
+    #calibrate the parsed channels
+    #the header scale (a power of 2) of each channel is set as its factor, which is applied as values are read,
+    #so the raw values are kept as logged, and rpm counter intervals are converted from counter ticks to ms the same way
+    #the rpm pid target and actual values are inverted (rpm <-> ms) as set by rpm_pid_no_ms/rpm_pid_native
+    def calibrate(self):
+        for group in self.channels, self.averages:
+            for channels in group.values():
+                for channel in channels:
+                    channel.calibrate(pow(2.0, channel.scale) if channel.scale else 1)
+        spd = self.get_channel('spd')
+        if spd is not None:
+            spd.calibrate(self.RPM_tick_scale)
+
+        rpm_pid = self.get_pid(0)
+        if 'trg' in rpm_pid and 'act' in rpm_pid:
+            pid_t = rpm_pid['trg'].times
+            #the pid input is 0 while the engine is stopped
+            with np.errstate(divide='ignore'):
+                trg = 60000/rpm_pid['trg'].values
+                act = 60000/rpm_pid['act'].values
+            def add_pid_channel(key, values):
+                channels = self.channels.setdefault('pid.'+key, [])
+                if not channels:
+                    channels.append(data_channel('pid.'+key, 0, units=rpm_pid['trg'].units, rate=rpm_pid['trg'].rate))
+                channels[0].set(values, pid_t)
+                channels[0].calibrate(1)
+            if self.rpm_pid_no_ms and not self.rpm_pid_native:
+                names = ['trg', 'act', 'err']
+            elif not self.rpm_pid_native:
+                names = ['trg_rpm', 'act_rpm', 'err_rpm']
+            elif not self.rpm_pid_no_ms:
+                names = ['trg_ms', 'act_ms', 'err_ms']
+            else:
+                names = None
+            if names:
+                add_pid_channel(names[0], trg)
+                add_pid_channel(names[1], act)
+                add_pid_channel(names[2], trg - act)
         #this is a hack - the firmware needs to invert the input not the output
         #rpm_pid['i'] = -rpm_pid['i']*0.001
-        
-        #rpm_pid_k =
-        
-        
-        
-        for n in range(len(self.EGT)):
-            self.EGT[n] = self.EGT[n] * self.EGT_FRACTION
-        for n in range(len(self.EGT_avg)):
-            self.EGT_avg[n] = self.EGT_avg[n] * self.EGT_FRACTION    
-    
-        #end parse v4
+
+    #everything after the records have been collated that is common to v4 and binary logs
+    #rpm_record: index of each record with rpm counter ticks, rpm_no: number of ticks in each of those records
+    #rpm_offset, rpm_intervals: tick offset of each of those records and all their intervals, in rpm counter units
+    def finish_v4(self, rpm_record, rpm_no, rpm_offset, rpm_intervals):
+        #tick times, from the intervals and offsets of every record at once
+        self.RPM_no = np.asarray(rpm_no)
+        self.RPM_offset = rpm_offset * self.RPM_tick_scale
+        intervals, tick_times_ms, tick_record = reconstruct_ticks(rpm_intervals * self.RPM_tick_scale, self.RPM_no,
+                                                                  self.RPM_offset, self.AVG_t[rpm_record]*1000,
+                                                                  self.RECORD_INTERVAL_ms, self.verbose)
+        self.RPM_tick_time_record = rpm_record[tick_record]
+        self.RPM_tick_time_record_s = self.AVG_t[self.RPM_tick_time_record]
+        self.RPM_tick_time_record_offset = self.RPM_offset[tick_record]
+
+        #flag, rather than stop on, ticks that don't make sense
+        self.RPM_tick_non_monotonic = non_monotonic_ticks(tick_times_ms)
+        if len(self.RPM_tick_non_monotonic):
+            print("tick times non monotonic at", len(self.RPM_tick_non_monotonic), "ticks, first at",
+                  self.RPM_tick_non_monotonic[0], "(record", self.RPM_tick_time_record[self.RPM_tick_non_monotonic[0]], ")")
+        self.RPM_tick_late = late_ticks(tick_times_ms, tick_record, self.AVG_t[rpm_record]*1000, self.RECORD_INTERVAL_ms)
+        if len(self.RPM_tick_late):
+            print("tick times after the end of their record at", len(self.RPM_tick_late), "ticks")
+
+        #tacho intervals at the time of each tick, as logged (see calibrate)
+        self.channels['spd'] = [data_channel('spd', 0, units='ms')]
+        self.channels['spd'][0].set(rpm_intervals[rpm_intervals > 0], tick_times_ms/1000)
+
+        self.calibrate()
+        self.finish_channels()
+
     
+    #parse a binary dump of DATA_RECORDs (see binary_records) into the same channels as a v4 log
+    #binary records don't hold averages, or the header, which is generated from the firmware config
+    def parse_binary(self, file):
+        print("parse_binary")
+        config = firmware_config(**self.binary_config)
+        records, offsets = read_records(file.read(), config, self.verbose)
+        if len(records) == 0:
+            raise ValueError("no records found")
+        self.parse_binary_records(records, config)
+
+    #collate an array of DATA_RECORDs
+    def parse_binary_records(self, records, config):
+        descs = self.read_v4_header(firmware_header(config))
+
+        timestamps = records['timestamp'].astype(np.int64)
+        self.AVG_t = (timestamps - timestamps[0])/1000
+        record_no = np.arange(len(records))
+
+        self.channels = {}
+        self.averages = {}
+        for name, index, samples, counts in record_samples(records):
+            desc = descs.get(name.split('.')[0], {})
+            values, counts = valid_samples(samples, counts)
+            channel = data_channel(name, index, 0, desc.get('units'), desc.get('scale', 0), rate=sample_rate(desc))
+            channel.set(values, record_sample_times(self.AVG_t, record_no, counts, self.RECORD_INTERVAL, channel.rate))
+            self.channels.setdefault(name, []).append(channel)
+
+        intervals, counts = valid_samples(records['RPM_tick_times_tk'], records['RPM_no_of_ticks'])
+        self.finish_v4(record_no, counts, records['RPM_tick_offset_tk'].astype(np.float64), intervals.astype(np.float64))
+
     #TODO - ditch v3 support
+    #parse a v3 (text) log into the same channels as a v4 log
     def parse_v3(self, file):
         print("parse_v3")
-        print("file len:", file.readable())
-        
-        read_avg = True
-        index = 0
-        no_of_ana_samples = 0
-        no_of_egt_samples = 0
-        no_of_srv_samples = 0
-        
-        line_no = 0
-        record_no = 0
-        
-        
-        tick_offset = 0
-        first_tick = True
-    
-        
-        for line in file:
-            line = line.strip()
-            
-            if self.echo : print(f"{line_no}, {record_no}: {line}")
-            line_no = line_no+1
-            
-            #blank lines
-            if len(line) == 0:
-                continue
-            
-            #record marker
-            if line == "----------":
-                if read_avg == True:
-                    #start of record
-                    #add the inferred record timestamp
-                    if len(self.AVG_t)>0:
-                        timestamp = self.AVG_t[-1] + self.RECORD_INTERVAL
-                        self.AVG_t = np.append(self.AVG_t, timestamp)
-                        record_no = record_no+1
-                    else:
-                        self.AVG_t = np.array([0])
-                    #reset the tick offset
-                    tick_offset = -1
-                    
-                else: 
-                    read_avg = True
-                continue
-            
-            #split line int 'PAR:VAL'
-            line_split = line.split(": ")
-            
-            #an unsplit string is probably the start date and time
-            if len(line_split) < 2:
-                #probably the opening date stamp            
-                line_split = line.split(',')
-                if len(line_split) == 2:
-                    if self.date is None and len(line_split[0])>0:
-                        self.date = line_split[0]
-                        print("File start date: ", self.date)
-                    if self.time is None and len(line_split[1])>0:
-                        self.time = line_split[1]
-                        print("File start time: ", self.time)
-                continue
-                
-            if len(line_split) == 2:
-                #grab the parameter name
-                param = line_split[0]
-                #grab the value string
-                value = line_split[1]
-                
-                
-                #log file version
-                if self.record_version is None and param == "Record Ver.":
-                    self.record_version = int(value)
-                    print("Record Version:", self.record_version)
-                    continue
-                
-                
-                #anything else at this point is a param:value pair
-                
-                #convert the values to arrays of floats
-                values = np.fromstring(value.strip(), dtype=float, sep=',').astype(np.float32)
-                
-                #timestamp (present, but not currently used)
-                if param == "Timestamp":
-                    self.TIME_t = np.append(self.TIME_t, values)
-                    continue
-                
-                #parse number of analog samples per record
-                if param == "ANA no.":
-                    no_of_ana_samples = int(values[0])
-                    #we are now parsing samples, not averages
-                    read_avg = False #this is dumb, but there are errors in the record format, and this is how I'm getting around it.
-                    #generate timestamps for the samples
-                    values = np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, no_of_ana_samples,endpoint=False)
-                    self.ANA_t = np.append(self.ANA_t, values)
-                    if self.verbose: print("ana samp times:", self.ANA_t[-no_of_ana_samples:])
-                    continue
-    
-                #parse user inputs
-                if param.endswith("USR"):
-                    #user parameter no.
-                    index = int(param[0])
-                  
-                    if read_avg:
-                        #expand the number of channels if index exceed current max
-                        if index >= len(self.USR_avg):
-                            self.USR_avg.append(np.array([]))
-                        #append to averages
-                        self.USR_avg[index] = np.append(self.USR_avg[index], values)
-                        if self.verbose: print(f"USR avg {index}:", self.USR_avg[index][-1])
-                    else:
-                        #expand the number of channels if index exceed current max
-                        if index >= len(self.USR):
-                            self.USR.append(np.array([]))
-                        #append to samples
-                        self.USR[index] = np.append(self.USR[index], values)
-                        if self.verbose: print(f"USR {index}:", self.USR[index][-no_of_ana_samples:])
-                    continue
-                            
-                #parse MAP sensors
-                if param.endswith("MAP"):
-                    #map sensor no.
-                    index = int(param[0])
-                   
-                    if read_avg:
-                        #expand the number of channels if index exceed current max
-                        if index >= len(self.MAP_avg):
-                            self.MAP_avg.append(np.array([]))
-                        #append to averages
-                        self.MAP_avg[index] = np.append(self.MAP_avg[index], values)
-                        if self.verbose: print(f"MAP avg {index}:", self.MAP_avg[index][-1])
-                    else:
-                        #expand the number of channels if index exceed current max
-                        if index >= len(self.MAP):
-                            self.MAP.append(np.array([]))
-                        #append to samples
-                        self.MAP[index] = np.append(self.MAP[index], values)
-                        if self.verbose: print(f"MAP {index}:", self.MAP[index][-no_of_ana_samples:])
-                    continue
-                
-                #parse TMP sensors
-                if param.endswith("TMP"):
-                    #thermistor no.
-                    index = int(param[0])
-                    
-                    
-                   
-                    if read_avg:
-                        #expand the number of channels if index exceed current max
-                        if index >= len(self.TMP_avg):
-                            self.TMP_avg.append(np.array([]))
-                        #append to averages
-                        self.TMP_avg[index] = np.append(self.TMP_avg[index], values)
-                        if self.verbose: print(f"TMP avg {index}:", self.TMP_avg[index][-1])
-                    else:
-                        #expand the number of channels if index exceed current max
-                        if index >= len(self.TMP):
-                            self.TMP.append(np.array([]))
-                        #append to samples
-                        self.TMP[index] = np.append(self.TMP[index], values)
-                        if self.verbose: print(f"TMP {index}:", self.TMP[index][-no_of_ana_samples:])
-                    continue
-                
-                #parse TRQ sensors
-                if param == "TRQ":
-                    #there is only one torque sensor
-                    #presently it is tied in with analog samples (? in what way?)
-                    if read_avg:
-                        #append to averages
-                        self.TRQ_avg = np.append(self.TRQ_avg, values)
-                        if self.verbose: print("TRQ avg:", self.TRQ_avg[-1])
-                    else:
-                        #append to samples
-                        self.TRQ = np.append(self.TRQ, values)
-                        if self.verbose: print("TRQ:", self.TRQ[-no_of_ana_samples:])
-                    continue
-                
-                #parse EGT sensors
-                if param.endswith("EGT"):
-                    #egt no.
-                    index = int(param[0])
-                    
-                                    #expand the number of channels if index exceed current max
-                    if index >= len(self.EGT):
-                        self.EGT.append(np.array([]))
-                        self.EGT_t.append(np.array([]))
-                        
-                    #get the correct scale
-                    values = values * self.EGT_FRACTION
-                   
-                    #append to samples
-                    self.EGT[index] = np.append(self.EGT[index], values)
-                    
-                    if self.verbose: print(f"EGT {index}:", self.EGT[-no_of_egt_samples:])
-                    
-                    #generate time stamps for egt readings
-                    no_of_egt_samples = len(values)
-                    if no_of_egt_samples > 0:
-                        self.EGT_t[index] = np.append(self.EGT_t[index], np.linspace(self.AVG_t[-1],self.AVG_t[-1]+self.RECORD_INTERVAL, no_of_egt_samples, endpoint=False))
-                        if self.verbose: print(f"EGT_t {index}:", self.EGT_t[-no_of_egt_samples:])
-                    continue
-                
-                if param.endswith("EGT avg"):
-                    #egt no.
-                    index = int(param[0])
-                    
-                    
-                    #expand the number of channels if index exceed current max
-                    if index >= len(self.EGT_avg):
-                        self.EGT_avg.append(np.array([]))
-                        
-                    #get the correct scale
-                    values = values * self.EGT_FRACTION
-                    
-                    #append to averages
-                    self.EGT_avg[index] = np.append(self.EGT_avg[index], values)
-                    
-                    if self.verbose: print(f"EGT avg {index}:", self.EGT_avg[-1])
-                    continue
-                
-                
-                #rpm counter pre calculated average
-                if param == "RPM avg":
-                    self.RPM_avg = np.append(self.RPM_avg, values)
-                    if self.verbose: print("RPM avg:", self.RPM_avg[-1])
-                    continue
-                #rpm counter tick count
-                if param == "RPM no.":
-                    self.RPM_no = np.append(self.RPM_no, values)
-                    if self.verbose: print("RPM no.:", self.RPM_no[-1])
-                    continue
-                #rpm counter tick offset
-                if param == "RPM tick offset (ms)":
-                    tick_offset = values[0]
-                    if self.verbose: print("RPM tick offset (ms):", self.RPM_no[-1])
-                    continue
-                #rpm counter tick intervals
-                if param == "RPM times (ms)":
-                    if len(values) == 0:
-                        continue
-                    
-                    #check if this is the first recorded tick
-                    if len(self.RPM_intervals_ms) == 0:
-                        #in which case, ignore this tick
-                        values= values [1:]
-                        first_tick = True
-                        print("first tick")
-                    #also ignore any values less than 1
-                    if len(values[values<=0]) > 0:
-                        print("some ticks ignored:", np.argwhere(values<=0), ":", values[values<=0])
-                        values = values[values>0]
-                        
-                    self.RPM_intervals_ms = np.append(self.RPM_intervals_ms, values)
-                    if self.verbose: print("RPM intervals (ms):", self.RPM_intervals_ms[-len(values):])
-                    
-                    #this mostly works...
-                        
-                    #instead of accumilating times from the start of logging,
-                    #we will use the 1st tick offset from the current record's timestamp
-                    # using AVG_t starting at 0ms, rather than TIME_t, which does not start at 0
-                    # if a tick offset hasnt been read out, default to the old method
-                    if tick_offset >=0:
-                        #if this is the first tick in the log file,the first ick is ignored
-                        #so we must add the tick offset to the next tick (which is the time since the first uncounted tick)
-                        if first_tick:
-                            first_tick =  False;
-                            values[0] = values[0]+(self.AVG_t[-1]*1000) + tick_offset
-                        else:
-                            values[0] = (self.AVG_t[-1]*1000) + tick_offset
-                        #cumalative sum to get the timestamps relative to the last tick
-                        
-                    else:
-                        
-                        print("tick times, but no tick offset")
-                        #this is an error, but we can recover
-                        
-                        #add the previous tick time, if there was one
-                        if len(self.RPM_tick_times_ms) > 0:
-                            values[0] = values[0] + self.RPM_tick_times_ms[-1]
-                        else:
-                            print("also no previous times recorded")
-                            #just use the record timestamp
-                            values[0] = (self.AVG_t[-1]*1000)
-                            
-                    #add up all the intervals to get the timestamps for each tick
-                    values = np.cumsum(values)
-                        
-                    
-    
-                    #append the ticks times
-                    self.RPM_tick_times_ms = np.append(self.RPM_tick_times_ms, values)
-                    if self.verbose: print("RPM tick times (s):", self.RPM_tick_times_ms[-len(values):])
-                    continue
-                
-                #calculated average power
-                if param == "POW":
-                    self.POW_avg = np.append(self.POW_avg, values)
-                    if self.verbose: print("POW:", self.POW_avg[-1])
+        log = v3_reader(file, self.echo, self.verbose)
+        if log.date is not None: self.date = log.date
+        if log.time is not None: self.time = log.time
+        if log.version is not None: self.record_version = log.version
+
+        #v3 logs have no record timestamps that start from 0, so they are inferred from the record count
+        self.AVG_t = np.arange(log.no_of_records) * self.RECORD_INTERVAL
+
+        #samples are spread evenly over their record
+        def make_channels(fields, group):
+            for (name, index), field in sorted(fields.items()):
+                if name == 'spd':
                     continue
-        #end of file
+                values, records, counts = field.values()
+                channels = group.setdefault(name, [])
+                while len(channels) <= index:
+                    channels.append(None)
+                channel = data_channel(name, index, scale=self.V3_SCALES.get(name, 0))
+                channel.set(values, record_sample_times(self.AVG_t, records, counts, self.RECORD_INTERVAL))
+                channels[index] = channel
+            #drop any gaps in the sensor numbering
+            for name, channels in group.items():
+                group[name] = [channel for channel in channels if channel is not None]
+
+        self.channels = {}
+        self.averages = {}
+        make_channels(log.samples, self.channels)
+        make_channels(log.averages, self.averages)
+
+        #rpm counter ticks
+        self.RPM_no = log.record_array('rpm_no')
+        self.RPM_offset = log.record_array('rpm_offset', -1)
+        spd = log.samples.get(('spd', 0))
+        if spd is not None:
+            intervals, records, counts = spd.values()
+            counts = np.bincount(records, counts, log.no_of_records).astype(np.int64)
+        else:
+            intervals, counts = np.zeros(0), np.zeros(log.no_of_records, np.int64)
+        intervals, tick_times_ms, tick_record = reconstruct_v3_ticks(intervals, counts, self.RPM_offset, self.AVG_t*1000)
+        self.RPM_tick_time_record = tick_record
+        self.RPM_tick_time_record_s = self.AVG_t[tick_record]
+        self.RPM_tick_time_record_offset = self.RPM_offset[tick_record]
+        self.RPM_tick_non_monotonic = non_monotonic_ticks(tick_times_ms)
+        self.RPM_tick_late = late_ticks(tick_times_ms, tick_record, self.AVG_t*1000, self.RECORD_INTERVAL_ms)
+        if len(intervals):
+            self.channels['spd'] = [data_channel('spd', 0, units='ms')]
+            self.channels['spd'][0].set(intervals, tick_times_ms/1000)
+
+        self.calibrate()
+        self.finish_channels()
         print("Done")
-        
-        
+
+
+    def get_cache_key(self, path):
+        options = {name : getattr(self, name) for name in self.cache_options}
+        return cache_key(path, self.parser_version, options)
+
+    #load previously parsed data from the log's cache file, returns False if there's no valid cache
+    def load_cache(self, path):
+        try:
+            fields = load_cache(cache_path(path), self.get_cache_key(path))
+        except OSError:
+            return False
+        if fields is None:
+            return False
+        print("loaded from cache")
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.path = path.lower()
+        return True
+
+    #save the parsed data to the log's cache file
+    def save_cache(self, path):
+        try:
+            save_cache(cache_path(path), self.get_cache_key(path), vars(self))
+        except OSError as e:
+            print("could not write cache:", e)
+
     #todo, make this generic - select data to plot, vertical axis/range, time range
     #consider making it independant of plot method, ie returns the data to be plotted
     #then send data to matplotlib or some other plotter, eg pygame
@@ -810,158 +557,82 @@ class log_file:
             labels.clear()
         
         
+        #lines longer than plot_points are reduced to their min/max over each bucket of samples
         def draw_plot(data, time, name, colour=None):
             ln = min(len(time),len(data))
-            if colour:  plt.plot(time[:ln], data[:ln], colour)
-            else:       plt.plot(time[:ln], data[:ln])
+            time, data = time[:ln], data[:ln]
+            if self.plot_points:
+                time, data = minmax(time, data, self.plot_points)
+            if colour:  plt.plot(time, data, colour)
+            else:       plt.plot(time, data)
             labels.append(name)
             
-        def draw_plots(data, time, base_name):
-            for (m,n) in enumerate(data):
-                draw_plot(n,time,f'{base_name} {m}')
-                
-        def draw_plots_t(data, times, base_name):
-            for (m,n) in enumerate(data):
-                draw_plot(n,times[m],f'{base_name} {m}')
-        
-        draw_plots(self.USR[0:1],self.ANA_t,'USR') #masking off uninteresting channels
-        draw_plots(self.USR_avg[0:1],self.AVG_t,'USR avg.')
+        #draw each channel in a list against its own timestamps
+        def draw_channels(channels, base_name):
+            for channel in channels:
+                if self.plot_points and channel.times is not None:
+                    time, data = channel.lod().get(points=self.plot_points)
+                else:
+                    time, data = channel.times, channel.values
+                draw_plot(data, time, f'{base_name} {channel.index}')
+        
+        draw_channels(self.channels.get('usr', [])[0:1],'USR') #masking off uninteresting channels
+        draw_channels(self.averages.get('usr', [])[0:1],'USR avg.')
         show_plot('User Input (LSB, max 1023)',labels)
         
-        if self.MAP_t.size > 0:
-            time_axis = self.MAP_t
-        else:
-            time_axis = self.ANA_t
-        draw_plots(self.MAP,time_axis,'MAP')
-        draw_plots(self.MAP_avg,self.AVG_t,'MAP avg.')
+        draw_channels(self.channels.get('map', []),'MAP')
+        draw_channels(self.averages.get('map', []),'MAP avg.')
         show_plot('MAP (mbar)', labels)
-        if len(self.TMP) > 1:
-          draw_plots(self.TMP,self.ANA_t,'TMP')
-          draw_plots(self.TMP_avg,self.AVG_t,'TMP avg.')   
+        if len(self.channels.get('tmp', [])) > 1:
+          draw_channels(self.channels['tmp'],'TMP')
+          draw_channels(self.averages.get('tmp', []),'TMP avg.')   
           show_plot('Thermistor (°C)', labels)
         
-        draw_plots_t(self.EGT,self.EGT_t,'EGT')
-        draw_plots(self.EGT_avg,self.AVG_t,'EGT avg.') 
+        draw_channels(self.channels.get('egt', []),'EGT')
+        draw_channels(self.averages.get('egt', []),'EGT avg.') 
         show_plot('EGT (°C)', labels)
         
-        draw_plot(self.TRQ, self.ANA_t, 'TRQ')
-        draw_plot(self.TRQ_avg, self.AVG_t, 'TRQ avg.')
+        draw_channels(self.channels.get('trq', []), 'TRQ')
+        draw_channels(self.averages.get('trq', []), 'TRQ avg.')
         show_plot('Torque (mN.m)', labels)
         
         
         
         RPM_calc = 60*self.RPM_no/self.RECORD_INTERVAL
-        RPM_ticks = 60000/self.RPM_intervals_ms
+        spd = self.get_channel('spd')
+        if spd is not None:
+            RPM_ticks = 60000/spd.values
+            RPM_ticks_t = spd.times
+        else:
+            RPM_ticks = RPM_ticks_t = np.array([])
         
         
-        draw_plot(RPM_ticks, self.RPM_tick_times_ms/1000, 'avg. from tick times','y')
+        draw_plot(RPM_ticks, RPM_ticks_t, 'avg. from tick times','y')
         draw_plot(RPM_calc, self.AVG_t, 'avg. from count','g')
-        draw_plot(self.RPM_avg, self.AVG_t, 'reported avg.','b')
+        for channel in self.averages.get('rpm', []):
+            draw_plot(channel.values, channel.times, 'reported avg.','b')
         
         show_plot('Engine Speed (RPM)', labels)
         
         
-        draw_plot(self.POW_avg, self.AVG_t, 'brake power avg.')
+        for channel in self.averages.get('pow', []):
+            draw_plot(channel.values, channel.times, 'brake power avg.')
         show_plot('Power (W)', labels)
             
         
-        for n,pid in enumerate(self.PID):
+        for n in range(self.no_of_pids()):
             #print("plotting pid,",pid)
-            for key in pid:
-                draw_plot(pid[key], self.PID_t[n], key)
+            for key, channel in self.get_pid(n).items():
+                draw_plot(channel.values, channel.times, key)
             show_plot('PID', labels)
         
         
+        #detailed view of pid and rpm, zoomed in on detail_start_s to detail_stop_s
+        #detail_stop_s <= 0 is relative to the end of the log
         if self.detailed_pid or self.detailed_rpm:
-            time_max = 0
-            y_max = 6000
-            y_min = 0
-            title = ""
-            
-            if self.detailed_pid:
-                try:
-                    #select the data and time axis
-                    pid = self.PID[0]
-                    pid_t = self.PID_t[0]
-                    pid_keys = ['trg','act','err','out']
-                    #get the maximum time
-                    time_max = max(time_max, np.ceil(pid_t[-1]).astype(np.int32))
-                    y_min = -2000
-                    title += "PID "
-                except IndexError as e:
-                    print(e)
-                    self.detailed_pid = False
-                
-            if self.detailed_rpm:     #TODO: move this to parsing.
-                #time axis with 1m resoultion
-                ticks_t = np.array([])
-                #generate times from the range of AVG_t
-                duration_ms = np.round(self.AVG_t[-1]*1000 + self.RECORD_INTERVAL_ms)
-                ticks_t = np.arange(duration_ms)/1000
-                #update the max time stamp
-                time_max = max(time_max, np.ceil(ticks_t[-1]).astype(np.int32))
-                
-                #now we can create the spare array for tick data
-                ticks = np.zeros_like(ticks_t)
-                #and populate the indices corresponding to a tick with the rpm for that tick
-                #      dest   indices                                            source values
-                np.put(ticks, np.round(self.RPM_tick_times_ms).astype(np.int32), RPM_ticks)
-  
-                title += "RPM "
-            
-            step = 2 #time slice each detailed plot will show
-            
-            try:
-                #process stop time
-                if detail_stop_s <= 0: detail_stop_s = time_max + detail_stop_s
-                elif detail_stop_s < step: detail_stop_s += step
-                
-                #go through each time slice
-                
-                for start in range (detail_start_s, detail_stop_s - step, step):
-                    stop = start+step
-                    
-                    #do pid plotting
-                    if self.detailed_pid:
-                        #find the indices coresponding to this slice
-                        pid_start_idx = np.argmax(pid_t>start)
-                        pid_stop_idx = np.argmax(pid_t>stop)
-                        #get the time line slice
-                        pid_t_slice = pid_t[pid_start_idx:pid_stop_idx]
-                        #iterate through keys and plot their corresponding slices
-                        for key in pid_keys:
-                            try:
-                                pid_slice = pid[key][pid_start_idx:pid_stop_idx]
-                                draw_plot(pid_slice, pid_t_slice, key)
-                            except KeyError as e:
-                                print(e)                #print missing keys
-                                pid_keys.remove(key)    #remove key from key list
-                                
-                    #do rpm plotting
-                    if self.detailed_rpm:
-                      #this bit is assuming AVG_t is contiguous. FIXME
-                        if start is not None: 
-                          #rpm_start_idx = int(start/self.RECORD_INTERVAL)
-                          rpm_start_idx = np.argmin(np.abs(self.AVG_t - start))
-                        else: rpm_start_idx = None
-                        if stop is not None: 
-                          #rpm_stop_idx = int(stop/self.RECORD_INTERVAL)+1
-                          rpm_stop_idx = np.argmin(np.abs(self.AVG_t - stop))+1
-                        else: rpm_stop_idx = None
-                        
-                        draw_plot(RPM_calc[rpm_start_idx:rpm_stop_idx], self.AVG_t[rpm_start_idx:rpm_stop_idx],'avg. from count')
-                        
-                        if start is not None: tick_start_idx = int(start*1000)
-                        else: tick_start_idx = None
-                        if stop is not None: tick_stop_idx = int(stop*1000)
-                        else: tick_stop_idx = None
-                        
-                        draw_plot(ticks[tick_start_idx:tick_stop_idx], ticks_t[tick_start_idx:tick_stop_idx],'avg. from ticks','y')
-                    
-                    plt.ylim(y_min, y_max)                            
-                    show_plot(title, labels)
-            except IndexError as e:
-                print (e)
+            duration = self.AVG_t[-1] + self.RECORD_INTERVAL if len(self.AVG_t) else 0
+            if detail_stop_s <= 0: detail_stop_s = duration + detail_stop_s
+            log_viewer(self).show(detail_start_s, detail_stop_s)
 
 
 
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Synthetic log generator.
+
+Writes logs of any length and sensor count that look like the controller's, for testing and benchmarking
+the visualiser without the test rig: v4 (json) logs as described in LOG_FILE_FORMAT.md,
+laid out exactly as the firmware writes them (start_log and write_record in records.ino, using json.ino),
+and v3 (text) logs of the same data.
+
+The data comes from a crude engine: the rpm follows a target that steps every so often,
+with tacho ticks at the engine speed (logged in 16us counter ticks, with the offset of the first tick
+of each record, as RPM_Counter.ino does), an rpm pid reporting its terms, and sensors that roughly follow the rpm.
+It is not meant to be realistic, only to exercise every part of the parser with believable values.
+
+Sensor counts and rates are those of a firmware build (see binary_records.FIRMWARE_CONFIG), eg.
+    python log_generator.py big.jsn 100000 --config NO_OF_EGT_SENSORS=2 NO_OF_PIDS=1
+
+usage: python log_generator.py <output file> <records> [--v3] [--seed N] [--drop F] [--config NAME=VALUE ...]
+
+@author: AlexT-38
+"""
+
+import sys
+import argparse
+import numpy as np
+
+from binary_records import firmware_config
+
+
+FIRMWARE_NAME = "OpenGEET Reactor Controller (MEGA) v0.7.0"
+JSON_TAB = '\t'
+PID_FP_FRAC_BITS = 9        #PID.h
+RPM_MIN_SET_rpm = 1000      #RPM_counter.h
+RPM_MAX_SET_rpm = 4500
+START_ms = 10242            #timestamp of the first record - the controller takes a while to start logging
+
+
+#json text, laid out as json.ino does
+#objects have each member on a new line, arrays of numbers are on one line,
+#arrays of arrays or objects have each element on a new line
+def json_text(value, depth=0):
+    tabs = "\n" + JSON_TAB*(depth+1)
+    if isinstance(value, dict):
+        members = [f'{tabs}"{key}":{json_text(item, depth+1)}' for key, item in value.items()]
+        return "{" + ",".join(members) + "\n" + JSON_TAB*depth + "}"
+    if isinstance(value, list):
+        if value and isinstance(value[0], (list, dict)):
+            return "[" + ",".join(tabs + json_text(item, depth+1) for item in value) + "\n" + JSON_TAB*depth + "]"
+        return "[" + ",".join(json_text(item) for item in value) + "]"
+    if isinstance(value, str):
+        return '"' + value + '"'
+    return str(int(value))
+
+
+#the log header, as start_log writes it
+def log_header(config, date="2023/08/04", time="12:00:00", gains=((76, 25, 0), (0, 2282, 0))):
+    analog = config['ANALOG_SAMPLE_INTERVAL_ms']
+    sensors = []
+    def sensor(name, num, rate, units, rate_units, low=None, high=None, scale=0):
+        desc = {'name': name}
+        if num > 1: desc['num'] = num
+        if rate: desc['rate'] = rate
+        if rate_units: desc['rate_units'] = rate_units
+        if units: desc['units'] = units
+        if low is not None:
+            desc['min'] = low
+            desc['max'] = high
+            if scale: desc['scale'] = scale
+        return desc
+    if config['NO_OF_USER_INPUTS'] > 0:
+        sensors.append(sensor('usr', config['NO_OF_USER_INPUTS'], analog, 'LSB', 'ms', 0, 1023))
+    if config['NO_OF_MAP_SENSORS'] > 0:
+        sensors.append(sensor('map', config['NO_OF_MAP_SENSORS'], config['ADC_SAMPLE_INTERVAL_ms'], 'mbar', 'ms'))
+    if config['NO_OF_EGT_SENSORS'] > 0:
+        sensors.append(sensor('egt', config['NO_OF_EGT_SENSORS'], config['EGT_SAMPLE_INTERVAL_ms'], '°C', 'ms', 0, 1024, -2))
+    if config['NO_OF_TMP_SENSORS'] > 0:
+        sensors.append(sensor('tmp', config['NO_OF_TMP_SENSORS'], analog, '°C', 'ms', 0, 256, -2))
+    sensors.append(sensor('trq', 1, analog, 'mN.m', 'ms', -32000, 32000))
+    tick_us = 1 << config['TICK_us_BITS']
+    tick_max = 60000000//tick_us//config['RPM_MAX_rpm']
+    tick_min = 60000000//tick_us//(60000//config['UPDATE_INTERVAL_ms'])
+    sensors.append(sensor('spd', 1, 1, 'us', 'pr', tick_max, tick_min, config['TICK_us_BITS']))
+    sensors.append(sensor('rpm', 1, 0, 'rpm', None))
+    sensors.append(sensor('pow', 1, 0, 'W', None))
+
+    servos = sensor(None, config['NO_OF_SERVOS'], config['PID_UPDATE_INTERVAL_ms'], 'LSB', 'ms', 0, 1023)
+    del servos['name']
+    servos['names'] = ["throttle", "mixture", "brake"]
+    pid = sensor(None, config['NO_OF_PIDS'], config['PID_UPDATE_INTERVAL_ms'], None, 'ms')
+    del pid['name']
+    pid['k_frac'] = PID_FP_FRAC_BITS
+    pid['configs'] = [{'name': "rpm", 'src': "spd", 'dst': "throttle", 'kp': gains[0][0], 'ki': gains[0][1], 'kd': gains[0][2]},
+                      {'name': "vac", 'src': "map", 'idx': 0, 'dst': "mixture", 'kp': gains[1][0], 'ki': gains[1][1], 'kd': gains[1][2]}]
+    return {'version': 4, 'firmware': FIRMWARE_NAME, 'rate_ms': config['UPDATE_INTERVAL_ms'], 'date': date, 'time': time,
+            'sensors': sensors, 'servos': servos, 'pid': pid}
+
+
+#the start of a log, up to the opening of the records array
+def format_header(header):
+    return '{\n' + JSON_TAB + '"header":' + json_text(header, 1) + ',\n' + JSON_TAB + '"records":['
+
+#a record, including the separator from the record before it
+#the pid coefficients in the averages are written on one line each, as write_record does
+def format_record(record, first=False):
+    def members(values, depth):
+        return [f'\n{JSON_TAB*depth}"{key}":{json_text(value, depth)}' for key, value in values.items()]
+    avg = dict(record['avg'])
+    avg_pid = avg.pop('pid', None)
+    avg_members = members(avg, 4)
+    if avg_pid is not None:
+        coefs = ",".join(f"\n{JSON_TAB*5}{{" + ",".join(f'"{key}":{value}' for key, value in c.items()) + "}" for c in avg_pid)
+        avg_members.append(f'\n{JSON_TAB*4}"pid":[{coefs}]')
+    avg_text = "{" + ",".join(avg_members) + "\n" + JSON_TAB*3 + "}"
+    record_members = members({key: value for key, value in record.items() if key != 'avg'}, 3)
+    record_members.append(f'\n{JSON_TAB*3}"avg":{avg_text}')
+    return ("" if first else ",") + "\n" + JSON_TAB*2 + "{" + ",".join(record_members) + "\n" + JSON_TAB*2 + "}"
+
+#the end of a log
+def format_footer():
+    return "\n" + JSON_TAB + "]\n}"
+
+
+#rounded mean of each row, as the firmware averages samples
+def int_mean(samples):
+    samples = np.asarray(samples, np.int64)
+    n = samples.shape[-1]
+    if n == 0:
+        return np.zeros(samples.shape[:-1], np.int64)
+    return (samples.sum(axis=-1) + n//2) // n
+
+
+#the averages of a record, as write_record reports them, from its samples
+#the rpm is from the tick intervals, the power from the rpm and the average torque, and the pid coefficients are the gains
+def record_averages(record, config, gains):
+    tick_us = 1 << config['TICK_us_BITS']
+    intervals = np.asarray(record['spd'], np.int64)
+    avg = {}
+    for name in ['usr', 'map', 'tmp', 'egt']:
+        if name in record:
+            avg[name] = int_mean(record[name]).tolist()
+    avg['trq'] = int(int_mean(record['trq']))
+    avg['rpm'] = int((60000000//tick_us*len(intervals))//intervals.sum()) if intervals.sum() > 0 else 0
+    avg['pow'] = int((((avg['rpm']*avg['trq'] + 512) >> 10)*3514 + (1 << 14)) >> 15)
+    if 'srv' in record:
+        avg['srv'] = int_mean(record['srv']).tolist()
+    if config['NO_OF_PIDS'] > 0:
+        avg['pid'] = [{'kp': kp, 'ki': ki, 'kd': kd} for kp, ki, kd in (list(gains) + [(0, 0, 0)]*config['NO_OF_PIDS'])[:config['NO_OF_PIDS']]]
+    return avg
+
+
+#records of a synthetic engine run, as dicts with the fields of a v4 record, in the order write_record writes them
+# config:  firmware build (see binary_records.firmware_config)
+# records: number of records
+# drop:    fraction of records to leave out, as if they were lost (the timestamps skip them)
+def generate_records(config, records, seed=0, drop=0.0, gains=((76, 25, 0), (0, 2282, 0))):
+    rng = np.random.default_rng(seed)
+    interval = config['UPDATE_INTERVAL_ms']
+    slow = config['ANALOG_SAMPLES_PER_UPDATE']
+    fast = config['NO_OF_ADC_FAST_PER_RECORD']
+    egt_n = config['EGT_SAMPLES_PER_UPDATE']
+    loops = config['PID_LOOPS_PER_UPDATE']
+    max_ticks = config['RPM_MAX_TICKS_PER_UPDATE']
+    tick_us = 1 << config['TICK_us_BITS']
+
+    rpm = 0.0               #engine speed
+    target = 0.0
+    last_tick = None        #time (ms) of the last tacho tick
+    last_tk = None          #and in counter ticks, as logged
+    integral = 0
+    throttle = 0
+    egt = 20.0
+    for n in range(records):
+        timestamp = START_ms + n*interval
+        if drop and rng.random() < drop:
+            continue
+
+        #change the target every 20s or so, after a few seconds stopped
+        if n*interval >= 3000 and (target == 0 or rng.random() < interval/20000):
+            target = rng.uniform(RPM_MIN_SET_rpm, RPM_MAX_SET_rpm)
+        #the engine speed at each pid loop, heading for the target
+        loop_t = timestamp + np.arange(loops)*config['PID_UPDATE_INTERVAL_ms']
+        speeds = np.empty(loops)
+        for k in range(loops):
+            if target > 0:
+                rpm += (target - rpm)*0.02 + rng.normal(0, 10)
+                rpm = max(rpm, 200.0)
+            speeds[k] = rpm
+
+        #tacho ticks within this record
+        ticks = []
+        if rpm > 0:
+            if last_tick is None or last_tick < timestamp - interval:
+                last_tick = timestamp + rng.uniform(0, 60000/rpm)
+                ticks.append(last_tick)
+            while True:
+                speed = speeds[min(loops-1, max(0, int((last_tick - timestamp)//config['PID_UPDATE_INTERVAL_ms'])))]
+                tick = last_tick + 60000/speed*(1 + rng.normal(0, 0.01))
+                if tick >= timestamp + interval:
+                    break
+                ticks.append(tick)
+                last_tick = tick
+        ticks = [t for t in ticks if t >= timestamp][:max_ticks]
+        tick_tk = np.round(np.array(ticks)*1000/tick_us).astype(np.int64)
+        intervals = np.zeros(0, np.int64)
+        spd_t0 = 0
+        if len(ticks):
+            #the interval of the first tick is from the last tick before it, if the engine was already running
+            if last_tk is None or tick_tk[0] - last_tk > interval*1000//tick_us:
+                last_tk = tick_tk[0] - round(60000/rpm*1000/tick_us)
+            intervals = np.diff(tick_tk, prepend=last_tk)
+            spd_t0 = int(tick_tk[0] - round(timestamp*1000/tick_us))
+            last_tk = tick_tk[-1]
+
+        #rpm pid, in rpm, with the fixed point terms it would log
+        knob = int(np.clip((target - RPM_MIN_SET_rpm)*1023/(RPM_MAX_SET_rpm - RPM_MIN_SET_rpm), 0, 1023)) if target else 0
+        trg = np.full(loops, int(target))
+        act = speeds.astype(np.int64)
+        err = trg - act
+        kp, ki, kd = gains[0]
+        p = (kp*err) >> PID_FP_FRAC_BITS
+        i = integral + np.cumsum(ki*err)
+        i = np.clip(i, -(1023 << PID_FP_FRAC_BITS), 1023 << PID_FP_FRAC_BITS)
+        integral = int(i[-1])
+        d = np.zeros(loops, np.int64)
+        out = np.clip(p + (i >> PID_FP_FRAC_BITS) + d, 0, 1023)
+        throttle = out
+
+        egt += ((200 + rpm/10) - egt)*0.05
+        record = {'timestamp': timestamp}
+        if config['NO_OF_USER_INPUTS'] > 0:
+            usr = rng.integers(0, 4, (config['NO_OF_USER_INPUTS'], slow)) + np.arange(config['NO_OF_USER_INPUTS'])[:, None]*200
+            usr[0] = np.clip(knob + rng.integers(-1, 2, slow), 0, 1023)
+            record['usr'] = usr.tolist()
+        if config['NO_OF_MAP_SENSORS'] > 0:
+            phase = np.arange(fast)*config['ADC_SAMPLE_INTERVAL_ms']*rpm/60000*2*np.pi
+            map_ = 1013 - rpm/50 + 20*np.sin(phase) + rng.normal(0, 2, (config['NO_OF_MAP_SENSORS'], fast))
+            record['map'] = np.round(map_).astype(np.int64).tolist()
+        if config['NO_OF_TMP_SENSORS'] > 0:
+            record['tmp'] = np.round((30 + rng.normal(0, 0.5, (config['NO_OF_TMP_SENSORS'], slow)))*4).astype(np.int64).tolist()
+        if config['NO_OF_EGT_SENSORS'] > 0:
+            record['egt'] = np.round((egt + rng.normal(0, 2, (config['NO_OF_EGT_SENSORS'], egt_n)))*4).astype(np.int64).tolist()
+        trq = np.round(rpm/2 + rng.normal(0, 20, slow)).astype(np.int64)
+        record['trq'] = trq.tolist()
+        record['spd_t0'] = spd_t0
+        record['spd'] = intervals.tolist()
+        if config['NO_OF_SERVOS'] > 0:
+            srv = np.zeros((config['NO_OF_SERVOS'], loops), np.int64)
+            srv[0] = throttle
+            if config['NO_OF_SERVOS'] > 1:
+                srv[1] = 512
+            record['srv'] = srv.tolist()
+        if config['NO_OF_PIDS'] > 0:
+            pids = [{'trg': trg.tolist(), 'act': act.tolist(), 'err': err.tolist(), 'out': out.tolist(),
+                     'p': p.tolist(), 'i': i.tolist(), 'd': d.tolist()}]
+            zeros = [0]*loops
+            for k in range(1, config['NO_OF_PIDS']):
+                pids.append({'trg': zeros, 'act': zeros, 'err': zeros, 'out': zeros, 'p': zeros, 'i': zeros, 'd': zeros})
+            record['pid'] = pids
+
+        record['avg'] = record_averages(record, config, gains)
+        yield record
+
+
+#write a v4 log, one record at a time
+def write_v4_log(file, header, records):
+    file.write(format_header(header))
+    for n, record in enumerate(records):
+        file.write(format_record(record, n == 0))
+    file.write(format_footer())
+
+
+#write the same records as a v3 log
+#v3 logs have the averages of each record, then 'ANA no.' and the samples, with tick times in ms
+def write_v3_log(file, header, records):
+    def values(samples):
+        return ",".join(str(v) for v in samples)
+    file.write(f"{header['date']},{header['time']}\nRecord Ver.: 3\n")
+    tick_ms = 2**next(s for s in header['sensors'] if s['name'] == 'spd')['scale']/1000
+    for record in records:
+        avg = record['avg']
+        lines = ["----------", f"Timestamp: {record['timestamp']}"]
+        for name in ['usr', 'map', 'tmp']:
+            for index, value in enumerate(avg.get(name, [])):
+                lines.append(f"{index} {name.upper()}: {value}")
+        for index, value in enumerate(avg.get('egt', [])):
+            lines.append(f"{index} EGT avg: {value}")
+        lines.append(f"TRQ: {avg['trq']}")
+        lines.append(f"RPM avg: {avg['rpm']}")
+        lines.append(f"RPM no.: {len(record['spd'])}")
+        lines.append(f"POW: {avg['pow']}")
+        lines.append(f"ANA no.: {len(record['trq'])}")
+        for name in ['usr', 'map', 'tmp']:
+            for index, samples in enumerate(record.get(name, [])):
+                lines.append(f"{index} {name.upper()}: {values(samples)}")
+        lines.append(f"TRQ: {values(record['trq'])}")
+        for index, samples in enumerate(record.get('egt', [])):
+            lines.append(f"{index} EGT: {values(samples)}")
+        if record['spd']:
+            lines.append(f"RPM tick offset (ms): {round(record['spd_t0']*tick_ms)}")
+            lines.append(f"RPM times (ms): {values(round(v*tick_ms) for v in record['spd'])}")
+        lines += ["----------", ""]
+        file.write("\n".join(lines) + "\n")
+
+
+#write a synthetic log
+# v3:     write a v3 (text) log rather than v4 (json)
+# config: firmware build overrides, eg. {'NO_OF_EGT_SENSORS': 2}
+def generate_log(path, records, v3=False, seed=0, drop=0.0, config=None):
+    config = firmware_config(**(config or {}))
+    header = log_header(config)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        if v3:
+            write_v3_log(file, header, generate_records(config, records, seed, drop))
+        else:
+            write_v4_log(file, header, generate_records(config, records, seed, drop))
+
+
+#NAME=VALUE firmware config overrides from the command line
+def parse_config(items):
+    config = {}
+    for item in items or []:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"config should be NAME=VALUE, not '{item}'")
+        config[name] = int(value)
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write a synthetic log file")
+    parser.add_argument('path', help="output file")
+    parser.add_argument('records', type=int, help="number of records")
+    parser.add_argument('--v3', action='store_true', help="write a v3 (text) log")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drop', type=float, default=0, help="fraction of records to leave out")
+    parser.add_argument('--config', nargs='*', metavar='NAME=VALUE', help="firmware build settings, see binary_records.FIRMWARE_CONFIG")
+    args = parser.parse_args()
+    try:
+        config = parse_config(args.config)
+        generate_log(args.path, args.records, args.v3, args.seed, args.drop, config)
+    except (ValueError, KeyError) as e:
+        sys.exit(str(e))
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Loads a folder of log files and joins them into sessions.
+
+The controller starts a new log file every time it is reset or logging is restarted,
+so a day of testing is spread over many files in one folder (eg. "09-08-2023/23080400.JSN" ... "23080412.JSN").
+Each file is parsed in its own process, and the files are then placed on a common wall clock axis
+using the date and time in their headers and joined into sessions:
+files that start within max_gap_s of the end of the file before are part of the same session.
+
+Each session is returned as a log_file, with the same channels as a single log,
+timestamped in seconds from the start of the first file in the session.
+
+usage: python log_session.py <folder or files...> [--processes N] [--gap S] [--plot START STOP]
+
+@author: AlexT-38
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from data_channel import data_channel
+from log_file_visualiser import log_file
+
+
+LOG_EXTENSIONS = ('.jsn', '.json', '.txt')
+
+
+#log files in a folder, in name order (the firmware names files by date and sequence number)
+def find_logs(folder):
+    names = sorted(name for name in os.listdir(folder) if name.lower().endswith(LOG_EXTENSIONS))
+    return [os.path.join(folder, name) for name in names]
+
+
+#wall clock time at which a log started, None if the log doesn't say (v3 logs)
+def log_start(log):
+    if not log.date or not log.time:
+        return None
+    try:
+        return datetime.datetime.strptime(log.date + " " + log.time, "%Y/%m/%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+#duration of a log (s), up to the end of its last record
+def log_duration(log):
+    if len(log.AVG_t) == 0:
+        return 0
+    return log.AVG_t[-1] + log.RECORD_INTERVAL
+
+
+#parse one log - this runs in a worker process
+#log_file lower cases its path, the path is put back as given so that sessions list files that exist
+def load_log(path, stream=None, cache=None):
+    log = log_file(path, stream, cache)
+    log.path = path
+    return log
+
+
+#parse a list of log files, each in its own process
+#processes: number of worker processes, None to use every core, 1 to load in this process
+#logs that fail to load are reported and left out
+def load_logs(paths, processes=None, stream=None, cache=None):
+    if processes == 1 or len(paths) < 2:
+        logs = []
+        for path in paths:
+            try:
+                logs.append(load_log(path, stream, cache))
+            except Exception as e:
+                print("could not load", path, ":", e)
+        return logs
+
+    logs = []
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(load_log, path, stream, cache) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                logs.append(future.result())
+            except Exception as e:
+                print("could not load", path, ":", e)
+    return logs
+
+
+#group logs into sessions, each session a list of (log, start time offset in s from the start of the session)
+#logs without a start time are assumed to follow straight on from the log before (or to end where the log after starts)
+def group_sessions(logs, max_gap_s=600):
+    #put the logs in wall clock order, keeping the given order for any without a start time:
+    #those after a log with a start time follow straight on from it, those before the first one end where the next starts,
+    #and if nothing in the list has a start time the logs are laid end to end
+    starts = [log_start(log) for log in logs]
+    durations = [datetime.timedelta(seconds=float(log_duration(log))) for log in logs]
+    dated = [n for n, start in enumerate(starts) if start is not None]
+    if not logs:
+        return []
+    if not dated:
+        starts[0] = datetime.datetime(1970, 1, 1)
+        dated = [0]
+    for n in range(dated[0] + 1, len(logs)):
+        if starts[n] is None:
+            starts[n] = starts[n-1] + durations[n-1]
+    for n in range(dated[0] - 1, -1, -1):
+        starts[n] = starts[n+1] - durations[n]
+    order = sorted(range(len(logs)), key=lambda n: starts[n])
+
+    sessions = []
+    session_start = None
+    session_end = None
+    for n in order:
+        log, start = logs[n], starts[n]
+        if session_end is None or (start - session_end).total_seconds() > max_gap_s:
+            sessions.append([])
+            session_start = start
+        offset = (start - session_start).total_seconds()
+        if session_end is not None and start < session_end and sessions[-1]:
+            print("log", log.path, "starts", (session_end - start).total_seconds(), "s before the end of the log before it")
+        sessions[-1].append((log, offset))
+        end = start + datetime.timedelta(seconds=float(log_duration(log)))
+        session_end = end if session_end is None else max(session_end, end)
+    return sessions
+
+
+#join the logs of a session into a single log_file
+#parts is a list of (log, time offset in s), as from group_sessions
+def merge_logs(parts):
+    first = parts[0][0]
+    merged = log_file.__new__(log_file)
+    merged.path = os.path.dirname(first.path)
+    merged.paths = [log.path for log, offset in parts]
+    merged.offsets_s = np.array([offset for log, offset in parts])
+    for name in ['record_version', 'firmware', 'date', 'time', 'header', 'RECORD_INTERVAL', 'RECORD_INTERVAL_ms', 'RPM_tick_scale']:
+        if hasattr(first, name):
+            setattr(merged, name, getattr(first, name))
+
+    #concatenate each channel, shifting its times by the offset of the log it came from
+    def merge_group(group):
+        merged_group = {}
+        for log, offset in parts:
+            for name, channels in getattr(log, group).items():
+                merged_channels = merged_group.setdefault(name, [])
+                for channel in channels:
+                    while len(merged_channels) <= channel.index:
+                        merged_channels.append([])
+                    merged_channels[channel.index].append((channel, offset))
+        result = {}
+        for name, channels in merged_group.items():
+            result[name] = []
+            for index, pieces in enumerate(channels):
+                if not pieces:
+                    continue
+                channel = pieces[0][0]
+                merged_channel = data_channel(name, index, 0, channel.units, channel.scale, rate=channel.rate)
+                #keep the raw values if every piece has the same factor
+                if all(c.factor == channel.factor for c, o in pieces):
+                    values = np.concatenate([c.raw for c, o in pieces])
+                    merged_channel.calibrate(channel.factor)
+                else:
+                    values = np.concatenate([c.values for c, o in pieces])
+                if any(c.times is None for c, o in pieces):
+                    merged_channel.set(values)
+                else:
+                    merged_channel.set(values, np.concatenate([c.times + o for c, o in pieces]))
+                result[name].append(merged_channel)
+        return result
+
+    merged.channels = merge_group('channels')
+    merged.averages = merge_group('averages')
+    merged.AVG_t = np.concatenate([log.AVG_t + offset for log, offset in parts])
+
+    #per record and per tick fields, indices are shifted by the number of records/ticks in the logs before
+    records = np.cumsum([0] + [len(log.AVG_t) for log, offset in parts])
+    ticks = np.cumsum([0] + [len(log.RPM_tick_time_record) for log, offset in parts])
+    def concat(name, shift=None):
+        arrays = []
+        for n, (log, offset) in enumerate(parts):
+            array = np.asarray(getattr(log, name, []))
+            if shift is not None:
+                array = array + shift[n]
+            arrays.append(array)
+        setattr(merged, name, np.concatenate(arrays))
+    concat('RPM_no')
+    concat('RPM_offset')
+    concat('RPM_tick_time_record_offset')
+    concat('RPM_tick_time_record', records)
+    concat('RPM_tick_time_record_s', merged.offsets_s)
+    concat('RPM_tick_non_monotonic', ticks)
+    concat('RPM_tick_late', ticks)
+
+    merged.finish_channels()
+    return merged
+
+
+#load a folder (or list) of logs, and return one log_file per session
+def load_sessions(paths, processes=None, max_gap_s=600, stream=None, cache=None):
+    if isinstance(paths, str):
+        paths = find_logs(paths) if os.path.isdir(paths) else [paths]
+    logs = load_logs(paths, processes, stream, cache)
+    return [merge_logs(parts) for parts in group_sessions(logs, max_gap_s)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load a folder of log files and join them into sessions")
+    parser.add_argument('paths', nargs='+', help="log folder, or log files")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--gap', type=float, default=600, help="start a new session after a gap of this many seconds")
+    parser.add_argument('--plot', type=float, nargs=2, metavar=('START', 'STOP'), help="plot each session, with detail from START to STOP s")
+    args = parser.parse_args()
+
+    paths = args.paths[0] if len(args.paths) == 1 else args.paths
+    if isinstance(paths, str) and not os.path.exists(paths):
+        sys.exit(f"no such file or folder: {paths}")
+    sessions = load_sessions(paths, args.processes, args.gap)
+
+    for n, session in enumerate(sessions):
+        print(f"session {n}: {session.date} {session.time}, {len(session.paths)} logs, {log_duration(session):.1f} s")
+        for path, offset in zip(session.paths, session.offsets_s):
+            print(f"    {offset:10.1f} s  {path}")
+        if args.plot:
+            session.plot_data(*args.plot)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Interactive viewer for a parsed log.
+
+All of the main channels are drawn in one window, one panel per sensor, with their time axes linked,
+so zooming or panning any panel (with the matplotlib toolbar, or the mouse wheel) moves them all.
+
+Every time the visible time range changes, each line is re-fetched for just that range
+from its channel's level of detail pyramid (see decimate), which finds the range with a binary search
+on the timestamps and returns about as many points as the panel is pixels wide,
+so the view stays responsive however long the log is and however far it is zoomed in.
+
+usage: python log_viewer.py <log file> [START STOP]
+
+@author: AlexT-38
+"""
+
+import sys
+import numpy as np
+import matplotlib.pyplot as plt
+
+from decimate import lod_pyramid
+
+
+# log_viewer shows a log_file in a single window of linked panels
+class log_viewer:
+
+    zoom_factor = 1.5       #zoom per mouse wheel step
+
+    def __init__(self, log):
+        self.log = log
+        self.lines = []     #list of (line, lod_pyramid or tick_series, function of the values to plot)
+        panels = self.panels()
+        self.fig, axes = plt.subplots(len(panels), 1, sharex=True, squeeze=False, figsize=(12, 2*len(panels)))
+        self.axes = axes[:, 0]
+        for ax, (title, series) in zip(self.axes, panels):
+            for label, lod, function in series:
+                line, = ax.plot([], [], label=label)
+                self.lines.append((line, lod, function))
+            self.autoscale_y(ax, series)
+            ax.set_title(title, fontsize='small')
+            ax.legend(loc='upper left', fontsize='x-small')
+        self.axes[-1].set_xlabel("time (s)")
+        self.axes[0].set_autoscalex_on(False)
+        self.axes[0].callbacks.connect('xlim_changed', self.on_xlim)
+        self.fig.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.fig.tight_layout()
+
+    #the panels to draw, each a title and a list of (label, lod_pyramid or tick_series, function of values to plot or None)
+    def panels(self):
+        log = self.log
+        panels = []
+        def add(title, series):
+            series = [s for s in series if len(s[1])]
+            if series:
+                panels.append((title, series))
+        def channels(name, label, averages=False, limit=None):
+            group = log.averages if averages else log.channels
+            return [(f"{label} {c.index}", c.lod(), None) for c in group.get(name, [])[:limit] if c.times is not None]
+
+        add('User Input (LSB)', channels('usr', 'USR', limit=1) + channels('usr', 'USR avg.', True, 1))
+        add('MAP (mbar)', channels('map', 'MAP') + channels('map', 'MAP avg.', True))
+        add('EGT (°C)', channels('egt', 'EGT') + channels('egt', 'EGT avg.', True))
+        add('Torque (mN.m)', channels('trq', 'TRQ') + channels('trq', 'TRQ avg.', True))
+
+        rpm = []
+        ticks = log.tick_rpm()
+        if ticks is not None:
+            rpm.append(('from tick times', ticks, None))
+        if len(log.RPM_no) == len(log.AVG_t):
+            rpm.append(('avg. from count', lod_pyramid(log.AVG_t, 60*log.RPM_no/log.RECORD_INTERVAL), None))
+        rpm += [('reported avg.', c.lod(), None) for c in log.averages.get('rpm', [])]
+        add('Engine Speed (RPM)', rpm)
+
+        pid = log.get_pid(0)
+        add('RPM PID', [(key, pid[key].lod(), None) for key in ['trg', 'act', 'err', 'out'] if key in pid])
+        return panels
+
+    #fit the y axis of a panel to all of its data
+    def autoscale_y(self, ax, series):
+        low, high = np.inf, -np.inf
+        for label, lod, function in series:
+            times, values = lod.get()       #reduced with min and max kept, so has the same range
+            if function is not None:
+                values = function(values)
+            values = values[np.isfinite(values)]
+            if len(values):
+                low, high = min(low, values.min()), max(high, values.max())
+        if low < high:
+            margin = 0.05*(high - low)
+            ax.set_ylim(low - margin, high + margin)
+
+    #fetch every line for the visible time range
+    def on_xlim(self, ax):
+        t0, t1 = ax.get_xlim()
+        points = max(100, int(ax.bbox.width))
+        for line, lod, function in self.lines:
+            times, values = lod.get(t0, t1, points)
+            line.set_data(times, values if function is None else function(values))
+        self.fig.canvas.draw_idle()
+
+    #zoom the time axis around the mouse
+    def on_scroll(self, event):
+        if event.xdata is None:
+            return
+        t0, t1 = self.axes[0].get_xlim()
+        scale = 1/self.zoom_factor if event.button == 'up' else self.zoom_factor
+        self.axes[0].set_xlim(event.xdata - (event.xdata - t0)*scale, event.xdata + (t1 - event.xdata)*scale)
+
+    #set the visible time range, None for the start/end of the log
+    def set_range(self, t0=None, t1=None):
+        end = self.log.AVG_t[-1] + self.log.RECORD_INTERVAL if len(self.log.AVG_t) else 1
+        self.axes[0].set_xlim(0 if t0 is None else t0, end if t1 is None else t1)
+
+    def show(self, t0=None, t1=None):
+        self.set_range(t0, t1)
+        plt.show()
+
+
+if __name__ == "__main__":
+    from log_file_visualiser import log_file
+    if len(sys.argv) < 2:
+        sys.exit("usage: python log_viewer.py <log file> [START STOP]")
+    log = log_file(sys.argv[1])
+    t0, t1 = (float(sys.argv[2]), float(sys.argv[3])) if len(sys.argv) > 3 else (None, None)
+    log_viewer(log).show(t0, t1)
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+PID replay - runs recorded pid inputs through the firmware's pid calculation, for any number of gain sets at once.
+
+update_PID (PID.ino) works in fixed point: the gains are 7.9 fixed point (PID_FP_FRAC_BITS),
+the error and the stored p and d terms are 16 bit ints, the integral and the products are 32 bit longs,
+and the output is clamped to 10 bits, centred on 511. replay_pid does the same sums on int64 arrays,
+wrapping to the C types where the firmware would, so its outputs match the firmware's to the bit.
+
+The integral is the only term carried from one update to the next (it saturates at +/-i_max, and is cleared
+whenever the engine is too slow for the pid to run), and it depends on the error alone, not on the gains,
+so it is worked out once for the whole series with a scan (see saturating_sum), and the output of every
+gain set is then a handful of array operations - there is no loop over updates.
+
+Two quirks of update_PID are mirrored rather than fixed:
+    pid->p is overwritten with the scaled p term, so d is err - (last p term), not err - (last err),
+    and the test to pause integration while the output is saturated can never be true, so it never pauses.
+
+The pid inputs can be:
+    the pid target and actual values logged by the firmware (pid trg/act), which replays what the pid was given,
+    or the rpm counter ticks of a log (spd), or a file of tick times (s, one per line, as test scripts/data/rpm_log.txt),
+    averaged over each pid update as get_rpm_for_pid (RPM_Counter.ino) does.
+
+pid_batch runs many pids one update at a time, for closed loop simulation (see pid_sweep).
+update_pid is a step by step port of update_PID, used to check replay_pid (--check).
+
+usage: python pid_replay.py <log or tick file> [--ticks] [--time] [--target RPM] [--gains KP KI KD ...] [--check N]
+
+@author: AlexT-38
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from log_file_visualiser import log_file
+
+
+#PID.h
+PID_FP_FRAC_BITS = 9
+PID_FP_ONE = 1 << PID_FP_FRAC_BITS
+PID_OUTPUT_BITS = 10
+PID_OUTPUT_MAX = (1 << PID_OUTPUT_BITS) - 1
+PID_OUTPUT_MIN = 0
+PID_OUTPUT_CENTRE = (PID_OUTPUT_MAX + PID_OUTPUT_MIN) >> 1
+PID_RPM_MIN_FB_RPM = 120
+
+#PID.ino
+PID_DEFAULT_THROTTLE = 200
+PID_DEFAULT_GAINS = (512, 128, 25)  #configure_PID: PID_FL_TO_FP(1.0), PID_FL_TO_FP(0.25), PID_FL_TO_FP(0.05)
+INT32_MAX = (1 << 31) - 1
+I_MAX_RSH_RPM = 13                  #reset_PID(&RPM_control, 13) when controlling rpm
+I_MAX_RSH_TIME = 15                 #reset_PID(&RPM_control, 15) when controlling tick time
+
+#RPM_counter.h, RPM_Counter.ino, firmware_arduino.ino
+TICK_us_BITS = 4
+TICK_us = 1 << TICK_us_BITS
+OVF_LIMIT = 2                       #timer overflows without a tick before the engine is taken to have stopped
+OVERFLOW_ms = 65536*TICK_us/1000    #time between rpm counter timer overflows
+PID_UPDATE_INTERVAL_ms = 50
+UPDATE_INTERVAL_ms = 500
+
+
+#PID_FL_TO_FP, a float gain to fixed point (the cast truncates towards 0)
+def fl_to_fp(value):
+    return int(value * PID_FP_ONE)
+
+#RPM_TO_TK
+def rpm_to_tk(rpm):
+    return (60000000//TICK_us)//rpm
+
+
+#wrap int64 values to a C integer type, as assigning them to it would
+def wrap(values, dtype):
+    return np.asarray(values, np.int64).astype(dtype).astype(np.int64)
+
+#the same for a single python int
+def c_int(value, bits, signed=True):
+    value &= (1 << bits) - 1
+    if signed and value >= 1 << (bits-1):
+        value -= 1 << bits
+    return value
+
+
+#running sum of steps, clamped to low..high after each step: x = clamp(x + step, low, high)
+#low and high can be arrays, one per step (eg. 0, 0 to clear the sum at a step)
+#each step is the function x -> clamp(x + a, lo, hi), and two of those composed are a function of the same form,
+#so the sum is worked out as a prefix scan, in log2(steps) passes over the arrays
+def saturating_sum(steps, low, high, start=0):
+    a = np.array(steps, np.int64)
+    lo = np.array(np.broadcast_to(low, a.shape), np.int64)
+    hi = np.array(np.broadcast_to(high, a.shape), np.int64)
+    shift = 1
+    while shift < len(a):
+        #each step, preceded by the (already composed) step shift places before it
+        after = slice(shift, None)
+        before = slice(None, -shift)
+        composed_lo = np.clip(lo[before] + a[after], lo[after], hi[after])
+        composed_hi = np.clip(hi[before] + a[after], lo[after], hi[after])
+        a[after] = a[before] + a[after]
+        lo[after] = composed_lo
+        hi[after] = composed_hi
+        shift *= 2
+    return np.clip(start + a, lo, hi)
+
+
+#which updates process_pid_loop runs update_PID for, rather than holding PID_DEFAULT_THROTTLE
+#feedback: the pid input, rpm, or tick time when use_time is set (flags_config.pid_rpm_use_time)
+def pid_runs(feedback, use_time=False):
+    feedback = np.asarray(feedback)
+    if use_time:
+        return (feedback != 0) & (feedback < rpm_to_tk(PID_RPM_MIN_FB_RPM))
+    return feedback > PID_RPM_MIN_FB_RPM
+
+
+#replay a series of pid updates for one or more sets of gains
+# target, feedback: the pid target and input of each update (ints, as update_PID is given them)
+# gains:  (kp, ki, kd) in fixed point (see fl_to_fp), or an array of them, one row per gain set
+# invert: pid->invert, the error is feedback - target rather than target - feedback (set when controlling tick time)
+# i_max:  integral limit (see reset_PID), None for the limit process_pid_loop sets
+# run:    bool per update, False where process_pid_loop holds PID_DEFAULT_THROTTLE and clears the integral
+#         rather than calling update_PID, None to work it out from the feedback (see pid_runs)
+# fields: which of the pid fields to return, 'out' is the servo demand, the rest as in PID_RECORD
+#returns a dict of field : array of (gain sets, updates)
+#the fields after updates where the pid isn't run hold their last values, as the firmware's PID struct does
+def replay_pid(target, feedback, gains, invert=False, i_max=None, run=None, fields=('out', 'err', 'p', 'i', 'd')):
+    target = np.asarray(target, np.int64)
+    feedback = np.asarray(feedback, np.int64)
+    gains = np.atleast_2d(np.asarray(gains, np.int64))
+    kp, ki, kd = gains[:, 0:1], gains[:, 1:2], gains[:, 2:3]
+    if i_max is None:
+        i_max = INT32_MAX >> (I_MAX_RSH_TIME if invert else I_MAX_RSH_RPM)
+    run = pid_runs(feedback, invert) if run is None else np.asarray(run, bool)
+
+    err = wrap(feedback - target if invert else target - feedback, np.int16)
+
+    #index of the last update the pid was run at, up to and including each update (-1 for none yet)
+    last = np.maximum.accumulate(np.where(run, np.arange(len(run)), -1))
+    previous = np.concatenate(([-1], last[:-1]))
+    def held(values, index):
+        return np.where(index >= 0, values[..., np.maximum(index, 0)], 0)
+
+    #the integral only changes at updates that run, and is cleared at those that don't
+    integral = saturating_sum(np.where(run, err, 0), np.where(run, -i_max, 0), np.where(run, i_max, 0))
+    integral = np.where(ki != 0, integral, 0)
+
+    #p and d of the last update are the scaled terms, the next d is the error less the last p term
+    p = wrap(err * kp, np.int32)
+    p_term = wrap(p >> PID_FP_FRAC_BITS, np.int16)
+    d_err = wrap(err - held(p_term, previous), np.int16)
+    d = wrap(d_err * kd, np.int32)
+    i = wrap(integral * ki, np.int32)
+    calc = wrap(p + i + d, np.int32)
+    result = wrap(PID_OUTPUT_CENTRE + wrap(calc >> PID_FP_FRAC_BITS, np.int16), np.int16)
+    output = np.clip(result, PID_OUTPUT_MIN, PID_OUTPUT_MAX)
+
+    replayed = {}
+    for field in fields:
+        if field == 'out':
+            values = np.where(run, output, PID_DEFAULT_THROTTLE)
+        elif field == 'err':
+            values = np.broadcast_to(held(err, last), output.shape)
+        elif field == 'p':
+            values = held(p_term, last)
+        elif field == 'i':
+            values = np.broadcast_to(integral, output.shape)
+        elif field == 'd':
+            values = held(wrap(d >> PID_FP_FRAC_BITS, np.int16), last)
+        else:
+            raise ValueError(f"unknown pid field '{field}'")
+        replayed[field] = values
+    return replayed
+
+
+# pid_batch is process_pid_loop's rpm pid for many pids at once (eg. one per set of gains), one update at a time
+# for closed loop simulation, where the input of each update depends on the output of the one before
+# (replay_pid needs all of the inputs up front)
+class pid_batch:
+    # gains, invert, i_max: as replay_pid, each pid starts as reset_PID leaves it
+    def __init__(self, gains, invert=False, i_max=None):
+        gains = np.atleast_2d(np.asarray(gains, np.int64))
+        self.kp, self.ki, self.kd = gains[:, 0], gains[:, 1], gains[:, 2]
+        self.invert = invert
+        self.i_max = INT32_MAX >> (I_MAX_RSH_TIME if invert else I_MAX_RSH_RPM) if i_max is None else i_max
+        self.p = np.zeros(len(gains), np.int64)     #pid->p, the scaled p term of the last update
+        self.i = np.zeros(len(gains), np.int64)     #pid->i, the integral
+        self.err = np.zeros(len(gains), np.int64)
+        self.d = np.zeros(len(gains), np.int64)     #pid->d, the scaled d term
+        self.actual = np.zeros(len(gains), np.int64)
+        self.output = np.zeros(len(gains), np.int64)
+
+    def __len__(self):
+        return len(self.kp)
+
+    #one update of every pid, target and feedback are single values or one per pid
+    #run: as replay_pid, None to work it out from the feedback
+    #returns the servo demand of each pid
+    def update(self, target, feedback, run=None):
+        target = np.asarray(target, np.int64)
+        feedback = np.asarray(feedback, np.int64)
+        run = np.broadcast_to(pid_runs(feedback, self.invert) if run is None else run, self.p.shape)
+        err = wrap(feedback - target if self.invert else target - feedback, np.int16)
+
+        #saturate the integral rather than let it pass i_max, and clear it where the pid isn't run
+        clip = ((err > 0) & (self.i >= self.i_max - err)) | ((err < 0) & (self.i <= -self.i_max - err))
+        integral = np.where(clip, np.where(err > 0, self.i_max, -self.i_max), wrap(self.i + err, np.int32))
+        self.i = np.where(run, np.where(self.ki != 0, integral, self.i), 0)
+
+        p = wrap(err * self.kp, np.int32)
+        i = wrap(self.i * self.ki, np.int32)
+        d = wrap(wrap(err - self.p, np.int16) * self.kd, np.int32)
+        calc = wrap(p + i + d, np.int32)
+        result = wrap(PID_OUTPUT_CENTRE + wrap(calc >> PID_FP_FRAC_BITS, np.int16), np.int16)
+        output = np.clip(result, PID_OUTPUT_MIN, PID_OUTPUT_MAX)
+
+        self.p = np.where(run, wrap(p >> PID_FP_FRAC_BITS, np.int16), self.p)
+        self.d = np.where(run, wrap(d >> PID_FP_FRAC_BITS, np.int16), self.d)
+        self.err = np.where(run, err, self.err)
+        self.actual = np.where(run, feedback, self.actual)
+        self.output = np.where(run, output, self.output)
+        return np.where(run, output, PID_DEFAULT_THROTTLE)
+
+
+#a PID struct (PID.h), after reset_PID
+def new_pid(gains, invert=False, i_max=None):
+    if i_max is None:
+        i_max = INT32_MAX >> (I_MAX_RSH_TIME if invert else I_MAX_RSH_RPM)
+    return {'target': 0, 'actual': 0, 'k': tuple(gains), 'err': 0, 'output': 0, 'p': 0, 'ik': 0, 'd': 0, 'i': 0,
+            'invert': invert, 'i_max': i_max}
+
+#update_PID, one update at a time, as the firmware does it
+def update_pid(pid, feedback):
+    kp, ki, kd = pid['k']
+    pid['actual'] = feedback
+    pid['err'] = c_int(feedback - pid['target'] if pid['invert'] else pid['target'] - feedback, 16)
+    pid['d'] = c_int(pid['err'] - pid['p'], 16)
+    pid['p'] = pid['err']
+    if ki:
+        err, i, i_max = pid['err'], pid['i'], pid['i_max']
+        if (err > 0 and i >= i_max - err) or (err < 0 and i <= -i_max - err):
+            pid['i'] = i_max if err > 0 else -i_max
+        else:
+            pid['i'] = c_int(i + err, 32)
+    p = c_int(pid['p'] * kp, 32)
+    i = c_int(pid['i'] * ki, 32)
+    d = c_int(pid['d'] * kd, 32)
+    calc = c_int(p + i + d, 32)
+    result = c_int(PID_OUTPUT_CENTRE + c_int(calc >> PID_FP_FRAC_BITS, 16), 16)
+    pid['p'] = c_int(p >> PID_FP_FRAC_BITS, 16)
+    pid['d'] = c_int(d >> PID_FP_FRAC_BITS, 16)
+    pid['ik'] = c_int(i >> PID_FP_FRAC_BITS, 16)
+    pid['output'] = min(max(result, PID_OUTPUT_MIN), PID_OUTPUT_MAX)
+    return pid['output']
+
+#process_pid_loop's rpm pid, one update at a time - the servo demand of each update
+def step_pid(target, feedback, gains, invert=False, i_max=None, run=None):
+    pid = new_pid(gains, invert, i_max)
+    if run is None:
+        run = pid_runs(feedback, invert)
+    output = []
+    for trg, fb, runs in zip(target, feedback, run):
+        pid['target'] = int(trg)
+        if runs:
+            output.append(update_pid(pid, int(fb)))
+        else:
+            pid['i'] = 0
+            output.append(PID_DEFAULT_THROTTLE)
+    return np.array(output, np.int64)
+
+
+#the pid input at each pid update, from rpm counter ticks, as get_rpm_for_pid works it out
+# tick_times_ms:  time of each tick (ms), in order
+# intervals_tk:   interval of each tick in rpm counter ticks (TICK_us)
+# update_ms:      pid update interval
+# use_time:       the average tick time (us) rather than rpm (flags_config.pid_rpm_use_time)
+#                 (as in the firmware, this is in us, while the target and the limit in pid_runs are in counter ticks)
+# record_ms:      record interval (UPDATE_INTERVAL_ms), which the firmware uses to estimate the speed once ticks stop
+#returns (time of each update in ms, pid input at each update)
+def tick_feedback(tick_times_ms, intervals_tk, update_ms=PID_UPDATE_INTERVAL_ms, use_time=False,
+                  record_ms=UPDATE_INTERVAL_ms, duration_ms=None):
+    tick_times_ms = np.asarray(tick_times_ms, np.float64)
+    intervals_tk = np.asarray(intervals_tk, np.int64)
+    if duration_ms is None:
+        duration_ms = tick_times_ms[-1] if len(tick_times_ms) else 0
+    times = np.arange(1, int(duration_ms // update_ms) + 1) * update_ms
+
+    #the ticks counted since the update before each update
+    ends = np.searchsorted(tick_times_ms, times, 'right')
+    starts = np.concatenate(([0], ends[:-1]))
+    count = wrap(ends - starts, np.uint8)
+    total_tk = np.concatenate(([0], np.cumsum(intervals_tk)))
+    total = wrap(total_tk[ends] - total_tk[starts], np.uint16)
+    ticked = total != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if use_time:
+            average = wrap(np.where(ticked, (total << TICK_us_BITS) // np.maximum(count, 1), 0), np.uint16)
+        else:
+            average = wrap(np.where(ticked, ((60000000//TICK_us) * count) // np.maximum(total, 1), 0), np.uint16)
+
+    #without a tick, the first update keeps the last value, later ones estimate it from the number of updates missed,
+    #and once the rpm counter timer has overflowed OVF_LIMIT times the engine is taken to have stopped
+    last = np.maximum.accumulate(np.where(ticked, np.arange(len(times)), -1))
+    missed = np.arange(len(times)) - last
+    held = np.where(last >= 0, average[np.maximum(last, 0)], 0)
+    if use_time:
+        estimate = wrap(((record_ms * missed) * 1000) >> TICK_us_BITS, np.uint16)
+    else:
+        estimate = 60000 // np.maximum(record_ms * missed, 1)
+    feedback = np.where(missed <= 1, held, estimate)
+    last_tick_ms = np.where(ends > 0, tick_times_ms[np.maximum(ends - 1, 0)], -np.inf)
+    stopped = (times - last_tick_ms) >= OVF_LIMIT*OVERFLOW_ms
+    feedback = np.where(ticked, average, np.where(stopped, 0, feedback))
+    return times, feedback
+
+
+#read a file of tick times (s), one per line, as test scripts/data/rpm_log.txt
+#returns (tick times in ms, tick intervals in rpm counter ticks)
+def read_tick_times(path):
+    times_ms = np.loadtxt(path, ndmin=1) * 1000
+    intervals_ms = np.diff(np.concatenate(([0], times_ms)))
+    return times_ms, np.round(intervals_ms * 1000 / TICK_us).astype(np.int64)
+
+
+#True if a file is a list of tick times rather than a log (its first line is a number)
+def is_tick_file(path):
+    with open(path, 'r', errors='replace') as file:
+        line = file.readline()
+    try:
+        float(line)
+        return True
+    except ValueError:
+        return False
+
+#the pid target and input a log recorded for a pid loop, with their times (s), None if the pid wasn't logged
+def logged_inputs(log, loop=0):
+    pid = log.get_pid(loop)
+    if 'trg' not in pid or 'act' not in pid:
+        return None
+    return pid['trg'].times, pid['trg'].raw.astype(np.int64), pid['act'].raw.astype(np.int64)
+
+#the gains of each pid loop in a log header, as (kp, ki, kd) in fixed point
+def header_gains(header):
+    configs = (header or {}).get('pid', {}).get('configs', [])
+    return [(config.get('kp', 0), config.get('ki', 0), config.get('kd', 0)) for config in configs]
+
+#the pid inputs of a log's rpm counter ticks
+#target: the target (rpm) at every update, or None to use the logged pid target where there is one
+def log_tick_inputs(log, target=None, use_time=False, update_ms=PID_UPDATE_INTERVAL_ms):
+    spd = log.get_channel('spd')
+    if spd is None:
+        raise ValueError("no rpm counter ticks in the log")
+    order = spd.time_order()
+    times_s, intervals_ms = (spd.times, spd.values) if order is None else (spd.times[order], spd.values[order])
+    intervals_tk = np.round(intervals_ms * 1000 / TICK_us).astype(np.int64)
+    times_ms, feedback = tick_feedback(times_s*1000, intervals_tk, update_ms, use_time, log.RECORD_INTERVAL_ms)
+    if target is None:
+        logged = logged_inputs(log)
+        if logged is None:
+            raise ValueError("the log has no pid target, give one")
+        trg_t, trg, act = logged
+        held = np.searchsorted(trg_t*1000, times_ms, 'right') - 1
+        targets = np.where(held >= 0, trg[np.maximum(held, 0)], trg[0])
+    else:
+        targets = np.full(len(times_ms), rpm_to_tk(target) if use_time else target, np.int64)
+    return times_ms/1000, targets, feedback
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay recorded pid inputs through the firmware pid, for one or more sets of gains")
+    parser.add_argument('path', help="log file, or a file of tick times (s) with --ticks")
+    parser.add_argument('--ticks', action='store_true', help="path is a file of tick times, or use the ticks of the log rather than its logged pid inputs")
+    parser.add_argument('--time', action='store_true', help="control tick time rather than rpm (flags_config.pid_rpm_use_time)")
+    parser.add_argument('--target', type=int, help="target rpm (default: the logged pid target)")
+    parser.add_argument('--gains', type=float, nargs='+', metavar='K', help="kp ki kd (as floats) of each gain set to replay (default: the logged gains)")
+    parser.add_argument('--check', type=int, default=0, metavar='N', help="check the first N updates against a step by step replay")
+    args = parser.parse_args()
+
+    if args.gains and len(args.gains) % 3:
+        sys.exit("gains are given as kp ki kd for each gain set")
+    gains = [tuple(fl_to_fp(k) for k in args.gains[n:n+3]) for n in range(0, len(args.gains), 3)] if args.gains else None
+
+    logged_out = None
+    try:
+        if args.ticks and is_tick_file(args.path):
+            if args.target is None:
+                sys.exit("a tick time file needs a --target")
+            tick_times_ms, intervals_tk = read_tick_times(args.path)
+            times_ms, feedback = tick_feedback(tick_times_ms, intervals_tk, use_time=args.time)
+            target = np.full(len(feedback), rpm_to_tk(args.target) if args.time else args.target, np.int64)
+        else:
+            log = log_file(args.path)
+            gains = gains or header_gains(log.header)[:1]
+            if args.ticks:
+                times_s, target, feedback = log_tick_inputs(log, args.target, args.time)
+            else:
+                logged = logged_inputs(log)
+                if logged is None:
+                    sys.exit("no pid inputs in the log, use --ticks")
+                times_s, target, feedback = logged
+                if args.target is not None:
+                    target = np.full(len(feedback), rpm_to_tk(args.target) if args.time else args.target, np.int64)
+                elif log.get_pid(0).get('out') is not None:
+                    logged_out = log.get_pid(0)['out'].raw
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+    gains = gains or [PID_DEFAULT_GAINS]
+
+    start = time.perf_counter()
+    replayed = replay_pid(target, feedback, gains, invert=args.time, fields=('out',))
+    elapsed = time.perf_counter() - start
+    steps = len(feedback) * len(gains)
+    print(f"{len(feedback)} updates x {len(gains)} gain sets in {elapsed:.3f} s, {steps/max(elapsed, 1e-9)/1e6:.1f} M updates/s")
+    runs = pid_runs(feedback, args.time)
+    print(f"pid run at {np.count_nonzero(runs)} of {len(runs)} updates")
+    for (kp, ki, kd), out in zip(gains, replayed['out']):
+        line = f"kp {kp/PID_FP_ONE:6.3f} ki {ki/PID_FP_ONE:6.3f} kd {kd/PID_FP_ONE:6.3f}: out mean {out.mean():7.1f} min {out.min():5d} max {out.max():5d}"
+        if logged_out is not None and len(logged_out) == len(out):
+            line += f", matches the logged output at {np.count_nonzero(out == logged_out)} of {len(out)} updates"
+        print(line)
+
+    if args.check:
+        n = min(args.check, len(feedback))
+        for k, out in zip(gains, replayed['out']):
+            stepped = step_pid(target[:n], feedback[:n], k, args.time)
+            mismatched = np.flatnonzero(stepped != out[:n])
+            if len(mismatched):
+                print(f"gains {k}: {len(mismatched)} of {n} updates differ from the step by step replay, first at {mismatched[0]}")
+            else:
+                print(f"gains {k}: all {n} updates match the step by step replay")
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+PID gain sweep - searches for the pid gains that give the best closed loop response.
+
+Each set of gains is run in closed loop with a model of the engine (the plant):
+the pid output sets the throttle, and the model gives the speed the pid sees at its next update.
+The pid sums are the firmware's (see pid_replay.pid_batch), and every gain set is run at once, one update at a time.
+
+The plant is a first order lag with a dead time, from the throttle to the engine speed (or whatever the pid input is):
+    speed moves towards gain*throttle + offset with time constant tau_ms, delay pid updates after the throttle changes.
+It is fitted to the pid output and input recorded in a log (fit_plant), or given on the command line (--plant).
+The target follows the pid target recorded in the log, or a series of steps (--steps).
+
+Each run is scored on:
+    settling time:    mean time (s) after each target step until the error stays within --band
+    overshoot:        mean overshoot past each target step, as a fraction of the step
+    integrated error: mean absolute error over the run
+which are added, weighted by --weights, into one score - lower is better - and the gain sets are listed best first.
+Target changes smaller than --min-step (eg. noise on a logged target knob) aren't counted as steps.
+
+Gain sets are a grid (--kp/--ki/--kd START STOP N), or --random N sets drawn from the same ranges
+(log uniform, unless a range starts at 0). They are split into chunks, each run in a process pool.
+
+usage: python pid_sweep.py [log] [--loop N] [--kp START STOP N] [--ki ...] [--kd ...] [--random N]
+                           [--plant GAIN OFFSET TAU_MS DELAY] [--steps TARGET ...] [--top N] [--processes N]
+
+@author: AlexT-38
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from log_file_visualiser import log_file
+from pid_replay import pid_batch, pid_runs, fl_to_fp, PID_FP_ONE, PID_UPDATE_INTERVAL_ms
+
+
+DEFAULT_STEPS = [2000, 3000, 2500, 3500, 2000]  #rpm target steps when there is no log to follow
+DEFAULT_PLANT = (3.0, 900.0, 400.0, 2)          #gain (rpm per lsb), offset (rpm), tau (ms), delay (updates)
+CHUNK_SIZE = 256                                #gain sets per process pool job
+
+
+# first_order_plant is the response of the pid input (eg. engine speed) to the pid output (eg. throttle)
+class first_order_plant:
+    # gain, offset: the input settles at gain*output + offset
+    # tau_ms:       time constant of the response
+    # delay:        pid updates between the output changing and the input starting to respond
+    def __init__(self, gain, offset, tau_ms, delay=0, update_ms=PID_UPDATE_INTERVAL_ms):
+        self.gain = gain
+        self.offset = offset
+        self.tau_ms = tau_ms
+        self.delay = int(delay)
+        self.update_ms = update_ms
+        self.alpha = 1 - np.exp(-update_ms/tau_ms)   #fraction of the way to the settled input moved each update
+
+    def __repr__(self):
+        return f"first_order_plant(gain={self.gain:.4g}, offset={self.offset:.4g}, tau_ms={self.tau_ms:.4g}, delay={self.delay})"
+
+    #run pids in closed loop with the plant
+    # pids:    pid_batch, one pid per run
+    # targets: target at each update
+    # start:   input at the start, None for the first target
+    #returns the input of every run at each update, (runs, updates)
+    def run(self, pids, targets, start=None):
+        inputs = np.empty((len(pids), len(targets)), np.float32)
+        speed = np.full(len(pids), float(targets[0] if start is None else start))
+        #outputs of the last delay+1 updates, oldest first - the pid starts with the plant settled at the start speed
+        settled = np.full(len(pids), (speed[0] - self.offset)/self.gain if self.gain else 0)
+        outputs = [settled]*(self.delay + 1)
+        for n, target in enumerate(targets):
+            inputs[:, n] = speed
+            outputs.append(pids.update(target, np.rint(speed)))
+            applied = outputs.pop(0)
+            speed = speed + self.alpha*(self.gain*applied + self.offset - speed)
+        return inputs
+
+
+#fit a first_order_plant to the output and input of a pid loop recorded in a log
+#only the updates where the pid was run are used, the delay is the one that fits best, up to max_delay updates
+def fit_plant(log, loop=0, max_delay=10):
+    pid = log.get_pid(loop)
+    if 'out' not in pid or 'act' not in pid:
+        raise ValueError(f"pid {loop} wasn't logged")
+    output = pid['out'].values
+    speed = pid['act'].values
+    update_ms = pid['act'].rate*1000 if pid['act'].rate else PID_UPDATE_INTERVAL_ms
+    run = pid_runs(speed) if loop == 0 else np.ones(len(speed), bool)
+
+    best = None
+    for delay in range(max_delay + 1):
+        #speed change over each update, from the speed and the output delay updates before
+        k = np.arange(delay, len(speed) - 1)
+        k = k[run[k] & run[k+1] & run[k-delay]]
+        if len(k) < 10:
+            continue
+        terms = np.column_stack([output[k-delay], speed[k], np.ones(len(k))])
+        coefs, residual = np.linalg.lstsq(terms, speed[k+1] - speed[k], rcond=None)[:2]
+        residual = residual[0] if len(residual) else np.inf
+        if best is None or residual < best[0]:
+            best = (residual, delay, coefs)
+    if best is None:
+        raise ValueError("not enough pid updates to fit a plant")
+    residual, delay, (a, b, c) = best
+    alpha = -b
+    if not 0 < alpha < 1:
+        raise ValueError(f"the fitted plant isn't stable (alpha {alpha:.3g})")
+    return first_order_plant(a/alpha, c/alpha, -update_ms/np.log(1 - alpha), delay, update_ms)
+
+
+#score closed loop runs
+# inputs:   input of each run at each update (runs, updates), targets: target at each update
+# band:     error within which the input has settled, min_step: smallest target change counted as a step
+#returns (settling time s, overshoot fraction, mean absolute error) of each run, each an array
+def score_runs(inputs, targets, update_ms, band, min_step):
+    targets = np.asarray(targets, np.float64)
+    err = inputs - targets
+    mean_error = np.mean(np.abs(err), axis=1)
+
+    steps = np.flatnonzero(np.abs(np.diff(targets)) >= min_step) + 1
+    ends = np.append(steps[1:], len(targets))
+    settling = np.zeros(len(inputs))
+    overshoot = np.zeros(len(inputs))
+    for start, end in zip(steps, ends):
+        size = targets[start] - targets[start-1]
+        segment = err[:, start:end]
+        overshoot += np.maximum(0, np.max(segment*np.sign(size), axis=1))/abs(size)
+        #settled after the last update outside the band, runs that end outside it never settled
+        outside = np.abs(segment) > band
+        last_outside = segment.shape[1] - np.argmax(outside[:, ::-1], axis=1)
+        settling += np.where(outside.any(axis=1), last_outside, 0) * update_ms/1000
+    if len(steps):
+        settling /= len(steps)
+        overshoot /= len(steps)
+    return settling, overshoot, mean_error
+
+
+#run and score a chunk of gain sets - this runs in a worker process
+#returns an array of (settling, overshoot, mean error) rows, one per gain set
+def run_chunk(gains, plant, targets, band, min_step):
+    inputs = plant.run(pid_batch(gains), targets)
+    return np.column_stack(score_runs(inputs, targets, plant.update_ms, band, min_step))
+
+
+#gain sets (fixed point) on a grid, each range is (start, stop, number) of float gains
+def grid_gains(kp, ki, kd):
+    axes = [np.linspace(start, stop, int(n)) for start, stop, n in (kp, ki, kd)]
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), -1).reshape(-1, 3)
+    return unique_gains(grid)
+
+#count gain sets (fixed point) drawn at random from the ranges, log uniform unless a range starts at 0
+def random_gains(kp, ki, kd, count, seed=None):
+    rng = np.random.default_rng(seed)
+    columns = []
+    for start, stop, n in (kp, ki, kd):
+        if start > 0 and stop > 0:
+            columns.append(np.exp(rng.uniform(np.log(start), np.log(stop), count)))
+        else:
+            columns.append(rng.uniform(start, stop, count))
+    return unique_gains(np.column_stack(columns))
+
+#float gains to fixed point, without repeats (close float gains can round to the same fixed point values)
+def unique_gains(gains):
+    fixed = np.array([[fl_to_fp(k) for k in row] for row in gains], np.int64).reshape(-1, 3)
+    return np.unique(fixed, axis=0)
+
+
+#run and score every gain set, in chunks over a process pool
+#processes: number of worker processes, None to use every core, 1 to run in this process
+#returns an array of (settling, overshoot, mean error) rows, in the order of gains
+def sweep(gains, plant, targets, band=50, min_step=100, processes=None, chunk_size=CHUNK_SIZE):
+    chunks = [gains[n:n+chunk_size] for n in range(0, len(gains), chunk_size)]
+    if processes == 1 or len(chunks) < 2:
+        results = [run_chunk(chunk, plant, targets, band, min_step) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(run_chunk, chunk, plant, targets, band, min_step) for chunk in chunks]
+            results = [future.result() for future in futures]
+    return np.concatenate(results) if results else np.zeros((0, 3))
+
+
+#the gain sets and their scores, best first
+#weights: of settling time (s), overshoot (fraction) and mean error, in the combined score
+def rank(gains, scores, weights):
+    combined = scores @ np.asarray(weights, np.float64)
+    order = np.argsort(combined, kind='stable')
+    return gains[order], scores[order], combined[order]
+
+
+def print_table(gains, scores, combined, top=20, units='rpm'):
+    print(f"{'rank':>4} {'kp':>7} {'ki':>7} {'kd':>7}   {'(fixed point)':<17} {'settle s':>8} {'over %':>7} {'err ' + units:>8} {'score':>8}")
+    for n in range(min(top, len(gains))):
+        kp, ki, kd = gains[n]
+        settling, overshoot, error = scores[n]
+        fixed = f"{kp},{ki},{kd}"
+        print(f"{n+1:>4} {kp/PID_FP_ONE:>7.3f} {ki/PID_FP_ONE:>7.3f} {kd/PID_FP_ONE:>7.3f}   {fixed:<17} "
+              f"{settling:>8.2f} {overshoot*100:>7.1f} {error:>8.1f} {combined[n]:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="search for the pid gains with the best closed loop response")
+    parser.add_argument('log', nargs='?', help="log to fit the plant to and take the target from")
+    parser.add_argument('--loop', type=int, default=0, help="pid loop of the log (default: 0, rpm)")
+    parser.add_argument('--kp', type=float, nargs=3, default=[0.05, 2.0, 12], metavar=('START', 'STOP', 'N'))
+    parser.add_argument('--ki', type=float, nargs=3, default=[0.0, 0.5, 12], metavar=('START', 'STOP', 'N'))
+    parser.add_argument('--kd', type=float, nargs=3, default=[0.0, 0.5, 6], metavar=('START', 'STOP', 'N'))
+    parser.add_argument('--random', type=int, metavar='N', help="N random gain sets from the ranges, rather than a grid")
+    parser.add_argument('--seed', type=int, help="random seed")
+    parser.add_argument('--plant', type=float, nargs=4, metavar=('GAIN', 'OFFSET', 'TAU_MS', 'DELAY'), help="plant model, rather than fitting one to the log")
+    parser.add_argument('--steps', type=float, nargs='+', metavar='TARGET', help="target steps, rather than the logged target")
+    parser.add_argument('--hold', type=float, default=5, help="seconds each target step is held (default: 5)")
+    parser.add_argument('--band', type=float, default=50, help="error within which the response has settled (default: 50)")
+    parser.add_argument('--min-step', type=float, default=100, help="smallest target change counted as a step (default: 100)")
+    parser.add_argument('--weights', type=float, nargs=3, default=[1, 1, 0.01], metavar=('SETTLE', 'OVERSHOOT', 'ERROR'))
+    parser.add_argument('--top', type=int, default=20, help="number of gain sets listed")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    log = None
+    if args.log:
+        if not os.path.isfile(args.log):
+            sys.exit(f"no such file: {args.log}")
+        log = log_file(args.log)
+    try:
+        if args.plant:
+            plant = first_order_plant(*args.plant)
+        elif log is not None:
+            plant = fit_plant(log, args.loop)
+        else:
+            plant = first_order_plant(*DEFAULT_PLANT)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(plant)
+
+    if args.steps or log is None:
+        steps = args.steps or DEFAULT_STEPS
+        targets = np.repeat(steps, int(args.hold*1000/plant.update_ms)).astype(np.int64)
+    else:
+        trg = log.get_pid(args.loop).get('trg')
+        if trg is None:
+            sys.exit(f"pid {args.loop} has no logged target, give --steps")
+        targets = trg.raw.astype(np.int64)
+
+    if args.random:
+        gains = random_gains(args.kp, args.ki, args.kd, args.random, args.seed)
+    else:
+        gains = grid_gains(args.kp, args.ki, args.kd)
+    print(f"{len(gains)} gain sets, {len(targets)} updates ({len(targets)*plant.update_ms/1000:.0f} s) each")
+
+    start = time.perf_counter()
+    scores = sweep(gains, plant, targets, args.band, args.min_step, args.processes)
+    elapsed = time.perf_counter() - start
+    print(f"done in {elapsed:.1f} s, {len(gains)*len(targets)/elapsed/1e6:.1f} M updates/s")
+    print_table(*rank(gains, scores, args.weights), args.top)
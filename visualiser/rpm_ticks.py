@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Reconstruction of rpm counter tick times.
+
+The rpm counter logs the interval between each tacho tick (spd)
+and the time from the record timestamp to the first tick of the record (spd_t0).
+The time of each tick is found by adding up the intervals from the first tick of each record.
+
+This is done for every record of the log at once, once the log has been read,
+rather than record by record while parsing.
+Only records with a bad spd_t0 depend on the record before, and only those are handled one at a time.
+
+tick_series holds the ticks as events (the time of each tick and the interval that ended at it),
+so its size depends on the number of ticks, not the length of the log.
+A continuous rpm trace (step or interpolated) is only generated for the time window being drawn.
+
+@author: AlexT-38
+"""
+
+import numpy as np
+
+from decimate import lod_pyramid
+
+
+#reconstruct the time of every tick
+# intervals:       tick intervals (ms) of every record that logged ticks, concatenated
+# counts:          number of intervals in each record
+# offsets:         spd_t0 (ms) of each record, negative if it wasn't logged
+# record_times:    timestamp (ms) of each record
+# record_interval: time between records (ms)
+#returns the intervals with any invalid (<=0) values removed,
+# the time (ms) of each tick, and the index (into counts) of the record each tick came from
+def reconstruct_ticks(intervals, counts, offsets, record_times, record_interval, verbose=False):
+    intervals = np.asarray(intervals, np.float64)
+    counts = np.asarray(counts, np.int64)
+    offsets = np.asarray(offsets, np.float64)
+    record_times = np.asarray(record_times, np.float64)
+    records = np.repeat(np.arange(len(counts)), counts)
+
+    #ignore any values less than 1 - not sure why there would be, as the src is uint, but good to catch data errors
+    valid = intervals > 0
+    if not valid.all():
+        print("some ticks ignored:", np.flatnonzero(~valid), ":", intervals[~valid])
+        intervals = intervals[valid]
+        records = records[valid]
+        counts = np.bincount(records, minlength=len(counts))
+
+    if len(intervals) == 0:
+        return intervals, np.zeros(0), np.zeros(0, np.int64)
+
+    #everything from here is per record that has ticks
+    tick_records = np.flatnonzero(counts)
+    n = counts[tick_records]
+    first = np.cumsum(n) - n            #index of the first tick of each record
+    last = first + n - 1
+    t_now = record_times[tick_records]
+    t_next = t_now + record_interval
+    offset = offsets[tick_records]
+    initial = intervals[first]          #the first interval of each record
+
+    #time of each tick from the first tick of its record
+    total = np.cumsum(intervals)
+    relative = total - np.repeat(total[first], n)
+    span = relative[last]
+
+    #the offset is from the record timestamp to the first tick
+    #without a valid offset, assume the first interval started at the record timestamp
+    valid_offset = (offset >= 0) & (offset < record_interval)
+    start = np.where(valid_offset, t_now + offset, t_now + initial)
+
+    #if the last tick is after the end of the record then the offset was to the start of the first interval,
+    #so shift the ticks back by that interval
+    def shift(start):
+        return np.where(start + span > t_next, initial, 0)
+    shifts = shift(start)
+
+    #without a valid offset, the first interval most likely started at the last tick of the previous record
+    #(if that puts it within this record) - this depends on the previous record, so is done one record at a time
+    for r in np.flatnonzero(~valid_offset[1:]) + 1:
+        guess = start[r-1] + span[r-1] - shifts[r-1] + initial[r]
+        if guess >= t_now[r] and guess < t_next[r]:
+            start[r] = guess
+            shifts[r] = shift(start)[r]
+
+    if not valid_offset.all():
+        print("tick offset is outside the record interval in", np.count_nonzero(~valid_offset), "records",
+              "(greater:", np.count_nonzero(offset >= record_interval), "negative:", np.count_nonzero(offset < 0), ")")
+        if not valid_offset[0]:
+            print("no previous times recorded for the first record with ticks")
+    if verbose and shifts.any():
+        print("last tick time is after end of record in", np.count_nonzero(shifts), "records; shifted ticks to start of record")
+
+    tick_times = relative + np.repeat(start - shifts, n)
+    return intervals, tick_times, records
+
+
+#indices of ticks that are earlier than the tick before them
+def non_monotonic_ticks(tick_times):
+    tick_times = np.asarray(tick_times)
+    return np.flatnonzero(tick_times[1:] < tick_times[:-1]) + 1
+
+
+#indices of ticks that are after the end of the record they came from
+# tick_records: record index of each tick, record_times: timestamp (ms) of each record
+def late_ticks(tick_times, tick_records, record_times, record_interval):
+    record_times = np.asarray(record_times)
+    return np.flatnonzero(np.asarray(tick_times) > record_times[tick_records] + record_interval)
+
+
+#reconstruct the time of every tick of a v3 log
+#v3 logs differ from v4 in that:
+# the first interval of the log is ignored (there was no tick before it), the time of the first tick is the offset plus the next interval
+# the offset (RPM tick offset) is valid if it is positive, there is no upper limit
+# without a valid offset, the first interval is from the last tick of the previous record
+#arguments and return values are as reconstruct_ticks
+def reconstruct_v3_ticks(intervals, counts, offsets, record_times):
+    intervals = np.asarray(intervals, np.float64)
+    counts = np.asarray(counts, np.int64)
+    offsets = np.asarray(offsets, np.float64)
+    record_times = np.asarray(record_times, np.float64)
+    records = np.repeat(np.arange(len(counts)), counts)
+    keep = np.ones(len(intervals), bool)
+
+    #ignore the first interval of the log, and of any record before it that doesn't have another interval
+    first = np.cumsum(counts) - counts
+    for r in np.flatnonzero(counts):
+        keep[first[r]] = False
+        print("first tick")
+        if np.any(intervals[first[r]+1:first[r]+counts[r]] > 0):
+            break
+
+    #also ignore any values less than 1
+    if np.any(intervals[keep] <= 0):
+        bad = keep & (intervals <= 0)
+        print("some ticks ignored:", np.flatnonzero(bad), ":", intervals[bad])
+        keep &= intervals > 0
+    intervals = intervals[keep]
+    records = records[keep]
+    if len(intervals) == 0:
+        return intervals, np.zeros(0), np.zeros(0, np.int64)
+    counts = np.bincount(records, minlength=len(counts))
+
+    tick_records = np.flatnonzero(counts)
+    n = counts[tick_records]
+    first = np.cumsum(n) - n
+    t_now = record_times[tick_records]
+    offset = offsets[tick_records]
+    initial = intervals[first]
+
+    total = np.cumsum(intervals)
+    relative = total - np.repeat(total[first], n)
+    span = relative[np.cumsum(n) - 1]
+
+    valid_offset = offset >= 0
+    start = t_now + offset
+    #the offset of the first record with one is to the ignored tick, so the first tick is the next interval later
+    if valid_offset.any():
+        r = np.argmax(valid_offset)
+        start[r] += initial[r]
+
+    #without an offset, follow on from the previous tick - one record at a time, as it depends on the record before
+    if not valid_offset.all():
+        print("tick times, but no tick offset in", np.count_nonzero(~valid_offset), "records")
+        if not valid_offset[0]:
+            print("also no previous times recorded")
+            start[0] = t_now[0]
+        for r in np.flatnonzero(~valid_offset[1:]) + 1:
+            start[r] = start[r-1] + span[r-1] + initial[r]
+
+    return intervals, relative + np.repeat(start, n), records
+
+
+# tick_series is the engine speed at each rpm counter tick, as a series of events
+# the interval at each tick is the time since the tick before, so the rpm from an interval
+# holds from the tick before up to the tick it was logged at
+class tick_series:
+
+    # times:     time (s) of each tick
+    # intervals: interval (ms) that ended at each tick
+    #ticks that are out of order (see non_monotonic_ticks) are sorted into time order
+    def __init__(self, times, intervals):
+        times = np.asarray(times)
+        intervals = np.asarray(intervals)
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind='stable')
+            times, intervals = times[order], intervals[order]
+        self.times = times
+        self.intervals = intervals
+        self._lod = None
+
+    def __len__(self):
+        return len(self.times)
+
+    #index range of the ticks with t0 <= time < t1 (None for the start/end)
+    def index_range(self, t0=None, t1=None):
+        start = 0 if t0 is None else int(np.searchsorted(self.times, t0, 'left'))
+        stop = len(self.times) if t1 is None else int(np.searchsorted(self.times, t1, 'left'))
+        return start, max(start, stop)
+
+    #the ticks with t0 <= time < t1, as tick times and rpm
+    def window(self, t0=None, t1=None):
+        start, stop = self.index_range(t0, t1)
+        return self.times[start:stop], 60000/self.intervals[start:stop]
+
+    #rpm at points evenly spaced times from t0 to t1
+    # mode 'step':   the rpm of the interval each time falls in
+    # mode 'interp': interpolated between the rpm at each tick
+    #times that don't fall within any interval (before the first tick, or a gap in the ticks
+    #longer than the next interval, eg. the engine stopped or records are missing) are nan
+    #returns the times and the rpm at each
+    def view(self, t0, t1, points=2000, mode='step'):
+        times = np.linspace(t0, t1, max(int(points), 2))
+        rpm = np.full(len(times), np.nan)
+        if len(self.times) == 0:
+            return times, rpm
+        #the tick at or after each time, which ends the interval the time falls in
+        next_tick = np.searchsorted(self.times, times, 'left')
+        inside = next_tick < len(self.times)
+        tick = np.minimum(next_tick, len(self.times) - 1)
+        inside &= times >= self.times[tick] - self.intervals[tick]/1000
+        if mode == 'step':
+            rpm[inside] = 60000/self.intervals[tick[inside]]
+        elif mode == 'interp':
+            #only the ticks around the window are needed
+            start, stop = self.index_range(t0, t1)
+            start, stop = max(0, start-1), min(len(self.times), stop+1)
+            rpm[inside] = np.interp(times[inside], self.times[start:stop], 60000/self.intervals[start:stop])
+        else:
+            raise ValueError(f"unknown mode '{mode}'")
+        return times, rpm
+
+    #the rpm between t0 and t1, reduced to about points samples, for plotting
+    #as a step view where there are fewer ticks in the window than points,
+    #otherwise the min and max rpm of groups of ticks (see decimate)
+    def get(self, t0=None, t1=None, points=2000):
+        start, stop = self.index_range(t0, t1)
+        if stop - start > points or len(self.times) == 0:
+            if self._lod is None:
+                self._lod = lod_pyramid(self.times, 60000/self.intervals)
+            return self._lod.get(t0, t1, points)
+        t0 = self.times[0] if t0 is None else t0
+        t1 = self.times[-1] if t1 is None else t1
+        return self.view(t0, t1, points, 'step')
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Reader for version 3 (text) log files.
+
+A v3 log is a date/time line, a 'Record Ver.' line, then records of 'PARAM: values' lines between
+'----------' markers. Each record starts with the record averages, followed by 'ANA no.' and the samples,
+so the same parameter (eg. '0 USR') is an average before 'ANA no.' and a list of samples after it.
+
+The whole file is read and split into lines at once, each line is looked up in a table of known parameters,
+and its value text is put aside, unparsed, with the number of the record it came from.
+The values of each parameter are then converted to numbers in one go, once the file has been read.
+
+@author: AlexT-38
+"""
+
+import numpy as np
+
+
+RECORD_MARKER = "----------"
+
+#kinds of parameter
+SENSOR = 0      #an average before 'ANA no.', samples after it
+SAMPLES = 1     #always samples
+AVERAGE = 2     #always an average
+RECORD = 3      #a single value per record
+ANA_NO = 4      #'ANA no.', marks the start of the samples
+VERSION = 5     #'Record Ver.'
+
+MAX_SENSORS = 10    #sensor numbers are a single digit
+
+#parameter name : (kind, channel name, channel index)
+KEYS = {}
+for index in range(MAX_SENSORS):
+    for name in ['usr', 'map', 'tmp']:
+        KEYS[f"{index} {name.upper()}"] = (SENSOR, name, index)
+    KEYS[f"{index} EGT"] = (SAMPLES, 'egt', index)
+    KEYS[f"{index} EGT avg"] = (AVERAGE, 'egt', index)
+KEYS.update({
+    "TRQ"                   : (SENSOR, 'trq', 0),
+    "RPM avg"               : (AVERAGE, 'rpm', 0),
+    "POW"                   : (AVERAGE, 'pow', 0),
+    "RPM times (ms)"        : (SAMPLES, 'spd', 0),
+    "RPM no."               : (RECORD, 'rpm_no', 0),
+    "RPM tick offset (ms)"  : (RECORD, 'rpm_offset', 0),
+    "ANA no."               : (ANA_NO, None, 0),
+    "Record Ver."           : (VERSION, None, 0),
+})
+
+
+#the value text of one parameter, collected from every record
+class v3_field:
+    __slots__ = ('text', 'records')
+
+    def __init__(self):
+        self.text = []
+        self.records = []
+
+    #convert the collected text to values
+    #returns the values, the record number of each line and the number of values on each line
+    def values(self):
+        counts = np.array([text.count(',')+1 for text in self.text], np.int64)
+        try:
+            values = np.array(",".join(self.text).split(","), np.float64)
+        except ValueError:
+            #a corrupt line - parse line by line, dropping anything that isn't a number
+            lines = [np.fromstring(text, dtype=np.float64, sep=',') for text in self.text]
+            counts = np.array([len(line) for line in lines], np.int64)
+            values = np.concatenate(lines) if lines else np.zeros(0)
+        return values, np.array(self.records, np.int64), counts
+
+
+class v3_reader:
+
+    # file: log file, opened in text mode
+    # echo: print each line as it is read
+    def __init__(self, file, echo=False, verbose=False):
+        self.date = None
+        self.time = None
+        self.version = None
+        self.no_of_records = 0
+        self.samples = {}       #(name, index) : v3_field
+        self.averages = {}      #(name, index) : v3_field
+        self.record_values = {} #name : {record number : value}
+        self.read(file, echo, verbose)
+
+    def read(self, file, echo, verbose):
+        read_avg = True
+        record = -1
+        samples = self.samples
+        averages = self.averages
+        record_values = self.record_values
+
+        for line_no, line in enumerate(file.read().splitlines()):
+            line = line.strip()
+            if echo: print(f"{line_no}, {record}: {line}")
+            if not line:
+                continue
+
+            #record marker, starts a record unless it ends the samples of the one before
+            if line == RECORD_MARKER:
+                if read_avg:
+                    record += 1
+                else:
+                    read_avg = True
+                continue
+
+            param, sep, value = line.partition(": ")
+
+            #a line that isn't 'PARAM: value' is probably the opening date stamp
+            if not sep:
+                date_time = line.split(',')
+                if len(date_time) == 2:
+                    if self.date is None and date_time[0]:
+                        self.date = date_time[0]
+                        print("File start date: ", self.date)
+                    if self.time is None and date_time[1]:
+                        self.time = date_time[1]
+                        print("File start time: ", self.time)
+                continue
+
+            key = KEYS.get(param)
+            if key is None:
+                if verbose: print("unknown parameter:", param)
+                continue
+            kind, name, index = key
+
+            if kind == VERSION:
+                if self.version is None:
+                    self.version = int(value)
+                    print("Record Version:", self.version)
+                continue
+            #anything else needs to be in a record
+            if record < 0:
+                continue
+            if kind == ANA_NO:
+                #we are now parsing samples, not averages
+                read_avg = False #this is dumb, but there are errors in the record format, and this is how I'm getting around it.
+                continue
+            if kind == RECORD:
+                record_values.setdefault(name, {})[record] = float(value)
+                continue
+
+            group = averages if kind == AVERAGE or (kind == SENSOR and read_avg) else samples
+            field = group.get((name, index))
+            if field is None:
+                field = group[(name, index)] = v3_field()
+            field.text.append(value)
+            field.records.append(record)
+
+        self.no_of_records = record + 1
+
+    #an array of a per record value for every record, missing values are set to default
+    def record_array(self, name, default=0):
+        array = np.full(self.no_of_records, default, np.float64)
+        values = self.record_values.get(name, {})
+        if values:
+            array[list(values.keys())] = list(values.values())
+        return array
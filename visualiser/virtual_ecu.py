@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+OpenGEET ECU Log File Visiualiser
+Virtual ECU - a stand in for the controller, streaming a live log of a simulated engine.
+
+The engine is engine_model's engine_batch (one engine), with its throttle set by the firmware's rpm pid
+(pid_replay.pid_batch, in rpm mode, with the firmware's default gains unless given), which is fed from the engine's
+tacho ticks averaged over each pid update as get_rpm_for_pid does. The target comes from the first knob (usr 0),
+mapped to rpm with amap as process_pid_loop does, and the knob is turned to a new position every so often.
+The other servos follow their knobs, as they do on the controller.
+
+The sensors the engine model doesn't have are rough: the torque is what the load (the shaft drag) absorbs,
+the manifold pressure falls with the throttle closed and dips on each intake stroke, and the egt follows the throttle.
+
+Records are laid out exactly as the firmware writes them (start_log and write_record in records.ino, see log_generator),
+one at a time, at the record rate times --speed (eg. 10 for ten times as fast as the controller), or as fast as the
+engine can be simulated with --speed 0, to:
+    a pty (the default), which live_view.py can read as if it were the controller's serial port
+    a tcp socket (--port), which live_view.py can read as host:port
+    a file or stdout (--out, - for stdout)
+
+eg. to load test the live viewer:
+    python virtual_ecu.py --speed 10
+    python live_view.py /dev/pts/N
+
+usage: python virtual_ecu.py [--port N | --out FILE] [--speed X] [--records N] [--gains KP KI KD] [--seed N] [--config NAME=VALUE ...]
+
+@author: AlexT-38
+"""
+
+import os
+import sys
+import time
+import argparse
+import datetime
+import numpy as np
+
+from binary_records import firmware_config
+from log_generator import log_header, format_header, format_record, format_footer, record_averages, parse_config, \
+    START_ms, RPM_MIN_SET_rpm, RPM_MAX_SET_rpm
+from engine_model import engine_batch, rpm_to_rads, SIM_RATE_Hz, INTAKE_STROKE
+from pid_replay import pid_batch, PID_DEFAULT_GAINS, PID_DEFAULT_THROTTLE, PID_OUTPUT_MAX, TICK_us, OVF_LIMIT, OVERFLOW_ms
+
+
+#amap (map.ino), a 10 bit input to a range
+def amap(x, out_min, out_max):
+    return ((x*(out_max - out_min) + (1 << 9)) >> 10) + out_min
+
+
+# virtual_ecu runs the engine and the rpm pid, a record at a time
+class virtual_ecu:
+
+    start_rpm = 1500            #the engine has been started when logging starts
+    knob_max = 700              #highest target knob position (about 3400 rpm, near full throttle)
+    knob_interval_ms = 20000    #mean time between turns of the target knob
+    egt_tau_ms = 3000           #egt time constant
+
+    # config:   firmware build overrides (see binary_records.FIRMWARE_CONFIG)
+    # gains:    rpm pid gains (kp, ki, kd), fixed point
+    # sim_rate: engine simulation steps per second
+    def __init__(self, config=None, gains=PID_DEFAULT_GAINS, seed=0, sim_rate=SIM_RATE_Hz):
+        self.config = firmware_config(**(config or {}))
+        self.gains = tuple(gains)
+        self.rng = np.random.default_rng(seed)
+        now = datetime.datetime.now()
+        self.header = log_header(self.config, now.strftime("%Y/%m/%d"), now.strftime("%H:%M:%S"), (self.gains, (0, 0, 0)))
+
+        self.engine = engine_batch(1, sim_rate, speed_rpm=self.start_rpm, throttle=PID_DEFAULT_THROTTLE/PID_OUTPUT_MAX)
+        self.pid = pid_batch([self.gains])
+        sample_ms = self.config['ADC_SAMPLE_INTERVAL_ms']
+        self.steps_per_sample = max(1, round(sample_ms*sim_rate/1000))
+        self.sample_ms = self.steps_per_sample*1000/sim_rate     #the engine is stepped a fast adc sample at a time
+
+        #knob positions, the target and the servos that follow the knobs
+        self.knobs = [int(self.rng.integers(0, self.knob_max)), 512, 0, 0] + [0]*(self.config['NO_OF_USER_INPUTS'] + self.config['NO_OF_SERVOS'])
+        self.records = 0
+        self.egt = 20.0
+
+        #get_rpm_for_pid
+        self.ticks_tk = []          #intervals of the ticks since the last pid update
+        self.feedback = 0
+        self.missed = 0             #pid updates since the last one with a tick
+        self.last_tick_ms = START_ms
+        self.last_tk = round(START_ms*1000/TICK_us)  #the engine starts at top dead centre
+
+    #the pid input, from the ticks since the last update, as get_rpm_for_pid works it out
+    def pid_feedback(self, now_ms):
+        count = len(self.ticks_tk) & 0xff
+        total = sum(self.ticks_tk) & 0xffff
+        self.ticks_tk = []
+        if total:
+            self.feedback = (((60000000//TICK_us)*count)//total) & 0xffff
+            self.missed = 0
+            return self.feedback
+        #without a tick, the first update keeps the last value, later ones estimate it from the updates missed,
+        #and once the rpm counter timer has overflowed OVF_LIMIT times the engine is taken to have stopped
+        self.missed += 1
+        if now_ms - self.last_tick_ms >= OVF_LIMIT*OVERFLOW_ms:
+            return 0
+        if self.missed > 1:
+            return 60000//(self.config['UPDATE_INTERVAL_ms']*self.missed)
+        return self.feedback
+
+    #step the engine over one fast adc sample, keeping the time and interval of its ticks in counter ticks
+    def run_sample(self, ticks, intervals):
+        for tick_time in self.engine.advance(self.steps_per_sample):
+            tick_ms = START_ms + tick_time*1000
+            tick_tk = round(tick_ms*1000/TICK_us)
+            self.ticks_tk.append(tick_tk - self.last_tk)
+            ticks.append(tick_tk)
+            intervals.append(tick_tk - self.last_tk)
+            self.last_tk = tick_tk
+            self.last_tick_ms = tick_ms
+
+    #the next record, as a dict with the fields of a v4 record, in the order write_record writes them
+    def next_record(self):
+        config = self.config
+        rng = self.rng
+        interval = config['UPDATE_INTERVAL_ms']
+        timestamp = START_ms + self.records*interval
+        self.records += 1
+        if rng.random() < interval/self.knob_interval_ms:
+            self.knobs[0] = int(rng.integers(0, self.knob_max))
+
+        loops = config['PID_LOOPS_PER_UPDATE']
+        pid_every = max(1, round(config['PID_UPDATE_INTERVAL_ms']/self.sample_ms))
+        analog_every = max(1, round(config['ANALOG_SAMPLE_INTERVAL_ms']/self.sample_ms))
+        egt_every = max(1, round(config['EGT_SAMPLE_INTERVAL_ms']/self.sample_ms))
+        fields = ['trg', 'act', 'err', 'out', 'p', 'i', 'd']
+        pid = {name: [] for name in fields}
+        srv, usr, trq, map_, egt = [], [], [], [], []
+        ticks, intervals = [], []
+        drag = self.engine.drag[0]
+        for k in range(config['NO_OF_ADC_FAST_PER_RECORD']):
+            now_ms = timestamp + k*self.sample_ms
+            throttle = self.engine.throttle[0]
+            speed = self.engine.speed[0]
+            if k % pid_every == 0 and len(srv) < loops:
+                target = amap(self.knobs[0], RPM_MIN_SET_rpm, RPM_MAX_SET_rpm)
+                output = int(self.pid.update(target, self.pid_feedback(now_ms))[0])
+                self.engine.set_throttle(output/PID_OUTPUT_MAX)
+                srv.append([output] + self.knobs[1:config['NO_OF_SERVOS']])
+                for name, value in zip(fields, [target, self.pid.actual[0], self.pid.err[0], self.pid.output[0],
+                                                 self.pid.p[0], self.pid.i[0], self.pid.d[0]]):
+                    pid[name].append(int(value))
+            if k % analog_every == 0:
+                knob = int(np.clip(self.knobs[0] + rng.integers(-1, 2), 0, 1023))
+                usr.append([knob] + self.knobs[1:config['NO_OF_USER_INPUTS']])
+                trq.append(round(drag*speed*1000 + rng.normal(0, 20)))
+            if k % egt_every == 0:
+                egt.append(round((self.egt + rng.normal(0, 2))*4))
+            stroke_dip = 30 if self.engine.stroke[0] == INTAKE_STROKE else 0
+            map_.append(round(1013 - 700*(1 - throttle)*min(speed/rpm_to_rads(3000), 1) - stroke_dip + rng.normal(0, 2)))
+            self.egt += ((150 + 500*throttle + speed/5) - self.egt)*self.sample_ms/self.egt_tau_ms
+            self.run_sample(ticks, intervals)
+
+        record = {'timestamp': timestamp}
+        if config['NO_OF_USER_INPUTS'] > 0:
+            record['usr'] = np.array(usr).T.tolist()
+        if config['NO_OF_MAP_SENSORS'] > 0:
+            record['map'] = [map_]*config['NO_OF_MAP_SENSORS']
+        if config['NO_OF_TMP_SENSORS'] > 0:
+            record['tmp'] = np.round((30 + rng.normal(0, 0.5, (config['NO_OF_TMP_SENSORS'], len(trq))))*4).astype(np.int64).tolist()
+        if config['NO_OF_EGT_SENSORS'] > 0:
+            record['egt'] = [egt]*config['NO_OF_EGT_SENSORS']
+        record['trq'] = trq
+        #the interval of the first tick is from the tick before it, which may have been in an earlier record
+        record['spd_t0'] = ticks[0] - round(timestamp*1000/TICK_us) if ticks else 0
+        record['spd'] = intervals[:config['RPM_MAX_TICKS_PER_UPDATE']]
+        if config['NO_OF_SERVOS'] > 0:
+            record['srv'] = np.array(srv).T.tolist()
+        if config['NO_OF_PIDS'] > 0:
+            zeros = [0]*loops
+            record['pid'] = [pid] + [{name: zeros for name in fields} for n in range(1, config['NO_OF_PIDS'])]
+        record['avg'] = record_averages(record, config, (self.gains, (0, 0, 0)))
+        return record
+
+
+# stream a virtual ecu's log to a file like object (anything with write(bytes) and flush())
+# speed:   records are written at the record rate times speed, 0 for as fast as they can be made
+# records: number of records, None to run until stopped
+#returns (records written, seconds taken)
+def stream(ecu, out, speed=1.0, records=None):
+    interval_s = ecu.config['UPDATE_INTERVAL_ms']/1000
+    out.write(format_header(ecu.header).encode())
+    out.flush()
+    start = time.perf_counter()
+    written = 0
+    try:
+        while records is None or written < records:
+            record = ecu.next_record()
+            if speed > 0:
+                #sleep until the record is due, a record interval after the one before, rather than after the last write
+                wait = start + (written + 1)*interval_s/speed - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            out.write(format_record(record, written == 0).encode())
+            out.flush()
+            written += 1
+            if written % 100 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{written} records, {written*interval_s/elapsed:.1f} x real time, {ecu.engine.rpm[0]:.0f} rpm", file=sys.stderr)
+        out.write(format_footer().encode())
+        out.flush()
+    except KeyboardInterrupt:
+        pass
+    return written, time.perf_counter() - start
+
+
+# a pty, written to as the controller's serial port would be
+class pty_out:
+    def __init__(self):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)      #no echo, and no line editing of the json
+        self.name = os.ttyname(self.slave)
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.master, data):]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+# a tcp server with one client, which is waited for before anything is sent
+class socket_out:
+    def __init__(self, port, host=''):
+        import socket
+        self.server = socket.create_server((host, port))
+        print(f"waiting for a connection on port {port}", file=sys.stderr)
+        self.client, address = self.server.accept()
+        print(f"connected to {address[0]}:{address[1]}", file=sys.stderr)
+
+    def write(self, data):
+        self.client.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.client.close()
+        self.server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stream a live log of a simulated engine, as the controller would")
+    parser.add_argument('--port', type=int, help="serve the log on this tcp port, rather than a pty")
+    parser.add_argument('--out', help="write the log to a file (- for stdout), rather than a pty")
+    parser.add_argument('--speed', type=float, default=1, help="times the controller's record rate, 0 for as fast as it can")
+    parser.add_argument('--records', type=int, help="number of records, rather than until stopped")
+    parser.add_argument('--gains', type=int, nargs=3, default=PID_DEFAULT_GAINS, metavar=('KP', 'KI', 'KD'),
+                        help="rpm pid gains, fixed point")
+    parser.add_argument('--sim-rate', type=float, default=SIM_RATE_Hz, help="engine simulation steps per second")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', nargs='*', metavar='NAME=VALUE', help="firmware build settings, see binary_records.FIRMWARE_CONFIG")
+    args = parser.parse_args()
+    try:
+        ecu = virtual_ecu(parse_config(args.config), args.gains, args.seed, args.sim_rate)
+    except (ValueError, KeyError) as e:
+        sys.exit(str(e))
+
+    if args.out == '-':
+        out = sys.stdout.buffer
+    elif args.out:
+        out = open(args.out, 'wb')
+    elif args.port:
+        out = socket_out(args.port)
+    else:
+        out = pty_out()
+        print(f"streaming on {out.name}", file=sys.stderr)
+    try:
+        written, elapsed = stream(ecu, out, args.speed, args.records)
+    except (BrokenPipeError, ConnectionResetError):
+        print("the reader went away", file=sys.stderr)
+        written, elapsed = ecu.records, None
+    if elapsed:
+        interval_s = ecu.config['UPDATE_INTERVAL_ms']/1000
+        print(f"{written} records in {elapsed:.1f} s, {written*interval_s/elapsed:.1f} x real time", file=sys.stderr)
+    if out is not sys.stdout.buffer:
+        out.close()